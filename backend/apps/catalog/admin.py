@@ -0,0 +1,27 @@
+"""
+Admin interface for catalog models.
+"""
+from django.contrib import admin
+from .models import Vendor, Product, FacetCount
+
+
+@admin.register(Vendor)
+class VendorAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'website', 'is_active', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('name',)
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'vendor', 'sku', 'category', 'price', 'in_stock', 'is_active')
+    list_filter = ('is_active', 'in_stock', 'category')
+    search_fields = ('name', 'sku')
+    raw_id_fields = ('vendor',)
+    readonly_fields = ('model_metadata', 'created_at', 'updated_at')
+
+
+@admin.register(FacetCount)
+class FacetCountAdmin(admin.ModelAdmin):
+    list_display = ('facet', 'value', 'count')
+    list_filter = ('facet',)
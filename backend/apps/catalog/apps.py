@@ -0,0 +1,14 @@
+"""
+App configuration for the furniture catalog.
+"""
+from django.apps import AppConfig
+
+
+class CatalogConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.catalog'
+    label = 'catalog'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,270 @@
+"""
+Facet counts for catalog search.
+
+Facets: category, vendor (by id), and price, width, depth and height
+buckets. A bucket is named by its bounds, e.g. price '250-500' means
+250 <= price < 500 and '2500+' has no upper bound; the same ranges are
+accepted as search filters (min_price, max_price, ...).
+
+Counts for the whole catalog and for each single category (the common
+browsing entry points) are precomputed in FacetCount and changed by
+deltas as products are saved or deleted (signals.py): apply() adds a
+Counter of {(scope, facet, value): change} and invalidates the cached
+counts of the scopes it touched. Writes that bypass signals
+(bulk_create, bulk_update, update()) must apply their own deltas;
+`manage.py rebuild_facets` recounts everything.
+
+Counts for any other search (text, several filters) are grouped from the
+products it pages through (search.results) and cached per query for
+CATALOG_SEARCH_CACHE_TTL seconds.
+"""
+import hashlib
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import FACET_FIELDS, FacetCount, Product, Vendor
+from .search import digest
+
+PRICE_BUCKETS = (0, 100, 250, 500, 1000, 2500)
+SIZE_BUCKETS = (0, 50, 100, 150, 200, 300)  # Centimetres
+# facet -> bucket edges, for the facets counted by range
+BUCKETED = {
+    'price': PRICE_BUCKETS,
+    'width': SIZE_BUCKETS,
+    'depth': SIZE_BUCKETS,
+    'height': SIZE_BUCKETS,
+}
+FACETS = ('category', 'vendor', *BUCKETED)
+CATALOG = ''
+_CACHE_KEY = 'catalog-facets'
+
+
+def _format(edge):
+    return f'{edge:g}'
+
+
+@lru_cache(maxsize=None)
+def ranges(edges):
+    """(label, low, high) per bucket; high is None for the last one."""
+    bounds = list(edges) + [None]
+    return tuple([
+        (f'{_format(low)}-{_format(high)}' if high is not None else f'{_format(low)}+', low, high)
+        for low, high in zip(bounds, bounds[1:])
+    ])
+
+
+def bucket(value, edges):
+    """The label of the bucket holding `value`, or None."""
+    if value is None:
+        return None
+    value = float(value)
+    if value < edges[0]:
+        return None
+    for label, low, high in ranges(edges):
+        if high is None or value < high:
+            return label
+
+
+def category_scope(category):
+    return f'category:{category}'
+
+
+def precomputed_scope(params):
+    """The FacetCount scope holding a search's counts, or None if they must be grouped."""
+    filters = {name for name in params if name != 'sort'}
+    if not filters:
+        return CATALOG
+    if filters == {'category'} and len(params['category']) == 1:
+        return category_scope(params['category'][0])
+    return None
+
+
+def values_of(fields):
+    """
+    The (scope, facet, value) keys a product counts towards, given its
+    FACET_FIELDS values; none for an inactive product.
+    """
+    if not fields or not fields['is_active']:
+        return set()
+    facets = {('vendor', str(fields['vendor_id']))}
+    for facet, edges in BUCKETED.items():
+        label = bucket(fields[facet], edges)
+        if label is not None:
+            facets.add((facet, label))
+    scope = category_scope(fields['category'])
+    return (
+        {(CATALOG, 'category', fields['category'])}
+        | {(CATALOG, facet, value) for facet, value in facets}
+        | {(scope, facet, value) for facet, value in facets}
+    )
+
+
+def snapshot(product):
+    return {field: getattr(product, field) for field in FACET_FIELDS}
+
+
+def deltas(before, after):
+    """Counter of count changes when a product goes from `before` to `after` (FACET_FIELDS dicts or None)."""
+    change = Counter()
+    old, new = values_of(before), values_of(after)
+    for key in new - old:
+        change[key] += 1
+    for key in old - new:
+        change[key] -= 1
+    return change
+
+
+def apply(change):
+    """Add a Counter of {(scope, facet, value): change} to the precomputed counts."""
+    change = {key: amount for key, amount in change.items() if amount}
+    if not change:
+        return
+    with transaction.atomic():
+        FacetCount.objects.bulk_create(
+            [FacetCount(scope=scope, facet=facet, value=value) for scope, facet, value in change],
+            ignore_conflicts=True,
+        )
+        # Sorted so concurrent writers lock rows in the same order
+        for (scope, facet, value), amount in sorted(change.items()):
+            FacetCount.objects.filter(scope=scope, facet=facet, value=value).update(count=F('count') + amount)
+        scopes = {scope for scope, _, _ in change}
+        transaction.on_commit(lambda: invalidate(scopes))
+
+
+def _scope_key(scope):
+    return f'{_CACHE_KEY}:scope:{hashlib.sha256(scope.encode()).hexdigest()[:32]}'
+
+
+def invalidate(scopes=(CATALOG,)):
+    cache.delete_many([_scope_key(scope) for scope in scopes])
+
+
+def _bucket_aggregates():
+    """Conditional counts for every bucket, as (aggregates, {alias: (facet, label)})."""
+    aggregates, labels = {}, {}
+    for facet, edges in BUCKETED.items():
+        for index, (label, low, high) in enumerate(ranges(edges)):
+            condition = Q(**{f'{facet}__gte': low})
+            if high is not None:
+                condition &= Q(**{f'{facet}__lt': high})
+            alias = f'{facet}_{index}'
+            aggregates[alias] = Count('id', filter=condition)
+            labels[alias] = (facet, label)
+    return aggregates, labels
+
+
+def _group(queryset):
+    """{facet: {value: count}} for the products in `queryset`, in three queries."""
+    queryset = queryset.order_by()
+    counts = defaultdict(dict)
+    for value, count in queryset.values_list('category').annotate(count=Count('id')):
+        counts['category'][value] = count
+    for value, count in queryset.values_list('vendor_id').annotate(count=Count('id')):
+        counts['vendor'][str(value)] = count
+    aggregates, labels = _bucket_aggregates()
+    for alias, count in queryset.aggregate(**aggregates).items():
+        if count:
+            facet, label = labels[alias]
+            counts[facet][label] = count
+    return counts
+
+
+def _group_by_category(queryset):
+    """{category scope: {facet: {value: count}}} for the products in `queryset`."""
+    queryset = queryset.order_by()
+    counts = defaultdict(lambda: defaultdict(dict))
+    for category, vendor, count in queryset.values_list('category', 'vendor_id').annotate(count=Count('id')):
+        counts[category_scope(category)]['vendor'][str(vendor)] = count
+    aggregates, labels = _bucket_aggregates()
+    for row in queryset.values('category').annotate(**aggregates):
+        for alias, (facet, label) in labels.items():
+            if row[alias]:
+                counts[category_scope(row['category'])][facet][label] = row[alias]
+    return counts
+
+
+def rebuild():
+    """Recount every facet from the products table; returns the number of facet values."""
+    active = Product.objects.filter(is_active=True)
+    counts = {CATALOG: _group(active), **_group_by_category(active)}
+    with transaction.atomic():
+        stale = set(FacetCount.objects.values_list('scope', flat=True).distinct())
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(
+            [
+                FacetCount(scope=scope, facet=facet, value=value, count=count)
+                for scope, facets in counts.items()
+                for facet, values in facets.items()
+                for value, count in values.items()
+            ],
+            batch_size=1000,
+        )
+        transaction.on_commit(lambda: invalidate(stale | set(counts)))
+    return sum(len(values) for facets in counts.values() for values in facets.values())
+
+
+def _present(counts):
+    """The API form: per facet, [{value, count, ...}], buckets in range order."""
+    vendor_ids = [int(value) for value in counts.get('vendor', {})]
+    vendors = dict(Vendor.objects.filter(pk__in=vendor_ids).values_list('id', 'name'))
+    result = {
+        'category': [
+            {'value': value, 'count': count}
+            for value, count in sorted(counts.get('category', {}).items(), key=lambda pair: (-pair[1], pair[0]))
+            if count > 0
+        ],
+        'vendor': [
+            {'value': int(value), 'name': vendors.get(int(value), ''), 'count': count}
+            for value, count in sorted(counts.get('vendor', {}).items(), key=lambda pair: (-pair[1], pair[0]))
+            if count > 0
+        ],
+    }
+    for facet, edges in BUCKETED.items():
+        result[facet] = [
+            {'value': label, 'min': low, 'max': high, 'count': counts[facet][label]}
+            for label, low, high in ranges(edges)
+            if counts.get(facet, {}).get(label, 0) > 0
+        ]
+    return result
+
+
+def precomputed_counts(scope):
+    """Facet counts of a scope (see precomputed_scope), from the precomputed table."""
+    key = _scope_key(scope)
+    result = cache.get(key)
+    if result is None:
+        counts = defaultdict(dict)
+        rows = FacetCount.objects.filter(scope=scope, count__gt=0).values_list('facet', 'value', 'count')
+        for facet, value, count in rows:
+            counts[facet][value] = count
+        if scope != CATALOG:
+            # Every product in a category has exactly one vendor
+            counts['category'] = {scope.split(':', 1)[1]: sum(counts['vendor'].values())}
+        result = _present(counts)
+        cache.set(key, result, settings.CATALOG_SEARCH_CACHE_TTL)
+    return result
+
+
+def search_cache_key(params):
+    return f'{_CACHE_KEY}:{digest(params)}'
+
+
+def search_counts(params, queryset):
+    """
+    Facet counts for a search. `params` are the parsed search
+    parameters, `queryset` the products it pages through.
+    """
+    scope = precomputed_scope(params)
+    if scope is not None:
+        return precomputed_counts(scope)
+    key = search_cache_key(params)
+    result = cache.get(key)
+    if result is None:
+        result = _present(_group(queryset))
+        cache.set(key, result, settings.CATALOG_SEARCH_CACHE_TTL)
+    return result
@@ -0,0 +1,408 @@
+"""
+Reading, inspecting and writing GLB (binary glTF 2.0) models.
+
+A GLB is a 12-byte header (magic 'glTF', version 2, total length) and
+chunks of (length, type, data): a JSON chunk describing the scene, and a
+BIN chunk holding buffer 0. GLB.from_file() maps the file with mmap and
+accessors are read as NumPy views into the mapping, so only the JSON
+chunk and whatever a caller derives from the views are ever copied. The
+mapping is released once the GLB and every array read from it are gone.
+
+inspect() summarises a model for clients: its bounding box in scene
+units (metres by glTF convention) with node transforms applied, triangle
+and vertex counts per rendered instance, and its textures' sizes.
+"""
+import base64
+import io
+import json
+import math
+import mmap
+import struct
+
+import numpy as np
+from PIL import Image
+
+MAGIC = b'glTF'
+JSON_CHUNK = 0x4E4F534A
+BIN_CHUNK = 0x004E4942
+COMPONENT_TYPES = {
+    5120: np.dtype('<i1'),
+    5121: np.dtype('<u1'),
+    5122: np.dtype('<i2'),
+    5123: np.dtype('<u2'),
+    5125: np.dtype('<u4'),
+    5126: np.dtype('<f4'),
+}
+COMPONENT_TYPE_IDS = {dtype: type_id for type_id, dtype in COMPONENT_TYPES.items()}
+COMPONENTS = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+TYPES = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4'}
+POINTS, LINES, LINE_LOOP, LINE_STRIP, TRIANGLES, TRIANGLE_STRIP, TRIANGLE_FAN = range(7)
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+
+class InvalidModel(ValueError):
+    """Raised for files that are not valid GLB models."""
+
+
+class UnsupportedModel(ValueError):
+    """Raised for valid models using features a caller cannot handle."""
+
+
+class _ViewFile(io.RawIOBase):
+    """Seekable read-only file over a memoryview, for Pillow, without copying it."""
+
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        data = self._view[self._position:self._position + len(target)]
+        target[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class GLB:
+    """A parsed GLB: `json` is the document, accessor data is read on demand."""
+
+    def __init__(self, data):
+        view = memoryview(data)
+        if len(view) < 12:
+            raise InvalidModel('File is too short to be a GLB')
+        magic, version, length = struct.unpack_from('<4sII', view)
+        if magic != MAGIC:
+            raise InvalidModel('Not a GLB file')
+        if version != 2:
+            raise UnsupportedModel(f'glTF version {version} is not supported')
+        if length > len(view):
+            raise InvalidModel('File is truncated')
+
+        chunks, offset = [], 12
+        while offset + 8 <= length:
+            chunk_length, chunk_type = struct.unpack_from('<II', view, offset)
+            if offset + 8 + chunk_length > length:
+                raise InvalidModel('Chunk runs past the end of the file')
+            chunks.append((chunk_type, view[offset + 8:offset + 8 + chunk_length]))
+            offset += 8 + chunk_length
+        if not chunks or chunks[0][0] != JSON_CHUNK:
+            raise InvalidModel('The first chunk must be JSON')
+        try:
+            self.json = json.loads(bytes(chunks[0][1]))
+        except ValueError:
+            raise InvalidModel('Invalid JSON chunk')
+        self.bin = chunks[1][1] if len(chunks) > 1 and chunks[1][0] == BIN_CHUNK else None
+        self.size = length
+
+    @classmethod
+    def from_file(cls, path):
+        """A GLB reading the file at `path` through a read-only memory map."""
+        with open(path, 'rb') as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise InvalidModel('File is empty')
+        return cls(mapped)
+
+    def _list(self, name):
+        return self.json.get(name) or []
+
+    def buffer_view(self, index):
+        """The bytes of a buffer view, as a memoryview into the file."""
+        try:
+            view = self._list('bufferViews')[index]
+            buffer = self._list('buffers')[view['buffer']]
+        except (IndexError, KeyError, TypeError):
+            raise InvalidModel(f'Invalid buffer view {index}')
+        if view['buffer'] != 0 or 'uri' in buffer or self.bin is None:
+            raise UnsupportedModel('Only data in the GLB binary chunk is supported')
+        start = view.get('byteOffset', 0)
+        end = start + view['byteLength']
+        if end > len(self.bin):
+            raise InvalidModel(f'Buffer view {index} runs past the binary chunk')
+        return self.bin[start:end]
+
+    def accessor(self, index):
+        """Accessor data as a (count, components) array; a view into the file where possible."""
+        try:
+            accessor = self._list('accessors')[index]
+            dtype = COMPONENT_TYPES[accessor['componentType']]
+            width = COMPONENTS[accessor['type']]
+            count = accessor['count']
+        except (IndexError, KeyError, TypeError):
+            raise InvalidModel(f'Invalid accessor {index}')
+        if 'sparse' in accessor:
+            raise UnsupportedModel('Sparse accessors are not supported')
+        if accessor['type'].startswith('MAT') and dtype.itemsize < 4:
+            raise UnsupportedModel('Padded matrix accessors are not supported')
+        if 'bufferView' not in accessor:
+            return np.zeros((count, width), dtype)
+
+        data = self.buffer_view(accessor['bufferView'])
+        offset = accessor.get('byteOffset', 0)
+        element = dtype.itemsize * width
+        stride = self._list('bufferViews')[accessor['bufferView']].get('byteStride') or element
+        if count and offset + stride * (count - 1) + element > len(data):
+            raise InvalidModel(f'Accessor {index} runs past its buffer view')
+        if offset % dtype.itemsize or stride % dtype.itemsize:
+            # Misaligned data cannot be viewed in place
+            rows = [np.frombuffer(data, dtype, width, offset + row * stride) for row in range(count)]
+            return np.array(rows, dtype).reshape(count, width)
+        return np.ndarray((count, width), dtype, buffer=data, offset=offset, strides=(stride, dtype.itemsize))
+
+    def triangles(self, primitive):
+        """A primitive's triangles as an (n, 3) array of vertex indices, or None if it draws none."""
+        mode = primitive.get('mode', TRIANGLES)
+        if mode not in (TRIANGLES, TRIANGLE_STRIP, TRIANGLE_FAN):
+            return None
+        if 'indices' in primitive:
+            indices = self.accessor(primitive['indices'])[:, 0].astype(np.int64)
+        else:
+            indices = np.arange(self._list('accessors')[primitive['attributes']['POSITION']]['count'])
+        if mode == TRIANGLES:
+            return indices[:len(indices) // 3 * 3].reshape(-1, 3)
+        if len(indices) < 3:
+            return np.empty((0, 3), np.int64)
+        if mode == TRIANGLE_FAN:
+            return np.column_stack([np.full(len(indices) - 2, indices[0]), indices[1:-1], indices[2:]])
+        # Strips alternate winding
+        triangles = np.column_stack([indices[:-2], indices[1:-1], indices[2:]])
+        triangles[1::2, [0, 1]] = triangles[1::2, [1, 0]]
+        return triangles
+
+    def triangle_count(self, primitive):
+        """A primitive's triangle count, from accessor counts alone."""
+        mode = primitive.get('mode', TRIANGLES)
+        accessor = primitive['indices'] if 'indices' in primitive else primitive['attributes'].get('POSITION')
+        if accessor is None or mode not in (TRIANGLES, TRIANGLE_STRIP, TRIANGLE_FAN):
+            return 0
+        count = self._list('accessors')[accessor]['count']
+        return count // 3 if mode == TRIANGLES else max(0, count - 2)
+
+    def image_data(self, index):
+        """The encoded bytes of an embedded image (a memoryview or bytes), or None for external ones."""
+        image = self._list('images')[index]
+        if 'bufferView' in image:
+            return self.buffer_view(image['bufferView'])
+        uri = image.get('uri', '')
+        if uri.startswith('data:') and ';base64,' in uri:
+            return base64.b64decode(uri.split(';base64,', 1)[1])
+        return None
+
+
+def _node_matrix(node):
+    if 'matrix' in node:
+        return np.array(node['matrix'], float).reshape(4, 4).T  # Column-major
+    x, y, z, w = node.get('rotation', (0, 0, 0, 1))
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array(node.get('scale', (1, 1, 1)), float)
+    matrix[:3, 3] = node.get('translation', (0, 0, 0))
+    return matrix
+
+
+def mesh_instances(document):
+    """(mesh index, world matrix) for every mesh the default scene draws."""
+    nodes = document.get('nodes') or []
+    scenes = document.get('scenes') or []
+    if scenes:
+        roots = scenes[document.get('scene', 0)].get('nodes', [])
+    else:
+        children = {child for node in nodes for child in node.get('children', [])}
+        roots = [index for index in range(len(nodes)) if index not in children]
+    if not nodes:
+        # A file of bare meshes
+        return [(index, np.eye(4)) for index in range(len(document.get('meshes') or []))]
+
+    instances, visited = [], set()
+    stack = [(root, np.eye(4)) for root in roots]
+    while stack:
+        index, parent = stack.pop()
+        if index in visited or not 0 <= index < len(nodes):
+            continue
+        visited.add(index)
+        node = nodes[index]
+        matrix = parent @ _node_matrix(node)
+        if 'mesh' in node:
+            instances.append((node['mesh'], matrix))
+        stack.extend((child, matrix) for child in node.get('children', []))
+    return instances
+
+
+def _local_bounds(glb, primitive):
+    """(min, max) of a primitive's positions, from the accessor bounds or its data."""
+    index = primitive['attributes'].get('POSITION')
+    if index is None:
+        return None
+    accessor = glb.json['accessors'][index]
+    if 'min' in accessor and 'max' in accessor:
+        low, high = np.array(accessor['min'][:3], float), np.array(accessor['max'][:3], float)
+    else:
+        positions = glb.accessor(index).astype(float)
+        if not len(positions):
+            return None
+        low, high = positions.min(axis=0), positions.max(axis=0)
+    if accessor.get('normalized'):
+        # Quantized positions (KHR_mesh_quantization) are stored scaled to the type's range
+        info = np.iinfo(COMPONENT_TYPES[accessor['componentType']])
+        scale = float(info.max)
+        low, high = np.maximum(low / scale, -1.0), np.maximum(high / scale, -1.0)
+    return low, high
+
+
+def _texture(glb, index):
+    image = glb.json['images'][index]
+    entry = {'image': index, 'mime_type': image.get('mimeType', ''), 'width': None, 'height': None, 'bytes': None}
+    try:
+        data = glb.image_data(index)
+    except UnsupportedModel:
+        data = None
+    if data is None:
+        entry['uri'] = image.get('uri', '')
+        return entry
+    entry['bytes'] = len(data)
+    try:
+        with Image.open(_ViewFile(memoryview(data))) as decoded:
+            entry['width'], entry['height'] = decoded.size
+            entry['mime_type'] = entry['mime_type'] or Image.MIME.get(decoded.format, '')
+    except Exception:
+        pass  # A format Pillow cannot read (e.g. KTX2); its size stays unknown
+    return entry
+
+
+def inspect(glb):
+    """
+    Summary of a model: {bbox: {min, max, size} or None, triangles,
+    vertices, meshes, textures: [{image, mime_type, width, height, bytes}],
+    max_texture, animated, skinned, extensions, bytes}.
+    """
+    document = glb.json
+    meshes = document.get('meshes') or []
+    bounds_min, bounds_max = np.full(3, math.inf), np.full(3, -math.inf)
+    triangles = vertices = 0
+    for mesh_index, matrix in mesh_instances(document):
+        if not 0 <= mesh_index < len(meshes):
+            raise InvalidModel(f'Node references unknown mesh {mesh_index}')
+        for primitive in meshes[mesh_index].get('primitives', []):
+            triangles += glb.triangle_count(primitive)
+            position = primitive.get('attributes', {}).get('POSITION')
+            if position is not None:
+                vertices += document['accessors'][position]['count']
+            bounds = _local_bounds(glb, primitive)
+            if bounds is None:
+                continue
+            corners = np.array(np.meshgrid(*zip(*bounds), indexing='ij')).reshape(3, -1).T
+            world = corners @ matrix[:3, :3].T + matrix[:3, 3]
+            bounds_min = np.minimum(bounds_min, world.min(axis=0))
+            bounds_max = np.maximum(bounds_max, world.max(axis=0))
+
+    bbox = None
+    if np.isfinite(bounds_min).all():
+        bbox = {
+            'min': [round(float(value), 6) for value in bounds_min],
+            'max': [round(float(value), 6) for value in bounds_max],
+            'size': [round(float(value), 6) for value in bounds_max - bounds_min],
+        }
+    textures = [_texture(glb, index) for index in range(len(document.get('images') or []))]
+    return {
+        'bbox': bbox,
+        'triangles': triangles,
+        'vertices': vertices,
+        'meshes': len(meshes),
+        'textures': textures,
+        'max_texture': max((max(t['width'] or 0, t['height'] or 0) for t in textures), default=0),
+        'animated': bool(document.get('animations')),
+        'skinned': bool(document.get('skins')),
+        'extensions': sorted(document.get('extensionsUsed') or []),
+        'bytes': glb.size,
+    }
+
+
+class Writer:
+    """Builds a GLB whose data all lives in one packed binary chunk."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.buffer_views = []
+        self.accessors = []
+
+    def add_view(self, data, target=None, stride=None):
+        """Append bytes as a new buffer view; returns its index."""
+        self.data.extend(b'\0' * (-len(self.data) % 4))
+        view = {'buffer': 0, 'byteOffset': len(self.data), 'byteLength': len(data)}
+        if target is not None:
+            view['target'] = target
+        if stride is not None:
+            view['byteStride'] = stride
+        self.data.extend(data)
+        self.buffer_views.append(view)
+        return len(self.buffer_views) - 1
+
+    def add_accessor(self, array, like=None, target=None, bounds=False):
+        """
+        Append a (count, components) array as a new accessor; returns its
+        index. `like` is the accessor it replaces, whose type and flags it
+        keeps; `bounds` forces min/max (required for POSITION).
+        """
+        array = np.ascontiguousarray(array)
+        dtype = array.dtype.newbyteorder('<')
+        array = array.astype(dtype, copy=False)
+        count, width = array.shape
+        accessor = {
+            'componentType': COMPONENT_TYPE_IDS[dtype],
+            'type': like['type'] if like else TYPES[width],
+            'count': count,
+        }
+        if like and like.get('normalized'):
+            accessor['normalized'] = True
+        if count and (bounds or (like and 'min' in like)):
+            cast = float if dtype.kind == 'f' else int
+            accessor['min'] = [cast(value) for value in array.min(axis=0)]
+            accessor['max'] = [cast(value) for value in array.max(axis=0)]
+
+        element = array.itemsize * width
+        stride = None
+        data = array.tobytes()
+        if target == ARRAY_BUFFER and element % 4:
+            # Vertex attribute elements must start on 4-byte boundaries
+            stride = element + (-element % 4)
+            padded = np.zeros((count, stride), np.uint8)
+            padded[:, :element] = np.frombuffer(data, np.uint8).reshape(count, element)
+            data = padded.tobytes()
+        if count:
+            accessor['bufferView'] = self.add_view(data, target, stride)
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def build(self, document):
+        """The GLB bytes of `document` with this writer's buffer views and accessors."""
+        document = dict(document, bufferViews=self.buffer_views, accessors=self.accessors)
+        if self.data:
+            document['buffers'] = [{'byteLength': len(self.data)}]
+        else:
+            document.pop('buffers', None)
+        encoded = json.dumps(document, separators=(',', ':')).encode()
+        encoded += b' ' * (-len(encoded) % 4)
+        binary = bytes(self.data) + b'\0' * (-len(self.data) % 4)
+        length = 12 + 8 + len(encoded) + (8 + len(binary) if binary else 0)
+        parts = [struct.pack('<4sII', MAGIC, 2, length), struct.pack('<II', len(encoded), JSON_CHUNK), encoded]
+        if binary:
+            parts += [struct.pack('<II', len(binary), BIN_CHUNK), binary]
+        return b''.join(parts)
@@ -0,0 +1,469 @@
+"""
+Streaming ingest of vendor product feeds.
+
+A feed lists one vendor's products as CSV (with a header row), JSON Lines
+or a JSON array of objects, from a path or an http(s) URL, optionally
+gzipped (.gz). Fields:
+    sku, name, category, price      required
+    description, style, model_url, thumbnail_url
+    width, depth, height            centimetres, may be empty
+    color_options                   a list, or '|'-separated in CSV
+    in_stock                        true/false (default true)
+
+The feed is read and applied in batches of CATALOG_INGEST_BATCH_SIZE
+rows, so memory use does not depend on its size and each batch holds its
+row locks only briefly. A batch is diffed against the vendor's stored
+products by SKU and content hash: new SKUs are inserted, products whose
+hash changed (or that were retired) are updated, and the rest are not
+written at all. On PostgreSQL, batches with at least
+CATALOG_INGEST_COPY_ROWS writes are loaded with COPY into a staging table
+and applied with one INSERT ... SELECT and one UPDATE ... FROM; smaller
+batches, and other databases, use bulk_create and bulk_update. Once the
+whole feed has been read, the vendor's active products it no longer lists
+are retired. A product whose row is invalid is still listed, so it keeps
+its stored values rather than being retired.
+
+Bulk writes send no signals, so every batch applies its own facet deltas
+(see facets.py) and queues analysis of the 3D models it wrote (see
+lods.py). Invalid rows are skipped and reported. A failed run can
+simply be repeated: rows already applied are then unchanged.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import math
+import time
+from collections import Counter
+from contextlib import ExitStack
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import facets
+from .models import FACET_FIELDS, Product
+
+# Product fields a feed sets; the content hash covers exactly these
+FEED_FIELDS = (
+    'name', 'description', 'category', 'style', 'model_url', 'thumbnail_url',
+    'width', 'depth', 'height', 'color_options', 'price', 'in_stock',
+)
+REQUIRED_FIELDS = ('sku', 'name', 'category', 'price')
+UPDATE_FIELDS = (*FEED_FIELDS, 'is_active', 'content_hash', 'updated_at')
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json'}
+# Invalid rows listed in a report; the rest are only counted
+MAX_ERRORS = 20
+READ_CHUNK = 64 * 1024
+STAGING_TABLE = 'catalog_ingest_staging'
+_COPY_COLUMNS = ('id', 'vendor_id', 'sku', *UPDATE_FIELDS, 'created_at')
+_TEXT_COLUMNS = ('sku', 'name', 'description', 'category', 'style', 'model_url', 'thumbnail_url', 'content_hash')
+_TRUE = ('1', 'true', 'yes', 'y')
+_FALSE = ('0', 'false', 'no', 'n')
+_PRICE_LIMIT = Decimal(10) ** 8  # max_digits=10, decimal_places=2
+_validate_url = URLValidator(schemes=['http', 'https'])
+
+
+class IngestError(ValueError):
+    """Raised for feeds that cannot be ingested."""
+
+
+def _is_url(source):
+    return urlparse(source).scheme in ('http', 'https')
+
+
+def feed_format(source):
+    """The format of a feed, from its file extension."""
+    path = (urlparse(source).path if _is_url(source) else source).lower().removesuffix('.gz')
+    for extension, format in FORMATS.items():
+        if path.endswith(extension):
+            return format
+    raise IngestError(f'Cannot tell the format of {source}; pass one of: {", ".join(sorted(set(FORMATS.values())))}')
+
+
+def _read_csv(text):
+    reader = csv.DictReader(text)
+    missing = [name for name in REQUIRED_FIELDS if name not in (reader.fieldnames or ())]
+    if missing:
+        raise IngestError(f'CSV header lacks: {", ".join(missing)}')
+    for row in reader:
+        yield f'line {reader.line_num}', row, None
+
+
+def _read_json_lines(text):
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield f'line {number}', json.loads(line), None
+        except ValueError:
+            yield f'line {number}', None, 'invalid JSON'
+
+
+def _read_json_array(text):
+    """Objects of a top-level JSON array, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    buffer, position, done = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, done
+        chunk = text.read(READ_CHUNK)
+        buffer, position, done = buffer[position:] + chunk, 0, not chunk
+
+    def peek():
+        """The next character that is not whitespace, '' at the end."""
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or done:
+                return buffer[position:position + 1]
+            fill()
+
+    if peek() != '[':
+        raise IngestError('A JSON feed must be an array of products (or use JSON Lines)')
+    position += 1
+    if peek() == ']':
+        return
+    number = 0
+    while True:
+        number += 1
+        while True:
+            try:
+                row, position = decoder.raw_decode(buffer, position)
+                break
+            except ValueError:
+                # Incomplete: read on, unless there is nothing left to read
+                if done:
+                    raise IngestError(f'Invalid JSON at product {number}')
+                fill()
+        yield f'product {number}', row, None
+        separator = peek()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise IngestError(f'Invalid JSON after product {number}')
+        position += 1
+        peek()
+
+
+_READERS = {'csv': _read_csv, 'jsonl': _read_json_lines, 'json': _read_json_array}
+
+
+def read_feed(source, format=None):
+    """
+    Stream a feed (path or http(s) URL) as (position, row, error) triples;
+    `error` is set for rows that could not be decoded.
+    """
+    format = format or feed_format(source)
+    if format not in _READERS:
+        raise IngestError(f'Unknown feed format: {format}')
+    with ExitStack() as stack:
+        if _is_url(source):
+            stream = stack.enter_context(urlopen(source, timeout=60))
+            path = urlparse(source).path
+        else:
+            stream = stack.enter_context(open(source, 'rb'))
+            path = source
+        if path.lower().endswith('.gz'):
+            stream = stack.enter_context(gzip.GzipFile(fileobj=stream))
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if format == 'csv' else None)
+        yield from _READERS[format](text)
+
+
+def _text(raw, name, required=False):
+    value = raw.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{name} is required')
+    max_length = Product._meta.get_field(name).max_length
+    if max_length and len(value) > max_length:
+        raise ValueError(f'{name} is longer than {max_length} characters')
+    return value
+
+
+def _url(raw, name):
+    value = _text(raw, name)
+    if value:
+        try:
+            _validate_url(value)
+        except ValidationError:
+            raise ValueError(f'{name} must be an http(s) URL')
+    return value
+
+
+def _size(raw, name):
+    value = raw.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = math.nan
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f'{name} must be a number of centimetres')
+    return value
+
+
+def _price(raw):
+    value = raw.get('price')
+    if value is None or value == '':
+        raise ValueError('price is required')
+    try:
+        price = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError('price must be a number')
+    if not price.is_finite() or price < 0 or price >= _PRICE_LIMIT:
+        raise ValueError('price must be a number from 0 to 99999999.99')
+    return price
+
+
+def _colors(raw):
+    value = raw.get('color_options')
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.split('|')
+    if not isinstance(value, list):
+        raise ValueError('color_options must be a list')
+    return [str(color).strip() for color in value if str(color).strip()]
+
+
+def _flag(raw, name, default=True):
+    value = raw.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in _TRUE:
+        return True
+    if str(value).strip().lower() in _FALSE:
+        return False
+    raise ValueError(f'{name} must be true or false')
+
+
+def content_hash(fields):
+    """Hash of a product's FEED_FIELDS values."""
+    encoded = json.dumps([fields[name] for name in FEED_FIELDS], default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def clean(raw):
+    """
+    A feed row as (sku, product field values); raises ValueError with a
+    message for invalid rows. Categories and styles are lower-cased so
+    they facet together across vendors.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError('not an object')
+    fields = {
+        'name': _text(raw, 'name', required=True),
+        'description': _text(raw, 'description'),
+        'category': _text(raw, 'category', required=True).lower(),
+        'style': _text(raw, 'style').lower(),
+        'model_url': _url(raw, 'model_url'),
+        'thumbnail_url': _url(raw, 'thumbnail_url'),
+        'width': _size(raw, 'width'),
+        'depth': _size(raw, 'depth'),
+        'height': _size(raw, 'height'),
+        'color_options': _colors(raw),
+        'price': _price(raw),
+        'in_stock': _flag(raw, 'in_stock'),
+    }
+    fields['content_hash'] = content_hash(fields)
+    return _text(raw, 'sku', required=True), fields
+
+
+def listed_sku(raw):
+    """The SKU of a feed row, even an invalid one, or '' if it has none."""
+    try:
+        return _text(raw, 'sku') if isinstance(raw, dict) else ''
+    except ValueError:
+        return ''
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def _copy_value(value):
+    if value is None:
+        return ''  # NULL, except in _TEXT_COLUMNS
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _copy(inserts, updates):
+    """Write a batch through a staging table: one COPY, one INSERT ... SELECT and one UPDATE ... FROM."""
+    quote = connection.ops.quote_name
+    table, staging = quote(Product._meta.db_table), quote(STAGING_TABLE)
+    columns = [Product._meta.get_field(name).column for name in _COPY_COLUMNS]
+    inserted = [column for column in columns if column != 'id']
+    updated = [Product._meta.get_field(name).column for name in UPDATE_FIELDS]
+    metadata = Product._meta.get_field('model_metadata').column
+
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for row in chain(inserts, updates):
+        writer.writerow([_copy_value(row[name]) for name in _COPY_COLUMNS])
+    data.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {staging} AS SELECT {", ".join(map(quote, columns))} FROM {table} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f'COPY {staging} ({", ".join(map(quote, columns))}) FROM STDIN '
+            f'WITH (FORMAT csv, FORCE_NOT_NULL ({", ".join(map(quote, _TEXT_COLUMNS))}))',
+            data,
+        )
+        # Model defaults are not database defaults
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(map(quote, inserted))}, {quote(metadata)}) '
+            f'SELECT {", ".join(map(quote, inserted))}, %s FROM {staging} WHERE id IS NULL',
+            [json.dumps({})],
+        )
+        cursor.execute(
+            f'UPDATE {table} AS product SET {", ".join(f"{quote(c)} = staging.{quote(c)}" for c in updated)} '
+            f'FROM {staging} AS staging WHERE product.id = staging.id'
+        )
+        cursor.execute(f'DROP TABLE {staging}')
+
+
+def _apply(vendor, batch, report):
+    """Diff one batch ({sku: fields}) against the stored products and write what changed."""
+    from .tasks import queue_analysis
+    now = timezone.now()
+    with transaction.atomic():
+        stored = {
+            sku: (pk, digest, active)
+            for sku, pk, digest, active in Product.objects.filter(vendor=vendor, sku__in=list(batch))
+            .values_list('sku', 'id', 'content_hash', 'is_active')
+        }
+        inserts, updates = [], []
+        for sku, fields in batch.items():
+            row = {'id': None, 'vendor_id': vendor.id, 'sku': sku, **fields,
+                   'is_active': True, 'created_at': now, 'updated_at': now}
+            if sku not in stored:
+                inserts.append(row)
+                continue
+            pk, digest, active = stored[sku]
+            if digest != fields['content_hash'] or not active:
+                row.update(id=pk, created_at=None)
+                updates.append(row)
+
+        # Only the rows about to change are locked, for exact facet deltas
+        before = {
+            row['id']: row
+            for row in Product.objects.select_for_update()
+            .filter(pk__in=[row['id'] for row in updates])
+            .values('id', *FACET_FIELDS)
+        }
+        updates = [row for row in updates if row['id'] in before]
+        change = Counter()
+        for row in inserts:
+            change.update(facets.deltas(None, row))
+        for row in updates:
+            change.update(facets.deltas(before[row['id']], row))
+
+        if connection.vendor == 'postgresql' and len(inserts) + len(updates) >= settings.CATALOG_INGEST_COPY_ROWS:
+            _copy(inserts, updates)
+        else:
+            Product.objects.bulk_create([Product(**row) for row in inserts])
+            Product.objects.bulk_update([Product(**row) for row in updates], UPDATE_FIELDS)
+        facets.apply(change)
+        models = {row['model_url'] for row in chain(inserts, updates) if row['model_url']}
+        if models:
+            transaction.on_commit(lambda: queue_analysis(models))
+
+    report['inserted'] += len(inserts)
+    report['updated'] += len(updates)
+    report['unchanged'] += len(batch) - len(inserts) - len(updates)
+
+
+def _retire(vendor, seen, batch_size, report):
+    """Retire the vendor's active products whose SKUs are not in `seen`."""
+    active = Product.objects.filter(vendor=vendor, is_active=True)
+    missing = [pk for pk, sku in active.values_list('id', 'sku').iterator(chunk_size=batch_size) if sku not in seen]
+    for ids in _batches(missing, batch_size):
+        with transaction.atomic():
+            rows = list(
+                Product.objects.select_for_update().filter(pk__in=ids, is_active=True).values('id', *FACET_FIELDS)
+            )
+            Product.objects.filter(pk__in=[row['id'] for row in rows]).update(
+                is_active=False, updated_at=timezone.now()
+            )
+            change = Counter()
+            for row in rows:
+                change.update(facets.deltas(row, {**row, 'is_active': False}))
+            facets.apply(change)
+        report['retired'] += len(rows)
+
+
+def ingest(vendor, source, format=None, retire=True, batch_size=None):
+    """
+    Ingest a vendor's feed (a path or http(s) URL) into the catalog.
+    With `retire`, active products missing from the feed are retired; pass
+    False for feeds that list only some products. Returns a report:
+    counts of rows read, inserted, updated, unchanged, retired and
+    invalid, the first MAX_ERRORS invalid rows, and the elapsed time.
+    Raises IngestError for unreadable feeds, or if the vendor's feed is
+    already being ingested.
+    """
+    lock = f'catalog-ingest:{vendor.id}'
+    if not cache.add(lock, 1, timeout=settings.CATALOG_INGEST_LOCK_TTL):
+        raise IngestError(f'A feed for vendor {vendor.id} is already being ingested')
+    try:
+        return _ingest(vendor, source, format, retire, batch_size or settings.CATALOG_INGEST_BATCH_SIZE)
+    finally:
+        cache.delete(lock)
+
+
+def _ingest(vendor, source, format, retire, batch_size):
+    started = time.perf_counter()
+    report = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'retired': 0, 'invalid': 0, 'errors': []}
+    seen = set()
+    invalid = set()  # SKUs of invalid rows, kept as they are
+    for rows in _batches(read_feed(source, format), batch_size):
+        batch = {}
+        for position, raw, error in rows:
+            report['rows'] += 1
+            try:
+                if error:
+                    raise ValueError(error)
+                sku, fields = clean(raw)
+                if sku in seen:
+                    raise ValueError(f'duplicate sku {sku!r}')
+            except ValueError as e:
+                report['invalid'] += 1
+                if len(report['errors']) < MAX_ERRORS:
+                    report['errors'].append(f'{position}: {e}')
+                invalid.add(listed_sku(raw))
+                continue
+            seen.add(sku)
+            batch[sku] = fields
+        _apply(vendor, batch, report)
+
+    # A feed without a single valid row is more likely broken than empty
+    if retire and seen:
+        _retire(vendor, seen | invalid, batch_size, report)
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows'] / elapsed) if elapsed else 0
+    return report
@@ -0,0 +1,371 @@
+"""
+Model analysis and levels of detail for catalog products.
+
+The analyze_model task reads a product's GLB model (see glb.py) once per
+distinct file and records in Product.model_metadata:
+    {
+        "source": <model_url analysed>, "sha256": <file hash>,
+        "bbox": {"min", "max", "size"}, "triangles", "vertices", "meshes",
+        "textures": [{"image", "mime_type", "width", "height", "bytes"}],
+        "max_texture", "animated", "skinned", "extensions", "bytes",
+        "lods": [{"name", "url", "triangles", "max_texture", "bytes"}],
+    }
+plus "lod_error" when no LODs could be built, or just {"source",
+"error"} for files that are not valid models.
+
+Analysis streams the file to a temporary file and maps it (never reading
+it whole into memory). Results are also cached by content hash for
+MODEL_ANALYSIS_CACHE_TTL seconds, so the same file at another URL is not
+processed again.
+
+LODs are lighter copies of the model: every mesh decimated by vertex
+clustering to a share of its triangles and embedded textures downscaled
+to a maximum size. A level is only kept if it is clearly smaller than the
+one before. pick() chooses the smallest model (original or LOD) with
+enough triangles and texture resolution for what a scene needs.
+"""
+import copy
+import hashlib
+import math
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.db.models.fields.json import KT
+from PIL import Image
+
+from apps.projects.storage import get_upload_backend
+
+from .glb import ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER, GLB, UnsupportedModel, Writer, inspect
+from .models import Product
+
+# name -> (share of triangles kept, maximum texture size in pixels)
+LEVELS = {
+    'lod1': (0.5, 1024),
+    'lod2': (0.2, 512),
+    'lod3': (0.05, 256),
+}
+# Primitives this small are kept as they are
+MIN_TRIANGLES = 64
+# A level must be under this share of the previous level's size to be kept
+MIN_SAVING = 0.9
+# Extensions LODs can carry over: they add nothing that references accessors
+SUPPORTED_EXTENSIONS = (
+    'KHR_materials_', 'KHR_texture_transform', 'KHR_lights_punctual', 'KHR_mesh_quantization',
+    'EXT_texture_webp',
+)
+# Finest clustering grid tried, in cells along the model's longest side
+MAX_GRID = 1024
+SAVE_OPTIONS = {'PNG': {'optimize': True}, 'JPEG': {'quality': 85, 'optimize': True}, 'WEBP': {'quality': 80}}
+
+
+def _cluster(scaled, triangles, resolution):
+    """Vertex cluster labels on a grid of `resolution` cells per axis, and the triangles left."""
+    cells = np.minimum((scaled * resolution).astype(np.int64), resolution - 1)
+    keys = cells[:, 0] + resolution * (cells[:, 1] + resolution * cells[:, 2])
+    _, labels = np.unique(keys, return_inverse=True)
+    labels = labels.reshape(-1)
+    faces = labels[triangles]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    if len(faces):
+        # Drop duplicates, comparing faces rotated to start at their lowest
+        # vertex so winding (and so back-to-back faces) is kept
+        shift = np.argmin(faces, axis=1)
+        rotated = np.take_along_axis(faces, (shift[:, None] + np.arange(3)) % 3, axis=1)
+        clusters = int(labels.max()) + 1
+        if clusters < 2 ** 21:
+            # One int64 key per face is much faster to sort than rows
+            keys = (rotated[:, 0] * clusters + rotated[:, 1]) * clusters + rotated[:, 2]
+            _, first = np.unique(keys, return_index=True)
+        else:
+            _, first = np.unique(rotated, axis=0, return_index=True)
+        faces = faces[np.sort(first)]
+    return labels, faces
+
+
+def decimate(positions, triangles, target):
+    """
+    Simplify a triangle mesh to at most `target` triangles (as close as the
+    grid allows) by vertex clustering: vertices sharing a grid cell merge
+    into the one nearest their mean, keeping its attributes. Returns
+    (original indices of the vertices kept, triangles indexing into them),
+    or None if the mesh cannot be reduced.
+    """
+    used = np.unique(triangles)
+    if not np.isfinite(positions[used]).all():
+        raise ValueError('Vertex positions must be finite')
+    low = positions[used].min(axis=0)
+    extent = float((positions[used].max(axis=0) - low).max()) or 1.0
+    scaled = np.clip((positions - low) / extent, 0.0, 1.0)
+
+    # Finest grid that reaches the target
+    best = None
+    low_resolution, high_resolution = 1, MAX_GRID
+    while low_resolution <= high_resolution:
+        resolution = (low_resolution + high_resolution) // 2
+        labels, faces = _cluster(scaled, triangles, resolution)
+        if len(faces) <= target:
+            if len(faces):
+                best = labels, faces
+            low_resolution = resolution + 1
+        else:
+            high_resolution = resolution - 1
+    if best is None:
+        return None
+    labels, faces = best
+
+    # Each cluster's vertex nearest its mean
+    clusters = labels.max() + 1
+    sizes = np.bincount(labels, minlength=clusters)
+    means = np.stack([np.bincount(labels, scaled[:, axis], clusters) for axis in range(3)], axis=1)
+    means /= np.maximum(sizes, 1)[:, None]
+    distance = np.square(scaled - means[labels]).sum(axis=1)
+    order = np.lexsort((distance, labels))
+    nearest = order[np.r_[True, labels[order][1:] != labels[order][:-1]]]
+
+    kept = np.unique(faces)
+    remap = np.full(clusters, -1, np.int64)
+    remap[kept] = np.arange(len(kept))
+    return nearest[kept], remap[faces]
+
+
+def check_supported(document):
+    """Raise UnsupportedModel if LODs of this document could lose or break content."""
+    for extension in document.get('extensionsUsed') or []:
+        if not extension.startswith(SUPPORTED_EXTENSIONS):
+            raise UnsupportedModel(f'Extension {extension} is not supported')
+    for buffer in document.get('buffers') or []:
+        if 'uri' in buffer:
+            raise UnsupportedModel('External buffers are not supported')
+
+
+def _downscale(data, mime_type, max_size):
+    """Image bytes no larger than `max_size` on either side, and their MIME type."""
+    data = bytes(data)
+    try:
+        image = Image.open(BytesIO(data))
+        image_format = image.format
+        if max(image.size) <= max_size or image_format not in SAVE_OPTIONS:
+            return data, mime_type or Image.MIME.get(image_format, '')
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        scale = max_size / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        output = BytesIO()
+        image.resize(size, Image.LANCZOS).save(output, image_format, **SAVE_OPTIONS[image_format])
+    except Exception:
+        return data, mime_type  # A format Pillow cannot re-encode; kept as it is
+    return output.getvalue(), Image.MIME[image_format]
+
+
+def build(glb, ratio, max_texture):
+    """
+    GLB bytes of a lighter copy of `glb`: triangle meshes reduced to
+    `ratio` of their triangles and embedded images to `max_texture`
+    pixels. Raises UnsupportedModel for models it cannot copy faithfully.
+    """
+    source = glb.json
+    check_supported(source)
+    document = copy.deepcopy(source)
+    accessors = source.get('accessors') or []
+    writer = Writer()
+    copied = {}
+
+    def copy_accessor(index, target=None):
+        if (index, target) not in copied:
+            copied[index, target] = writer.add_accessor(glb.accessor(index), like=accessors[index], target=target)
+        return copied[index, target]
+
+    def copy_rows(index, rows, bounds=False):
+        rows = glb.accessor(index)[rows]
+        return writer.add_accessor(rows, like=accessors[index], target=ARRAY_BUFFER, bounds=bounds)
+
+    for mesh in document.get('meshes') or []:
+        for primitive in mesh.get('primitives', []):
+            attributes = primitive.get('attributes', {})
+            triangles = glb.triangles(primitive) if 'POSITION' in attributes else None
+            reduced = None
+            if triangles is not None and len(triangles) > MIN_TRIANGLES:
+                positions = glb.accessor(attributes['POSITION']).astype(float)
+                if triangles.min() < 0 or triangles.max() >= len(positions):
+                    raise ValueError('Triangle indices out of range')
+                reduced = decimate(positions, triangles, max(MIN_TRIANGLES, math.ceil(len(triangles) * ratio)))
+
+            if reduced is None:
+                primitive['attributes'] = {
+                    name: copy_accessor(index, ARRAY_BUFFER) for name, index in attributes.items()
+                }
+                if 'indices' in primitive:
+                    primitive['indices'] = copy_accessor(primitive['indices'], ELEMENT_ARRAY_BUFFER)
+                primitive['targets'] = [
+                    {name: copy_accessor(index, ARRAY_BUFFER) for name, index in target.items()}
+                    for target in primitive.get('targets', [])
+                ]
+            else:
+                vertices, faces = reduced
+                primitive['attributes'] = {
+                    name: copy_rows(index, vertices, bounds=name == 'POSITION') for name, index in attributes.items()
+                }
+                primitive['targets'] = [
+                    {name: copy_rows(index, vertices) for name, index in target.items()}
+                    for target in primitive.get('targets', [])
+                ]
+                dtype = np.uint16 if len(vertices) < 65535 else np.uint32
+                primitive['indices'] = writer.add_accessor(
+                    faces.reshape(-1, 1).astype(dtype), target=ELEMENT_ARRAY_BUFFER
+                )
+                primitive.pop('mode', None)
+            if not primitive['targets']:
+                del primitive['targets']
+
+    for skin in document.get('skins') or []:
+        if 'inverseBindMatrices' in skin:
+            skin['inverseBindMatrices'] = copy_accessor(skin['inverseBindMatrices'])
+    for animation in document.get('animations') or []:
+        for sampler in animation.get('samplers', []):
+            sampler['input'] = copy_accessor(sampler['input'])
+            sampler['output'] = copy_accessor(sampler['output'])
+    for index, image in enumerate(document.get('images') or []):
+        data = glb.image_data(index)
+        if data is None:
+            raise UnsupportedModel('External images are not supported')
+        data, mime_type = _downscale(data, image.get('mimeType'), max_texture)
+        image.pop('uri', None)
+        image['bufferView'] = writer.add_view(data)
+        if mime_type:
+            image['mimeType'] = mime_type
+    return writer.build(document)
+
+
+def levels(glb):
+    """
+    Yield (name, GLB bytes, {triangles, max_texture, bytes}) for each
+    level of detail worth keeping, lightest last.
+    """
+    previous = glb.size
+    for name, (ratio, max_texture) in LEVELS.items():
+        data = build(glb, ratio, max_texture)
+        if len(data) >= previous * MIN_SAVING:
+            continue
+        summary = inspect(GLB(data))
+        previous = len(data)
+        yield name, data, {
+            'triangles': summary['triangles'], 'max_texture': summary['max_texture'], 'bytes': len(data),
+        }
+
+
+def analyze(path, digest):
+    """
+    Metadata of the GLB file at `path` (see the module docstring, minus
+    "source"), with its LODs built and stored. Raises InvalidModel or
+    UnsupportedModel for files that cannot be read.
+    """
+    glb = GLB.from_file(path)
+    metadata = {'sha256': digest, **inspect(glb), 'lods': []}
+    backend = get_upload_backend()
+    try:
+        for name, data, level in levels(glb):
+            url = backend.store_derivative(f'dreamspace/models/{digest[:32]}/{name}', data, 'glb')
+            metadata['lods'].append({'name': name, 'url': url, **level})
+    except UnsupportedModel as e:
+        metadata['lods'] = []
+        metadata['lod_error'] = str(e)
+    remember(digest, metadata)
+    return metadata
+
+
+def download(url, file):
+    """
+    Copy the model at `url` into `file`; returns its SHA-256 hex digest.
+    Raises ValueError for files over MODEL_MAX_BYTES.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with get_upload_backend().open(url) as source:
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > settings.MODEL_MAX_BYTES:
+                raise ValueError(f'Model is larger than {settings.MODEL_MAX_BYTES} bytes')
+            digest.update(chunk)
+            file.write(chunk)
+    file.flush()
+    return digest.hexdigest()
+
+
+def is_current(product):
+    """True if `product` has metadata of its current model."""
+    return bool(product.model_url) and (product.model_metadata or {}).get('source') == product.model_url
+
+
+def stale(urls):
+    """The model URLs among `urls` used by a product without current metadata."""
+    products = Product.objects.filter(model_url__in=list(urls)).annotate(source=KT('model_metadata__source'))
+    return set(
+        products.filter(Q(source__isnull=True) | ~Q(source=F('model_url')))
+        .order_by().values_list('model_url', flat=True).distinct()
+    )
+
+
+def cached(digest):
+    """A file's cached metadata (see remember), or None."""
+    return cache.get(cache_key(digest))
+
+
+def cache_key(digest):
+    return f'model-analysis:{digest}'
+
+
+def queued_key(url):
+    return f'model-analysis-queued:{hashlib.sha256(url.encode()).hexdigest()[:32]}'
+
+
+def remember(digest, metadata):
+    """Cache a file's metadata (minus its source) by content hash, for copies at other URLs."""
+    metadata = {key: value for key, value in metadata.items() if key != 'source'}
+    cache.set(cache_key(digest), metadata, settings.MODEL_ANALYSIS_CACHE_TTL)
+
+
+def summary(product):
+    """A product's model metadata for API responses, or None until it is analysed."""
+    if not is_current(product) or 'error' in product.model_metadata:
+        return None
+    metadata = product.model_metadata
+    return {
+        'bbox': metadata['bbox'],
+        'triangles': metadata['triangles'],
+        'max_texture': metadata['max_texture'],
+        'bytes': metadata['bytes'],
+        'lods': metadata.get('lods', []),
+    }
+
+
+def pick(product, triangles=None, texture=None):
+    """
+    The smallest model of `product` with at least `triangles` triangles
+    and `texture` pixels of texture size (each capped at what the original
+    has), as {name, url, triangles, max_texture, bytes}. Without either,
+    the original. None if the product has no analysed model.
+    """
+    metadata = summary(product)
+    if metadata is None:
+        return None
+    original = {
+        'name': 'original', 'url': product.model_url, 'triangles': metadata['triangles'],
+        'max_texture': metadata['max_texture'], 'bytes': metadata['bytes'],
+    }
+    if triangles is None and texture is None:
+        return original
+    needed_triangles = min(triangles or 0, original['triangles'])
+    needed_texture = min(texture or 0, original['max_texture'])
+    adequate = [
+        level for level in [original, *metadata['lods']]
+        if level['triangles'] >= needed_triangles and level['max_texture'] >= needed_texture
+    ]
+    return min(adequate, key=lambda level: level['bytes'])
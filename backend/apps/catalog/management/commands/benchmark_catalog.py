@@ -0,0 +1,147 @@
+"""
+Benchmark catalog search on a synthetic catalog.
+
+Creates --products random products inside a transaction that is rolled
+back afterwards, then times the product list endpoint for browsing,
+filtered, text and deep-page searches against the 50 ms target, and the
+facet counts endpoint for the same searches (cold: counted or read from
+the precomputed table; warm: cached).
+"""
+import random
+import time
+import uuid
+from decimal import Decimal
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import QueryDict
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.catalog import facets, search
+from apps.catalog.models import Vendor, Product
+from apps.catalog.views import ProductViewSet
+
+TARGET_MS = 50
+CATEGORIES = (
+    'sofa', 'armchair', 'dining table', 'coffee table', 'bed', 'wardrobe', 'desk', 'bookshelf',
+    'floor lamp', 'rug', 'sideboard', 'dining chair', 'stool', 'mirror', 'cabinet', 'bench',
+)
+MATERIALS = ('oak', 'walnut', 'velvet', 'linen', 'leather', 'marble', 'rattan', 'steel', 'boucle', 'teak')
+STYLES = ('scandinavian', 'industrial', 'mid-century', 'minimalist', 'bohemian', 'coastal', 'farmhouse')
+
+
+class Command(BaseCommand):
+    help = 'Time catalog searches on a synthetic catalog of many products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--vendors', type=int, default=200)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, products=100000, vendors=200, queries=20, seed=0, **options):
+        rng = random.Random(seed)
+        self.cache_keys = set()
+        try:
+            with transaction.atomic():
+                vendor_ids = self._catalog(rng, products, vendors)
+                self._run(vendor_ids, queries)
+                transaction.set_rollback(True)
+        finally:
+            # Drop facet counts of the rolled back catalog
+            facets.invalidate()
+            cache.delete_many(self.cache_keys)
+
+    def _catalog(self, rng, count, vendor_count):
+        started = time.perf_counter()
+        tag = uuid.uuid4().hex[:8]
+        vendors = Vendor.objects.bulk_create(
+            [Vendor(name=f'Benchmark vendor {tag} {index}') for index in range(vendor_count)]
+        )
+        batch = []
+        for index in range(count):
+            category, material, style = rng.choice(CATEGORIES), rng.choice(MATERIALS), rng.choice(STYLES)
+            batch.append(Product(
+                vendor=rng.choice(vendors),
+                sku=f'{tag}-{index}',
+                name=f'{style.title()} {material} {category} {index}',
+                description=f'A {style} {category} in {material}.',
+                category=category,
+                style=style,
+                width=round(rng.uniform(30, 320), 1),
+                depth=round(rng.uniform(30, 220), 1),
+                height=round(rng.uniform(20, 220), 1),
+                price=Decimal(rng.randint(2000, 500000)) / 100,
+                in_stock=rng.random() < 0.8,
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Product._meta.db_table}')
+        facets.rebuild()
+        self.stdout.write(f'{count} products in {time.perf_counter() - started:.1f} s ({connection.vendor})')
+        return [vendor.id for vendor in vendors]
+
+    def _get(self, view, user, params):
+        request = APIRequestFactory().get('/api/catalog/products/', params)
+        force_authenticate(request, user=user)
+        response = view(request)
+        response.render()
+        return response
+
+    def _time(self, label, view, user, params, queries):
+        # The first request runs without cached matches or facet counts
+        parsed = search.parse(QueryDict(urlencode(params)))
+        keys = [facets.search_cache_key(parsed), search.candidates_key(parsed)]
+        self.cache_keys.update(keys)
+        facets.invalidate([facets.precomputed_scope(parsed) or facets.CATALOG])
+        cache.delete_many(keys)
+        started = time.perf_counter()
+        self._get(view, user, params)
+        cold = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        for _ in range(queries):
+            response = self._get(view, user, params)
+        warm = (time.perf_counter() - started) * 1000 / max(1, queries)
+        flag = '' if max(cold, warm) <= TARGET_MS or view is self.facets_view else '  (over target)'
+        self.stdout.write(f'  {label:<36} cold {cold:8.2f} ms   warm {warm:8.2f} ms{flag}')
+        return response
+
+    def _run(self, vendor_ids, queries):
+        user = User.objects.create(username=f'catalog-benchmark-{uuid.uuid4().hex[:8]}')
+        self.facets_view = ProductViewSet.as_view({'get': 'facets'})
+        views = {'search': ProductViewSet.as_view({'get': 'list'}), 'facets': self.facets_view}
+        searches = [
+            ('browse by name', {}),
+            ('browse by price (desc)', {'sort': '-price'}),
+            ('category by price', {'category': 'sofa', 'sort': 'price'}),
+            ('category + price + width range', {
+                'category': 'sofa', 'min_price': 250, 'max_price': 1000, 'min_width': 150, 'max_width': 200,
+            }),
+            ('vendor by name', {'vendor': vendor_ids[0]}),
+            ('text, specific', {'q': 'walnut sideboard'}),
+            ('text, specific, by price', {'q': 'walnut sideboard', 'sort': 'price'}),
+            ('text, broad, by name', {'q': 'oak', 'sort': 'name'}),
+        ]
+        if search.has_trigram():
+            searches.append(('text, misspelt', {'q': 'sidebaord'}))
+
+        self.stdout.write(f'target {TARGET_MS} ms per search page; trigram matching: {search.has_trigram()}')
+        for name, view in views.items():
+            self.stdout.write(f'{name}:')
+            for label, params in searches:
+                self._time(label, view, user, params, queries)
+
+        # Page 50 of the plain browse, by cursor
+        response = self._get(views['search'], user, {})
+        for _ in range(49):
+            cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+            response = self._get(views['search'], user, {'cursor': cursor})
+        self.stdout.write('deep pages:')
+        self._time('browse, page 50', views['search'], user, {'cursor': cursor}, queries)
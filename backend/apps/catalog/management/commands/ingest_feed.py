@@ -0,0 +1,46 @@
+"""
+Ingest a vendor's product feed (CSV, JSON Lines or a JSON array; a path
+or URL, optionally gzipped) into the catalog, writing only the products
+that changed; see ingest.py. Pass --queue to run it on a Celery worker.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.catalog.ingest import IngestError, ingest
+from apps.catalog.models import Vendor
+from apps.catalog.tasks import ingest_feed
+
+
+class Command(BaseCommand):
+    help = "Ingest a vendor's product feed into the catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('vendor', type=int, help='Vendor id')
+        parser.add_argument('source', help='Feed path or http(s) URL')
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'json'],
+                            help='Feed format (default: from the file extension)')
+        parser.add_argument('--keep-missing', action='store_true',
+                            help='Do not retire products missing from the feed (for partial feeds)')
+        parser.add_argument('--batch-size', type=int, help='Rows per transaction (default: CATALOG_INGEST_BATCH_SIZE)')
+        parser.add_argument('--queue', action='store_true', help='Queue the ingest instead of running it here')
+
+    def handle(self, *args, vendor, source, format=None, keep_missing=False, batch_size=None, queue=False,
+               **options):
+        try:
+            vendor = Vendor.objects.get(pk=vendor)
+        except Vendor.DoesNotExist:
+            raise CommandError(f'Unknown vendor: {vendor}')
+        if queue:
+            result = ingest_feed.delay(vendor.id, source, format=format, retire=not keep_missing)
+            self.stdout.write(f'Queued ingest of {source} for {vendor}: task {result.id}')
+            return
+        try:
+            report = ingest(vendor, source, format=format, retire=not keep_missing, batch_size=batch_size)
+        except (IngestError, OSError) as e:
+            raise CommandError(str(e))
+        for error in report['errors']:
+            self.stderr.write(f'  skipped {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f"{vendor}: {report['rows']} rows in {report['seconds']:.1f} s ({report['rows_per_second']} rows/s): "
+            f"{report['inserted']} inserted, {report['updated']} updated, {report['unchanged']} unchanged, "
+            f"{report['retired']} retired, {report['invalid']} invalid"
+        ))
@@ -0,0 +1,16 @@
+"""
+Recount the precomputed catalog facet counts from the products table,
+e.g. after products were changed with update() or a raw SQL load that
+applied no facet deltas (see facets.py).
+"""
+from django.core.management.base import BaseCommand
+
+from apps.catalog import facets
+
+
+class Command(BaseCommand):
+    help = 'Recount catalog facet counts from scratch'
+
+    def handle(self, *args, **options):
+        values = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Facets: counted {values} values'))
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:23
+
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations
+
+TRIGRAM_INDEX = GinIndex(fields=['name'], name='product_name_trgm_idx', opclasses=['gin_trgm_ops'])
+
+# Keeps search_vector current for every write, including bulk inserts and COPY
+SEARCH_TRIGGER = """
+CREATE FUNCTION furniture_products_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.category, '') || ' ' || coalesce(NEW.style, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER furniture_products_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, category, style, description ON furniture_products
+    FOR EACH ROW EXECUTE FUNCTION furniture_products_search_vector();
+"""
+
+DROP_SEARCH_TRIGGER = """
+DROP TRIGGER IF EXISTS furniture_products_search_vector_update ON furniture_products;
+DROP FUNCTION IF EXISTS furniture_products_search_vector();
+"""
+
+
+def add_search(apps, schema_editor):
+    # Other databases search by substring (see search.py)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(SEARCH_TRIGGER)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            # Search then matches by full text only
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.add_index(apps.get_model('catalog', 'Product'), TRIGRAM_INDEX)
+
+
+def remove_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_SEARCH_TRIGGER)
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TRIGRAM_INDEX.name}')
+
+
+class Migration(migrations.Migration):
+    """
+    PostgreSQL-only search support: the search_vector trigger, and the
+    trigram name index where the pg_trgm extension can be installed.
+    """
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='product', index=TRIGRAM_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(add_search, remove_search),
+            ],
+        ),
+    ]
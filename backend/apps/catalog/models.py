@@ -0,0 +1,126 @@
+"""
+Models for the furniture catalog.
+
+Architecture:
+- Vendor: A furniture retailer or brand supplying products
+- Product: A purchasable piece of furniture, searchable by text and facets
+- FacetCount: Precomputed number of active products per facet value
+"""
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models
+from django.db.models import Q
+
+# Product fields that decide its facet values (see facets.py)
+FACET_FIELDS = ('is_active', 'category', 'vendor_id', 'price', 'width', 'depth', 'height')
+
+ACTIVE = Q(is_active=True)
+
+
+class Vendor(models.Model):
+    """A furniture retailer or brand."""
+    name = models.CharField(max_length=255)
+    website = models.URLField(max_length=500, blank=True)
+    logo_url = models.URLField(max_length=500, blank=True)
+    contact_email = models.EmailField(blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'vendors'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class Product(models.Model):
+    """
+    A catalog product. Only active products are searchable; retired ones
+    are kept so items that reference them still resolve.
+    """
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='products')
+    sku = models.CharField(max_length=100)  # The vendor's own product code
+    name = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    category = models.CharField(max_length=100)  # e.g., 'sofa', 'table', 'lamp'
+    style = models.CharField(max_length=100, blank=True)  # e.g., 'scandinavian'
+    model_url = models.URLField(max_length=500, blank=True)  # GLB model
+    thumbnail_url = models.URLField(max_length=500, blank=True)
+    # Outer dimensions in centimetres
+    width = models.FloatField(null=True, blank=True)
+    depth = models.FloatField(null=True, blank=True)
+    height = models.FloatField(null=True, blank=True)
+    color_options = models.JSONField(default=list, blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    in_stock = models.BooleanField(default=True)
+    is_active = models.BooleanField(default=True)
+    # Bounding box, triangle and texture sizes and LODs of the model (see lods.py)
+    model_metadata = models.JSONField(default=dict, blank=True, editable=False)
+    # Hash of the fields as last ingested from the vendor feed (see ingest.py)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # Weighted name/category/style/description document, maintained by a
+    # PostgreSQL trigger (migration 0002) so bulk writes keep it current too
+    search_vector = SearchVectorField(null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'furniture_products'
+        ordering = ['name', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'sku'], name='unique_product_vendor_sku'),
+        ]
+        indexes = [
+            # Text matching
+            GinIndex(fields=['search_vector'], name='product_search_gin_idx'),
+            # Fuzzy name matching; needs pg_trgm, so created by migration 0002 only where available
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+            # Each sort order (see search.ORDERINGS) has a keyset index, alone
+            # and behind the category and vendor filters. Search only reads
+            # active products, so these skip retired ones.
+            models.Index(fields=['name', 'id'], name='product_name_keyset_idx', condition=ACTIVE),
+            models.Index(fields=['price', 'id'], name='product_price_keyset_idx', condition=ACTIVE),
+            models.Index(fields=['category', 'name', 'id'], name='product_category_name_idx', condition=ACTIVE),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx', condition=ACTIVE),
+            models.Index(fields=['vendor', 'name', 'id'], name='product_vendor_name_idx', condition=ACTIVE),
+            # Model analysis updates every product sharing a model file
+            models.Index(fields=['model_url'], name='product_model_url_idx', condition=~Q(model_url='')),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.vendor_id}:{self.sku})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Facet values as loaded, so saves can count the difference
+        if not instance.get_deferred_fields() & set(FACET_FIELDS):
+            instance._loaded_facets = {field: getattr(instance, field) for field in FACET_FIELDS}
+        return instance
+
+    @property
+    def dimensions(self):
+        return {'width': self.width, 'depth': self.depth, 'height': self.height}
+
+
+class FacetCount(models.Model):
+    """
+    Active products per facet value, e.g. ('category', 'sofa') or
+    ('price', '250-500'), in the whole catalog (scope '') or one category
+    (scope 'category:sofa'). Updated incrementally by facets.apply().
+    """
+    scope = models.CharField(max_length=110, blank=True)
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'catalog_facet_counts'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'facet', 'value'], name='unique_facet_value'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope or '*'} {self.facet}={self.value}: {self.count}"
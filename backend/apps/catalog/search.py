@@ -0,0 +1,273 @@
+"""
+Catalog product search: full-text and fuzzy matching, facet filters and
+keyset pagination over active products.
+
+Text queries use PostgreSQL full-text search (websearch syntax: quoted
+phrases, `or`, `-word`) against Product.search_vector, ranked with
+ts_rank. Where the pg_trgm extension is installed, names within trigram
+word similarity of the query match too ("sofe" finds "sofa") and add
+their similarity to the rank. Other databases fall back to substring
+matching on the name.
+
+Browsing and filtering are served by a keyset index per sort order (see
+Product.Meta), so a page costs one index range scan however deep it is.
+Ranking or sorting text matches means reading every match, which grows
+without bound for broad terms ("oak" matches a tenth of the catalog), so
+a text search pages through its first CATALOG_SEARCH_CANDIDATES matches
+in the requested order (the best ranked, the cheapest, ...). Those are
+fetched once with their sort values and cached for
+CATALOG_SEARCH_CACHE_TTL seconds; pages are cut from the cached list and
+only their products loaded, so every page of a search, and its facet
+counts, see the same products.
+"""
+import hashlib
+import json
+import math
+from functools import lru_cache, reduce
+from operator import and_, itemgetter
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Q
+from django.http import QueryDict
+
+from apps.projects.pagination import KeysetPagination
+
+from .models import Product
+
+SEARCH_CONFIG = 'english'
+MAX_QUERY_LENGTH = 200
+ORDERINGS = {
+    'relevance': ('-rank', 'id'),
+    'name': ('name', 'id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+}
+RANGE_FILTERS = ('price', 'width', 'depth', 'height')
+
+
+class ProductPagination(KeysetPagination):
+    """Keyset pagination in the search's sort order (set `ordering` per request)."""
+    ordering = ORDERINGS['name']
+
+    def paginate_candidates(self, rows, queryset, request):
+        """
+        Keyset pagination over a text search's candidates (see candidates):
+        `rows` are sorted and cut here, then the page's products are loaded
+        from `queryset` by primary key.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        # Stable sorts, least significant field first
+        for name in reversed(self.ordering):
+            rows = sorted(rows, key=itemgetter(name.lstrip('-')), reverse=name.startswith('-'))
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            rows = [row for row in rows if self.row_after(row, position)]
+
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = SimpleNamespace(**rows[-1]) if rows else None
+        products = queryset.in_bulk([row['id'] for row in rows])
+        # Products retired since the candidates were cached drop out
+        self.page = []
+        for row in rows:
+            product = products.get(row['id'])
+            if product is not None:
+                product.rank = row.get('rank')
+                self.page.append(product)
+        return self.page
+
+    def row_after(self, row, position):
+        """Whether a candidate row is strictly after `position` in ordering order."""
+        for name in self.ordering:
+            field = name.lstrip('-')
+            if row[field] != position[field]:
+                return row[field] < position[field] if name.startswith('-') else row[field] > position[field]
+        return False
+
+    def to_python(self, model, field, value):
+        if field == 'rank':
+            return float(value)
+        return super().to_python(model, field, value)
+
+
+@lru_cache(maxsize=None)
+def has_trigram():
+    """Whether the trigram name index exists (migration 0002 needs pg_trgm to create it)."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'product_name_trgm_idx'")
+        return cursor.fetchone() is not None
+
+
+def _list(query_params, name):
+    """Repeated and comma-separated values of a query parameter."""
+    return sorted({value for raw in query_params.getlist(name) for value in raw.split(',') if value.strip()})
+
+
+def parse(query_params):
+    """
+    Validated search parameters from a query string:
+        q                       text query
+        category, vendor        one or more values (repeat or comma-separate)
+        min_price, max_price    min <= value < max, as facet buckets;
+        min_width, ...          likewise for width, depth and height (cm)
+        in_stock                true to hide products out of stock
+        sort                    relevance (default with q), name (default), price, -price
+    Raises ValueError with a message for the client.
+    """
+    params = {}
+    q = query_params.get('q', '').strip()
+    if q:
+        params['q'] = q[:MAX_QUERY_LENGTH]
+    categories = _list(query_params, 'category')
+    if categories:
+        params['category'] = categories
+    try:
+        vendors = sorted({int(value) for value in _list(query_params, 'vendor')})
+    except ValueError:
+        raise ValueError('vendor must be a list of ids')
+    if vendors:
+        params['vendor'] = vendors
+    for field in RANGE_FILTERS:
+        for bound in ('min', 'max'):
+            name = f'{bound}_{field}'
+            if query_params.get(name, '') == '':
+                continue
+            try:
+                value = float(query_params[name])
+            except ValueError:
+                value = math.nan
+            if not math.isfinite(value):
+                raise ValueError(f'{name} must be a number')
+            params[name] = value
+    if query_params.get('in_stock', '').lower() in ('1', 'true'):
+        params['in_stock'] = True
+
+    sort = query_params.get('sort') or ('relevance' if q else 'name')
+    if sort not in ORDERINGS:
+        raise ValueError(f'sort must be one of: {", ".join(ORDERINGS)}')
+    if sort == 'relevance' and not q:
+        raise ValueError('sort=relevance requires q')
+    params['sort'] = sort
+    return params
+
+
+def _text_match(q):
+    """(condition, rank expression or None) for a text query."""
+    if connection.vendor != 'postgresql':
+        return reduce(and_, (Q(name__icontains=term) for term in q.split())), None
+    query = SearchQuery(q, search_type='websearch', config=SEARCH_CONFIG)
+    condition = Q(search_vector=query)
+    rank = SearchRank(F('search_vector'), query)
+    if has_trigram():
+        condition |= Q(name__trigram_word_similar=q)
+        rank = rank + TrigramWordSimilarity(q, 'name')
+    return condition, rank
+
+
+def matching(params):
+    """Active products matching the parameters' text and filters, unordered."""
+    queryset = Product.objects.filter(is_active=True)
+    if 'q' in params:
+        queryset = queryset.filter(_text_match(params['q'])[0])
+    if 'category' in params:
+        queryset = queryset.filter(category__in=params['category'])
+    if 'vendor' in params:
+        queryset = queryset.filter(vendor_id__in=params['vendor'])
+    for field in RANGE_FILTERS:
+        if f'min_{field}' in params:
+            queryset = queryset.filter(**{f'{field}__gte': params[f'min_{field}']})
+        if f'max_{field}' in params:
+            queryset = queryset.filter(**{f'{field}__lt': params[f'max_{field}']})
+    if params.get('in_stock'):
+        queryset = queryset.filter(in_stock=True)
+    return queryset
+
+
+def digest(params):
+    """
+    Cache key part for a search's matches: its parameters apart from the
+    sort, which only picks a text search's candidates.
+    """
+    filters = {name: value for name, value in params.items() if name != 'sort' or 'q' in params}
+    encoded = json.dumps(filters, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:32]
+
+
+def candidates_key(params):
+    return f'catalog-candidates:{digest(params)}'
+
+
+def ordering(params):
+    """The ordering fields of a search's sort."""
+    if params['sort'] == 'relevance' and connection.vendor != 'postgresql':
+        # Substring matches have no rank
+        return ORDERINGS['name']
+    return ORDERINGS[params['sort']]
+
+
+def candidates(params):
+    """
+    The first CATALOG_SEARCH_CANDIDATES products matching a text search in
+    the search's ordering, as dicts of id, name, price and (on PostgreSQL)
+    rank; cached.
+    """
+    key = candidates_key(params)
+    rows = cache.get(key)
+    if rows is None:
+        queryset = matching(params)
+        fields = ['id', 'name', 'price']
+        rank = _text_match(params['q'])[1]
+        if rank is not None:
+            queryset = queryset.annotate(rank=rank)
+            fields.append('rank')
+        # Ordered, so the cut keeps the best matches rather than any
+        queryset = queryset.order_by(*ordering(params))
+        rows = list(queryset.values(*fields)[:settings.CATALOG_SEARCH_CANDIDATES])
+        cache.set(key, rows, settings.CATALOG_SEARCH_CACHE_TTL)
+    return rows
+
+
+def results(params):
+    """The active products a search pages through, unordered."""
+    if 'q' in params:
+        return Product.objects.filter(is_active=True, pk__in=[row['id'] for row in candidates(params)])
+    return matching(params)
+
+
+def browse(params):
+    """The ordered products of a search without text, for ProductPagination."""
+    return matching(params).order_by(*ordering(params))
+
+
+def indexed_queries():
+    """
+    The hot catalog queries and the index each must be able to use, as
+    (label, queryset, index name); checked by the query plan tests and
+    `manage.py check_query_plans`.
+    """
+    def first_page(query):
+        return browse(parse(QueryDict(query)))[:20]
+
+    queries = [
+        ('catalog text search', Product.objects.filter(_text_match('oak sofa')[0]), 'product_search_gin_idx'),
+        ('catalog by name', first_page('sort=name'), 'product_name_keyset_idx'),
+        ('catalog by price', first_page('sort=-price'), 'product_price_keyset_idx'),
+        ('catalog category by name', first_page('category=sofa&sort=name'), 'product_category_name_idx'),
+        ('catalog category by price', first_page('category=sofa&sort=price'), 'product_category_price_idx'),
+        ('catalog vendor by name', first_page('vendor=1&sort=name'), 'product_vendor_name_idx'),
+    ]
+    if has_trigram():
+        queries.append(
+            ('catalog fuzzy name', Product.objects.filter(name__trigram_word_similar='sofe'),
+             'product_name_trgm_idx')
+        )
+    return queries
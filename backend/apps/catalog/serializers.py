@@ -0,0 +1,34 @@
+"""
+Serializers for catalog models.
+"""
+from rest_framework import serializers
+from . import lods
+from .models import Vendor, Product
+
+
+class VendorSerializer(serializers.ModelSerializer):
+    """Serializer for vendors."""
+
+    class Meta:
+        model = Vendor
+        fields = ('id', 'name', 'website', 'logo_url')
+
+
+class ProductSerializer(serializers.ModelSerializer):
+    """Serializer for catalog products."""
+    vendor_name = serializers.CharField(source='vendor.name', read_only=True)
+    dimensions = serializers.DictField(read_only=True)
+    model = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = (
+            'id', 'vendor', 'vendor_name', 'sku', 'name', 'description', 'category', 'style',
+            'model_url', 'model', 'thumbnail_url', 'dimensions', 'color_options', 'price', 'in_stock',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = fields
+
+    def get_model(self, obj):
+        """Bounding box, sizes and LODs of the model; null until it is analysed."""
+        return lods.summary(obj)
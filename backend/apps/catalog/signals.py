@@ -0,0 +1,41 @@
+"""
+Signal handlers that keep the precomputed facet counts in step with
+product saves and deletes (see facets.py), and queue analysis of new
+product models (see lods.py).
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import facets, lods
+from .models import FACET_FIELDS, Product
+from .tasks import queue_analysis
+
+
+@receiver(pre_save, sender=Product)
+def load_facet_values(sender, instance, **kwargs):
+    """Read the stored facet values of products loaded without them."""
+    if instance._state.adding or hasattr(instance, '_loaded_facets'):
+        return
+    stored = Product.objects.filter(pk=instance.pk).values(*FACET_FIELDS).first()
+    instance._loaded_facets = stored
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+    current = facets.snapshot(instance)
+    facets.apply(facets.deltas(None if created else getattr(instance, '_loaded_facets', None), current))
+    instance._loaded_facets = current
+
+
+@receiver(post_save, sender=Product)
+def queue_model_analysis(sender, instance, raw=False, **kwargs):
+    """Analyse a saved product's model once the save commits, unless already done."""
+    if not raw and instance.model_url and not lods.is_current(instance):
+        url = instance.model_url
+        transaction.on_commit(lambda: queue_analysis([url]))
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    facets.apply(facets.deltas(getattr(instance, '_loaded_facets', None), None))
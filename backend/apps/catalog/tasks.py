@@ -0,0 +1,93 @@
+"""
+Celery tasks for the furniture catalog.
+"""
+import logging
+import tempfile
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+from . import lods
+from .ingest import IngestError, ingest
+from .models import Product, Vendor
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3)
+def ingest_feed(self, vendor_id, source, format=None, retire=True):
+    """
+    Ingest a vendor's product feed from a URL (see ingest.py). Failures to
+    fetch it are retried with backoff; a rerun only writes what is still
+    out of date.
+    """
+    vendor = Vendor.objects.filter(pk=vendor_id).first()
+    if vendor is None:
+        return {'status': 'failed', 'error': f'Vendor {vendor_id} not found'}
+    try:
+        report = ingest(vendor, source, format=format, retire=retire)
+    except IngestError as e:
+        return {'status': 'failed', 'error': str(e)}
+    except OSError as e:
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
+    return {'status': 'success', **report}
+
+
+@shared_task(bind=True, max_retries=3)
+def analyze_model(self, url, force=False):
+    """
+    Analyse the GLB model at `url` and build its LODs (see lods.py), and
+    record the metadata on every product using it. Models analysed before,
+    at this URL or (by content hash) another, are not processed again
+    unless `force`; fetch failures are retried with backoff.
+    """
+    if not force and not lods.stale([url]):
+        cache.delete(lods.queued_key(url))
+        return {'status': 'skipped', 'url': url}
+
+    products = Product.objects.filter(model_url=url)
+    metadata = None
+    if not force:
+        metadata = products.filter(model_metadata__source=url).values_list('model_metadata', flat=True).first()
+    if metadata is None:
+        with tempfile.NamedTemporaryFile(suffix='.glb') as file:
+            try:
+                digest = lods.download(url, file)
+            except OSError as e:
+                raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+            except ValueError as e:
+                metadata = {'error': str(e)}
+            else:
+                metadata = None if force else lods.cached(digest)
+                if metadata is None:
+                    try:
+                        metadata = lods.analyze(file.name, digest)
+                    except Exception as e:
+                        logger.warning('Cannot analyse model %s: %s', url, e)
+                        metadata = {'error': str(e)}
+    metadata = {**metadata, 'source': url}
+
+    updated = products.update(model_metadata=metadata)
+    cache.delete(lods.queued_key(url))
+    if 'error' in metadata:
+        return {'status': 'failed', 'url': url, 'error': metadata['error'], 'products': updated}
+    return {
+        'status': 'success',
+        'url': url,
+        'products': updated,
+        'triangles': metadata['triangles'],
+        'lods': [level['name'] for level in metadata['lods']],
+    }
+
+
+def queue_analysis(urls):
+    """
+    Queue analyze_model for each of the model `urls` some product has no
+    current metadata for, unless already queued. Returns the task ids.
+    """
+    task_ids = []
+    for url in sorted(lods.stale(urls)):
+        if cache.add(lods.queued_key(url), 1, timeout=settings.MODEL_ANALYSIS_QUEUED_TTL):
+            task_ids.append(analyze_model.delay(url).id)
+    return task_ids
@@ -0,0 +1,283 @@
+"""
+Tests for the catalog app.
+"""
+import gzip
+import json
+import os
+import struct
+import tempfile
+from decimal import Decimal
+from unittest import skipUnless
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.projects.querysets import index_plan
+
+from .glb import ARRAY_BUFFER, BIN_CHUNK, ELEMENT_ARRAY_BUFFER, GLB, InvalidModel, UnsupportedModel, Writer, inspect
+from .ingest import IngestError, ingest, read_feed
+from .lods import levels, pick
+from .models import Product, Vendor
+from .search import indexed_queries
+
+
+@override_settings(CATALOG_SEARCH_CANDIDATES=3, CATALOG_SEARCH_CACHE_TTL=0)
+class TextSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('shopper'))
+        vendor = Vendor.objects.create(name='Woodworks')
+        # Created most expensive first, so the first rows stored are the dearest
+        Product.objects.bulk_create([
+            Product(vendor=vendor, sku=f'OAK-{i}', name=f'Oak chair {i}', category='chair', price=Decimal(100 - i))
+            for i in range(10)
+        ])
+
+    def names(self, query):
+        response = self.client.get('/api/catalog/products/', query)
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_capped_search_keeps_the_cheapest(self):
+        self.assertEqual(
+            self.names({'q': 'oak chair', 'sort': 'price'}), ['Oak chair 9', 'Oak chair 8', 'Oak chair 7']
+        )
+
+    def test_capped_search_keeps_the_dearest(self):
+        self.assertEqual(
+            self.names({'q': 'oak chair', 'sort': '-price'}), ['Oak chair 0', 'Oak chair 1', 'Oak chair 2']
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTests(TestCase):
+    """The catalog's hot queries must stay servable from their indexes."""
+
+    def test_hot_queries_use_their_indexes(self):
+        for label, queryset, index in indexed_queries():
+            with self.subTest(label):
+                self.assertIn(index, index_plan(queryset))
+
+
+def chair(sku, price='100.00', **fields):
+    return {'sku': sku, 'name': f'Chair {sku}', 'category': 'Chair', 'price': price, **fields}
+
+
+class IngestTests(TestCase):
+
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name='Woodworks')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def feed(self, name, content):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def jsonl(self, rows, name='feed.jsonl'):
+        return self.feed(name, ''.join(json.dumps(row) + '\n' for row in rows))
+
+    def test_readers(self):
+        rows = [chair('A-1'), chair('A-2', color_options=['oak', 'ash'])]
+        csv_feed = self.feed('feed.csv', 'sku,name,category,price,color_options\nA-1,Chair A-1,Chair,100,\n'
+                             'A-2,Chair A-2,Chair,100,oak|ash\n')
+        feeds = [
+            csv_feed,
+            self.jsonl(rows),
+            self.jsonl(rows, 'feed.jsonl.gz'),
+            self.feed('feed.json', json.dumps(rows, indent=2)),
+        ]
+        for path in feeds:
+            with self.subTest(path):
+                self.assertEqual([row['sku'] for _, row, _ in read_feed(path)], ['A-1', 'A-2'])
+        with self.assertRaises(IngestError):
+            list(read_feed(self.feed('broken.json', '[{"sku": "A-1"}, oops]')))
+        with self.assertRaises(IngestError):
+            list(read_feed(self.feed('headless.csv', 'sku,name\nA-1,Chair\n')))
+
+    def test_rerun_writes_only_changed_rows(self):
+        rows = [chair(f'A-{i}') for i in range(5)]
+        report = ingest(self.vendor, self.jsonl(rows), batch_size=2)
+        self.assertEqual((report['inserted'], report['updated'], report['unchanged']), (5, 0, 0))
+
+        rows[0]['price'] = '120.00'
+        report = ingest(self.vendor, self.jsonl(rows), batch_size=2)
+        self.assertEqual((report['inserted'], report['updated'], report['unchanged']), (0, 1, 4))
+        self.assertEqual(Product.objects.get(sku='A-0').price, Decimal('120.00'))
+        self.assertEqual(Product.objects.get(sku='A-1').category, 'chair')
+
+    @override_settings(CATALOG_INGEST_COPY_ROWS=1)
+    def test_large_batches_are_staged(self):
+        # On PostgreSQL every batch goes through COPY; elsewhere through bulk writes
+        ingest(self.vendor, self.jsonl([chair('A-1'), chair('A-2')]))
+        report = ingest(self.vendor, self.jsonl([chair('A-1', price='90.00'), chair('A-3')]), retire=False)
+        self.assertEqual((report['inserted'], report['updated'], report['retired']), (1, 1, 0))
+        self.assertEqual(
+            dict(Product.objects.values_list('sku', 'price')),
+            {'A-1': Decimal('90.00'), 'A-2': Decimal('100.00'), 'A-3': Decimal('100.00')},
+        )
+        self.assertEqual(Product.objects.get(sku='A-3').model_metadata, {})
+
+    def test_products_missing_from_the_feed_are_retired(self):
+        ingest(self.vendor, self.jsonl([chair('A-1'), chair('A-2'), chair('A-3')]))
+        report = ingest(self.vendor, self.jsonl([chair('A-1')]))
+        self.assertEqual(report['retired'], 2)
+        self.assertEqual(set(Product.objects.filter(is_active=True).values_list('sku', flat=True)), {'A-1'})
+
+        report = ingest(self.vendor, self.jsonl([chair('A-1'), chair('A-2')]))
+        self.assertEqual((report['updated'], report['retired']), (1, 0))
+        self.assertTrue(Product.objects.get(sku='A-2').is_active)
+
+    def test_invalid_rows_are_not_retired(self):
+        ingest(self.vendor, self.jsonl([chair('A-1'), chair('A-2')]))
+        report = ingest(self.vendor, self.jsonl([chair('A-1'), chair('A-2', price='free')]))
+        self.assertEqual((report['invalid'], report['retired']), (1, 0))
+        self.assertIn('price', report['errors'][0])
+        product = Product.objects.get(sku='A-2')
+        self.assertTrue(product.is_active)
+        self.assertEqual(product.price, Decimal('100.00'))
+
+
+def grid_model(cells=20, translation=(1, 2, 3)):
+    """A flat unit square of cells x cells quads (two triangles each), moved by `translation`."""
+    steps = np.linspace(0, 1, cells + 1, dtype=np.float32)
+    x, y = np.meshgrid(steps, steps)
+    positions = np.column_stack([x.ravel(), y.ravel(), np.zeros(x.size, np.float32)])
+    corners = (np.arange(cells)[:, None] * (cells + 1) + np.arange(cells)).ravel()
+    triangles = np.concatenate([
+        np.column_stack([corners, corners + 1, corners + cells + 1]),
+        np.column_stack([corners + 1, corners + cells + 2, corners + cells + 1]),
+    ])
+    writer = Writer()
+    position = writer.add_accessor(positions, target=ARRAY_BUFFER, bounds=True)
+    indices = writer.add_accessor(triangles.reshape(-1, 1).astype(np.uint16), target=ELEMENT_ARRAY_BUFFER)
+    document = {
+        'asset': {'version': '2.0'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'translation': list(translation)}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': position}, 'indices': indices}]}],
+    }
+    return writer, document
+
+
+class GLBTests(TestCase):
+
+    def test_inspect(self):
+        writer, document = grid_model()
+        data = writer.build(document)
+        with tempfile.NamedTemporaryFile(suffix='.glb') as file:
+            file.write(data)
+            file.flush()
+            summary = inspect(GLB.from_file(file.name))
+        self.assertEqual(summary['bbox'], {'min': [1, 2, 3], 'max': [2, 3, 3], 'size': [1, 1, 0]})
+        self.assertEqual((summary['triangles'], summary['vertices'], summary['meshes']), (800, 441, 1))
+        self.assertEqual(summary['bytes'], len(data))
+
+    def test_accessors_are_read_in_place(self):
+        writer, document = grid_model(cells=2)
+        glb = GLB(writer.build(document))
+        positions = glb.accessor(0)
+        self.assertEqual(positions.shape, (9, 3))
+        self.assertFalse(positions.flags.owndata)
+        self.assertEqual(positions[4].tolist(), [0.5, 0.5, 0])
+        self.assertEqual(glb.triangles(document['meshes'][0]['primitives'][0]).shape, (8, 3))
+
+    def test_malformed_files_are_rejected(self):
+        writer, document = grid_model(cells=2)
+        data = writer.build(document)
+        cases = {
+            'too short': data[:8],
+            'not a GLB': b'glTX' + data[4:],
+            'truncated': data[:-4],
+            'chunk past the end': data[:12] + struct.pack('<I', len(data)) + data[16:],
+            'binary chunk first': data[:16] + struct.pack('<I', BIN_CHUNK) + data[20:],
+            'invalid JSON': data[:20] + b'[' + data[21:],
+        }
+        for label, content in cases.items():
+            with self.subTest(label), self.assertRaises(InvalidModel):
+                GLB(content)
+        with self.assertRaises(UnsupportedModel):
+            GLB(data[:4] + struct.pack('<I', 1) + data[8:])
+        with tempfile.NamedTemporaryFile(suffix='.glb') as file, self.assertRaises(InvalidModel):
+            GLB.from_file(file.name)
+
+    def test_references_outside_the_binary_chunk_are_rejected(self):
+        writer, document = grid_model(cells=2)
+        writer.accessors[0]['count'] += 1
+        glb = GLB(writer.build(document))
+        with self.assertRaisesMessage(InvalidModel, 'Accessor 0 runs past its buffer view'):
+            glb.accessor(0)
+        with self.assertRaisesMessage(InvalidModel, 'Invalid accessor 5'):
+            glb.accessor(5)
+
+        writer, document = grid_model(cells=2)
+        writer.buffer_views[1]['byteLength'] += 64
+        glb = GLB(writer.build(document))
+        with self.assertRaisesMessage(InvalidModel, 'Buffer view 1 runs past the binary chunk'):
+            glb.accessor(1)
+
+        writer, document = grid_model(cells=2)
+        document['nodes'][0]['mesh'] = 3
+        with self.assertRaisesMessage(InvalidModel, 'Node references unknown mesh 3'):
+            inspect(GLB(writer.build(document)))
+
+
+class LevelOfDetailTests(TestCase):
+
+    def test_levels_are_lighter_valid_models(self):
+        writer, document = grid_model()
+        glb = GLB(writer.build(document))
+        built = list(levels(glb))
+        self.assertEqual([name for name, _, _ in built], ['lod1', 'lod2', 'lod3'])
+        original = previous = inspect(glb)
+        for name, data, level in built:
+            with self.subTest(name):
+                summary = inspect(GLB(data))
+                self.assertLess(level['triangles'], previous['triangles'])
+                self.assertLess(level['bytes'], previous['bytes'])
+                self.assertEqual(level['triangles'], summary['triangles'])
+                # Clustering keeps vertices within the original's bounds
+                self.assertTrue(all(
+                    low >= outer - 1e-6 for low, outer in zip(summary['bbox']['min'], original['bbox']['min'])
+                ))
+                self.assertTrue(all(
+                    high <= outer + 1e-6 for high, outer in zip(summary['bbox']['max'], original['bbox']['max'])
+                ))
+                previous = summary
+
+    def product(self):
+        return Product(model_url='https://example.com/chair.glb', model_metadata={
+            'source': 'https://example.com/chair.glb', 'bbox': None,
+            'triangles': 10000, 'max_texture': 2048, 'bytes': 5000,
+            'lods': [
+                {'name': 'lod1', 'url': 'lod1.glb', 'triangles': 5000, 'max_texture': 1024, 'bytes': 2500},
+                {'name': 'lod2', 'url': 'lod2.glb', 'triangles': 2000, 'max_texture': 512, 'bytes': 1000},
+            ],
+        })
+
+    def test_pick(self):
+        product = self.product()
+        self.assertEqual(pick(product)['name'], 'original')
+        self.assertEqual(pick(product, triangles=1000)['name'], 'lod2')
+        self.assertEqual(pick(product, triangles=3000)['name'], 'lod1')
+        self.assertEqual(pick(product, triangles=1000, texture=1024)['name'], 'lod1')
+        self.assertEqual(pick(product, texture=4096)['name'], 'original')
+        # Needs beyond the original are capped at what it has
+        self.assertEqual(pick(product, triangles=50000)['url'], 'https://example.com/chair.glb')
+
+    def test_pick_needs_current_metadata(self):
+        product = self.product()
+        product.model_url = 'https://example.com/new-chair.glb'
+        self.assertIsNone(pick(product))
+        self.assertIsNone(pick(Product(model_url='https://example.com/chair.glb', model_metadata={
+            'source': 'https://example.com/chair.glb', 'error': 'Not a GLB file',
+        })))
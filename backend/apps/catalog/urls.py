@@ -0,0 +1,16 @@
+"""
+URL patterns for catalog endpoints.
+"""
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .views import ProductViewSet, VendorViewSet
+
+app_name = 'catalog'
+
+router = DefaultRouter()
+router.register(r'products', ProductViewSet, basename='product')
+router.register(r'vendors', VendorViewSet, basename='vendor')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
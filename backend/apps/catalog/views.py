@@ -0,0 +1,96 @@
+"""
+Views for browsing and searching the furniture catalog.
+"""
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from . import facets, lods, search
+from .models import Vendor, Product
+from .serializers import VendorSerializer, ProductSerializer
+
+
+class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only catalog products.
+
+    list: search with text, facet filters and sort (see search.parse)
+    retrieve: any product by id, including retired ones
+    facets: facet counts for the same search parameters, fetched
+            alongside the first page so counting never slows the results
+    model: the smallest version of a product's 3D model a scene needs
+    """
+    serializer_class = ProductSerializer
+    pagination_class = search.ProductPagination
+
+    def get_queryset(self):
+        return Product.objects.select_related('vendor')
+
+    def _params(self):
+        """Parsed search parameters; returns (params, error_response)."""
+        try:
+            return search.parse(self.request.query_params), None
+        except ValueError as e:
+            return None, Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def list(self, request, *args, **kwargs):
+        """
+        GET /api/catalog/products/?q=&category=&vendor=&min_price=&max_price=&sort=
+        Keyset-paginated search results: {next, results}
+        """
+        params, error = self._params()
+        if error:
+            return error
+        paginator = self.paginator
+        paginator.ordering = search.ordering(params)
+        if 'q' in params:
+            products = Product.objects.filter(is_active=True).select_related('vendor')
+            page = paginator.paginate_candidates(search.candidates(params), products, request)
+        else:
+            page = paginator.paginate_queryset(search.browse(params).select_related('vendor'), request, view=self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        GET /api/catalog/products/facets/?q=&category=&...
+        Facet counts for a search (same parameters as the list), or for
+        the whole catalog without any.
+        """
+        params, error = self._params()
+        if error:
+            return error
+        return Response(facets.search_counts(params, search.results(params)))
+
+    @action(detail=True, methods=['get'])
+    def model(self, request, pk=None):
+        """
+        GET /api/catalog/products/{id}/model/?triangles=&texture=
+        The smallest model (original or LOD) with at least `triangles`
+        triangles and `texture` pixels of texture resolution, with the
+        model's bounding box. Until the model is analysed, the original
+        with analyzed: false.
+        """
+        product = self.get_object()
+        if not product.model_url:
+            return Response({'error': 'Product has no model'}, status=status.HTTP_404_NOT_FOUND)
+        needs = {}
+        for name in ('triangles', 'texture'):
+            value = request.query_params.get(name, '')
+            if value:
+                try:
+                    needs[name] = int(value)
+                except ValueError:
+                    return Response({'error': f'{name} must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        picked = lods.pick(product, **needs)
+        if picked is None:
+            return Response({'name': 'original', 'url': product.model_url, 'analyzed': False})
+        return Response({**picked, 'bbox': product.model_metadata['bbox'], 'analyzed': True})
+
+
+class VendorViewSet(viewsets.ReadOnlyModelViewSet):
+    """Read-only list of active vendors."""
+    serializer_class = VendorSerializer
+    queryset = Vendor.objects.filter(is_active=True)
+    pagination_class = None
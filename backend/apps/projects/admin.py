@@ -12,16 +12,33 @@ class ProjectAdmin(admin.ModelAdmin):
     search_fields = ('name', 'owner__username')
     readonly_fields = ('created_at', 'updated_at')
 
+    def get_deleted_objects(self, objs, request):
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        # Versions cannot be deleted one by one, but go with their project
+        perms_needed.discard(Version._meta.verbose_name)
+        return deleted_objects, model_count, perms_needed, protected
+
+
+class ProjectChildAdmin(admin.ModelAdmin):
+    """
+    Images and variants are counted on their project (see signals.py),
+    so they cannot be moved to another one.
+    """
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly = super().get_readonly_fields(request, obj)
+        return (*readonly, 'project') if obj is not None else readonly
+
 
 @admin.register(ProjectImage)
-class ProjectImageAdmin(admin.ModelAdmin):
+class ProjectImageAdmin(ProjectChildAdmin):
     list_display = ('id', 'project', 'type', 'created_at')
     list_filter = ('type', 'created_at')
     search_fields = ('project__name',)
 
 
 @admin.register(DesignVariant)
-class DesignVariantAdmin(admin.ModelAdmin):
+class DesignVariantAdmin(ProjectChildAdmin):
     list_display = ('id', 'project', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('project__name',)
@@ -36,7 +53,20 @@ class ItemInstanceAdmin(admin.ModelAdmin):
 
 @admin.register(Version)
 class VersionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'project', 'created_at')
+    """
+    Read-only: versions are recorded through the API (see versioning.py),
+    and deleting one would break the delta chain of every later version.
+    """
+    list_display = ('id', 'project', 'sequence', 'is_keyframe', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('project__name',)
 
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
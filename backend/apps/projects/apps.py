@@ -0,0 +1,14 @@
+"""
+App configuration for projects.
+"""
+from django.apps import AppConfig
+
+
+class ProjectsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.projects'
+    label = 'projects'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
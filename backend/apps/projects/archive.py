@@ -0,0 +1,382 @@
+"""
+Streaming project archives: export a whole project as a ZIP and load it back.
+
+Archive layout:
+    manifest.json       archive format, source project id and name
+    images.jsonl        one row per line, in creation order
+    variants.jsonl
+    items.jsonl         masks as base64 RLE (see masks.py)
+    versions.jsonl      history in stored form (keyframes and deltas)
+    assets/images/<id>.<ext>, assets/variants/<id>.<ext>
+                        the stored image bytes; rows name theirs in `asset`
+    missing.json        assets that could not be fetched during export
+
+export_chunks() writes the ZIP into a small buffer that is drained after
+every few rows, reads rows in chunks with .iterator() and fetches assets
+with at most EXPORT_FETCH_CONCURRENCY downloads in flight, so memory use
+does not depend on the size of the project. import_archive() reads the
+entries line by line and inserts them with bulk_create in batches.
+"""
+import base64
+import io
+import json
+import os
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from apps.catalog.models import Product
+
+from . import masks
+from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version
+from .storage import get_upload_backend
+
+ARCHIVE_FORMAT = 1
+# Drain the ZIP buffer to the client once it holds this many bytes
+FLUSH_BYTES = 64 * 1024
+# Metadata that points at storage or rows of the source project
+_SOURCE_METADATA = ('derivatives', 'renders', 'reused_from', 'cloudinary_id', 'storage_id')
+
+
+class InvalidArchive(ValueError):
+    """Raised for archives that cannot be imported."""
+
+
+class _Sink:
+    """Unseekable write target for ZipFile that is drained as it fills."""
+
+    def __init__(self):
+        self._chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.buffered += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.buffered = 0
+        return data
+
+
+def bounded_map(function, iterable, concurrency):
+    """
+    map() over a thread pool, in input order, with at most `concurrency`
+    calls running or finished-but-unconsumed at any time.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        for item in iterable:
+            pending.append(pool.submit(function, item))
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _asset_name(kind, row_id, url):
+    extension = os.path.splitext(urlparse(url).path)[1].lower() or '.bin'
+    return f'assets/{kind}/{row_id}{extension}'
+
+
+def _image_row(image):
+    return {
+        'id': image.id,
+        'type': image.type,
+        'image_url': image.image_url,
+        'metadata': image.metadata,
+        'content_hash': image.content_hash,
+        'perceptual_hash': image.perceptual_hash,
+        'created_at': image.created_at,
+        'asset': _asset_name('images', image.id, image.image_url),
+    }
+
+
+def _variant_row(variant):
+    return {
+        'id': variant.id,
+        'image_url': variant.image_url,
+        'metadata': variant.metadata,
+        'created_at': variant.created_at,
+        'asset': _asset_name('variants', variant.id, variant.image_url),
+    }
+
+
+def _item_row(item):
+    return {
+        'id': item.id,
+        'variant': item.variant_id,
+        'name': item.name,
+        'category': item.category,
+        'product': item.product_id,
+        'bbox': item.bbox,
+        'mask': masks.payload(item),
+        'mask_url': item.mask_url,
+        'transform': item.transform,
+        'created_at': item.created_at,
+    }
+
+
+def _version_row(version):
+    return {
+        'id': version.id,
+        'sequence': version.sequence,
+        'is_keyframe': version.is_keyframe,
+        'payload': version.payload,
+        'payload_zlib': base64.b64encode(bytes(version.payload_zlib)).decode('ascii')
+        if version.payload_zlib is not None else None,
+        'prompt': version.prompt,
+        'created_at': version.created_at,
+    }
+
+
+def _entries(project):
+    """(entry name, rows queryset, row function) in archive order."""
+    return [
+        ('images.jsonl', project.images.order_by('created_at', 'id'), _image_row),
+        ('variants.jsonl', project.variants.order_by('created_at', 'id'), _variant_row),
+        ('items.jsonl', ItemInstance.objects.filter(project=project).order_by('variant_id', 'created_at', 'id'),
+         _item_row),
+        ('versions.jsonl', project.versions.order_by('sequence'), _version_row),
+    ]
+
+
+def _fetch(asset):
+    name, url = asset
+    try:
+        return name, get_upload_backend().fetch(url), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+def _write_assets(archive, sink, project, chunk_size):
+    """Fetch and add the stored image bytes, recording any that fail."""
+    assets = (
+        (_asset_name(kind, row_id, url), url)
+        for kind, rows in (('images', project.images), ('variants', project.variants))
+        for row_id, url in rows.order_by('created_at', 'id').values_list('id', 'image_url').iterator(
+            chunk_size=chunk_size
+        )
+    )
+    missing = {}
+    for name, content, error in bounded_map(_fetch, assets, settings.EXPORT_FETCH_CONCURRENCY):
+        if content is None:
+            missing[name] = error
+            continue
+        # Images are already compressed
+        archive.writestr(name, content, compress_type=zipfile.ZIP_STORED)
+        yield sink.drain()
+    archive.writestr('missing.json', json.dumps(missing))
+
+
+def export_chunks(project, include_assets=True):
+    """Yield the project's ZIP archive as a sequence of byte chunks."""
+    sink = _Sink()
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('manifest.json', json.dumps({
+            'format': ARCHIVE_FORMAT,
+            'project': {'id': project.id, 'name': project.name, 'created_at': project.created_at},
+            'assets': include_assets,
+        }, cls=DjangoJSONEncoder))
+
+        for name, rows, to_row in _entries(project):
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for row in rows.iterator(chunk_size=chunk_size):
+                    entry.write(json.dumps(to_row(row), cls=DjangoJSONEncoder).encode() + b'\n')
+                    if sink.buffered >= FLUSH_BYTES:
+                        yield sink.drain()
+            yield sink.drain()
+
+        if include_assets:
+            yield from _write_assets(archive, sink, project, chunk_size)
+    yield sink.drain()
+
+
+def _lines(archive, name):
+    if name not in archive.NameToInfo:
+        return
+    with archive.open(name) as entry:
+        for line in io.TextIOWrapper(entry, encoding='utf-8'):
+            if line.strip():
+                yield json.loads(line)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def _clean_metadata(metadata):
+    return {key: value for key, value in (metadata or {}).items() if key not in _SOURCE_METADATA}
+
+
+class _AssetUploader:
+    """Re-stores archived image bytes through the upload backend."""
+
+    def __init__(self, archive, project, enabled):
+        self.archive = archive
+        self.project = project
+        self.backend = get_upload_backend() if enabled else None
+        self.skip = set(json.loads(archive.read('missing.json'))) if 'missing.json' in archive.NameToInfo else set()
+        self.uploaded = 0
+
+    def _available(self, row):
+        name = row.get('asset')
+        return self.backend is not None and name and name not in self.skip and name in self.archive.NameToInfo
+
+    def _store(self, job):
+        row, public_id, content, extension = job
+        return row, public_id, self.backend.store_derivative(public_id, content, extension)
+
+    def apply(self, rows):
+        """
+        Drop metadata tied to the source project's storage, then point each
+        row with an archived asset at a newly stored copy.
+        """
+        for row in rows:
+            row['metadata'] = _clean_metadata(row.get('metadata'))
+        jobs = (
+            (
+                row,
+                f'dreamspace/projects/{self.project.id}/{uuid.uuid4().hex}',
+                self.archive.read(row['asset']),
+                os.path.splitext(row['asset'])[1].lstrip('.') or 'bin',
+            )
+            for row in rows if self._available(row)
+        )
+        for row, public_id, url in bounded_map(self._store, jobs, settings.EXPORT_FETCH_CONCURRENCY):
+            row['image_url'] = url
+            row['metadata'] = dict(row['metadata'], **{self.backend.metadata_key: public_id})
+            self.uploaded += 1
+
+
+def import_archive(source, owner, name=None, batch_size=500, upload_assets=True):
+    """
+    Create a new project for `owner` from an export archive (a path or
+    binary file). Runs in one transaction; returns (project, counts).
+    Row ids are remapped; created_at is the import time, with the
+    original order preserved.
+    """
+    from .tasks import generate_derivatives
+
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise InvalidArchive('Not a ZIP archive')
+    with archive:
+        try:
+            manifest = json.loads(archive.read('manifest.json'))
+        except (KeyError, ValueError):
+            raise InvalidArchive('manifest.json is missing or invalid')
+        if manifest.get('format') != ARCHIVE_FORMAT:
+            raise InvalidArchive(f'Unsupported archive format: {manifest.get("format")}')
+
+        counts = {}
+        with transaction.atomic():
+            project = Project.objects.create(name=name or manifest['project']['name'], owner=owner)
+            assets = _AssetUploader(archive, project, upload_assets)
+            image_ids, variant_ids = {}, {}
+
+            for batch in _batches(_lines(archive, 'images.jsonl'), batch_size):
+                assets.apply(batch)
+                created = ProjectImage.objects.bulk_create([
+                    ProjectImage(
+                        project=project,
+                        type=row['type'],
+                        image_url=row['image_url'],
+                        metadata=row['metadata'],
+                        content_hash=row.get('content_hash', ''),
+                        perceptual_hash=row.get('perceptual_hash', ''),
+                    )
+                    for row in batch
+                ])
+                image_ids.update((row['id'], image.id) for row, image in zip(batch, created))
+            counts['images'] = len(image_ids)
+
+            for batch in _batches(_lines(archive, 'variants.jsonl'), batch_size):
+                assets.apply(batch)
+                variants = []
+                for row in batch:
+                    metadata = row['metadata']
+                    if metadata.get('base_image_id') in image_ids:
+                        metadata['base_image_id'] = image_ids[metadata['base_image_id']]
+                    variants.append(DesignVariant(project=project, owner=owner, image_url=row['image_url'],
+                                                  metadata=metadata))
+                created = DesignVariant.objects.bulk_create(variants)
+                variant_ids.update((row['id'], variant.id) for row, variant in zip(batch, created))
+            counts['variants'] = len(variant_ids)
+
+            counts['items'] = 0
+            for batch in _batches(_lines(archive, 'items.jsonl'), batch_size):
+                # Catalog products are shared; keep references this catalog has
+                products = set(Product.objects.filter(
+                    pk__in={row['product'] for row in batch if row.get('product')}
+                ).values_list('pk', flat=True))
+                items = []
+                for row in batch:
+                    if row['variant'] not in variant_ids:
+                        raise InvalidArchive(f'Item {row["id"]} references unknown variant {row["variant"]}')
+                    item = ItemInstance(
+                        variant_id=variant_ids[row['variant']],
+                        project=project,
+                        owner=owner,
+                        name=row['name'],
+                        category=row['category'],
+                        product_id=row.get('product') if row.get('product') in products else None,
+                        mask_url=row.get('mask_url'),
+                        transform=row.get('transform') or {},
+                    )
+                    item.bbox = row.get('bbox')
+                    if row.get('mask'):
+                        try:
+                            fields = masks.parse(row['mask'])
+                        except masks.InvalidMask as e:
+                            raise InvalidArchive(f'Item {row["id"]}: {e}')
+                        for field, value in fields.items():
+                            setattr(item, field, value)
+                    items.append(item)
+                ItemInstance.objects.bulk_create(items)
+                counts['items'] += len(items)
+
+            counts['versions'] = 0
+            for batch in _batches(_lines(archive, 'versions.jsonl'), batch_size):
+                # Stored form is inserted as-is; Version.save() would re-encode
+                Version.objects.bulk_create([
+                    Version(
+                        project=project,
+                        sequence=row['sequence'],
+                        is_keyframe=row['is_keyframe'],
+                        payload=row['payload'],
+                        payload_zlib=base64.b64decode(row['payload_zlib']) if row['payload_zlib'] else None,
+                        prompt=row.get('prompt', ''),
+                    )
+                    for row in batch
+                ])
+                counts['versions'] += len(batch)
+
+            counts['assets'] = assets.uploaded
+
+            def queue_derivatives():
+                # bulk_create sends no post_save, so queue the derivatives here
+                for image_id in image_ids.values():
+                    generate_derivatives.delay('projectimage', image_id)
+                for variant_id in variant_ids.values():
+                    generate_derivatives.delay('designvariant', variant_id)
+
+            transaction.on_commit(queue_derivatives)
+
+    return project, counts
@@ -0,0 +1,78 @@
+"""
+Conditional GETs and a server-side response cache for project reads.
+
+Every write to a project's images, variants or versions bumps
+Project.revision, every write to a variant's items bumps
+DesignVariant.revision (see signals.py), saving the project itself changes
+updated_at, and buffered item edits change the project's write-behind
+stamp (see writebehind.py). Together they identify the project's state,
+so a response for a given URL can be keyed by (URL, revision, item
+revisions, updated_at, stamp), where the item revisions are those of the
+one variant a response covers, or their sum over the project's variants
+(revisions only grow, and adding or removing a variant bumps the
+project's revision):
+- the key's hash is the response ETag; a matching If-None-Match is
+  answered with 304 before any related rows are loaded
+- serialized bodies are cached under the key in the cache alias
+  settings.RESPONSE_CACHE_ALIAS, so stale entries are never read again
+  and simply expire after RESPONSE_CACHE_TTL seconds
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import writebehind
+
+
+def response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def response_key(request, project, variant=None):
+    """Hash of the requested URL and the state of the project, or of one of its variants."""
+    renderer = getattr(request, 'accepted_renderer', None)
+    if variant is not None:
+        item_revision = variant.revision
+    else:
+        item_revision = project.variants.order_by().aggregate(total=Sum('revision'))['total'] or 0
+    identity = '|'.join([
+        request.build_absolute_uri(),
+        getattr(renderer, 'format', ''),
+        str(project.pk),
+        str(project.revision),
+        str(item_revision),
+        project.updated_at.isoformat(),
+        str(writebehind.stamp(project.pk)),
+    ])
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+def conditional_response(request, project, render, variant=None):
+    """
+    Return the response for `project` (or only its `variant`) at
+    `request`'s URL: 304 if the client's copy is current, else the cached
+    body, else `render()` (a callable returning a Response), caching its
+    data.
+    """
+    key = response_key(request, project, variant)
+    etag = f'"{key}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match.strip() == '*' or etag in parse_etags(if_none_match):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cache = response_cache()
+    data = cache.get(f'project-response:{key}')
+    if data is None:
+        response = render()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        cache.set(f'project-response:{key}', data, settings.RESPONSE_CACHE_TTL)
+    return Response(data, headers=headers)
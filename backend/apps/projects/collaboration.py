@@ -0,0 +1,320 @@
+"""
+Live collaborative editing of a variant's items over a WebSocket.
+
+    ws(s)://<host>/api/projects/variants/{id}/live/?token=<token>
+
+where the token comes from POST /api/projects/variants/{id}/live-token/
+(browsers cannot set an Authorization header on a WebSocket).
+
+On connecting, the client receives the variant's items:
+    {"type": "snapshot", "session": <this connection's id>, "items": [<state>]}
+where a state is {"id", "version", "name", "category", "product", "bbox",
+"transform"}. It then sends edits of items' transform and bounding box,
+each based on the item version the client last saw:
+    {"type": "ops", "ops": [{"id", "version", "transform"?, "bbox"?}]}
+
+Edits are coalesced per item (the latest value of each field wins) and
+written once per LIVE_FRAME_MS frame window, with one conditional UPDATE
+per item that increments its version. An edit based on an older version
+than the item's is rejected, since someone else changed the item first,
+and the client is sent the current state to rebase on:
+    {"type": "rejected", "items": [<state> or {"id", "deleted": true}]}
+A client's own earlier writes are not conflicts, so a drag can keep
+sending edits based on the version it started from.
+
+Written edits, and items changed through the REST API, are published on
+the variant's realtime channel (see realtime.py), so every viewer in every
+API process receives them, also coalesced per frame window:
+    {"type": "items", "items": [<state> + "session"], "deleted": [id, ...]}
+"session" is the writer's connection id (null for REST writes); a client
+recognizes its own writes by it and takes their new versions.
+
+Invalid messages are answered with {"type": "error", "error": <message>}.
+"""
+import asyncio
+import json
+import uuid
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from rest_framework import serializers
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import writebehind
+from .models import DesignVariant, ItemInstance
+from .realtime import get_broker
+from .serializers import BBoxField
+from .streams import url_token_user, user_for_token
+
+STATE_FIELDS = (
+    'id', 'version', 'name', 'category', 'product_id', 'transform',
+    'bbox_x', 'bbox_y', 'bbox_width', 'bbox_height',
+)
+MAX_MESSAGE_BYTES = 256 * 1024
+# Close codes (4000-4999 are free for applications)
+CLOSE_FORBIDDEN = 4403
+CLOSE_GONE = 4410
+
+
+def channel_name(variant_id):
+    return f'variant-items:{variant_id}'
+
+
+def _state(row):
+    return {
+        'id': row['id'],
+        'version': row['version'],
+        'name': row['name'],
+        'category': row['category'],
+        'product': row['product_id'],
+        'bbox': {'x': row['bbox_x'], 'y': row['bbox_y'], 'width': row['bbox_width'], 'height': row['bbox_height']},
+        'transform': row['transform'],
+    }
+
+
+def item_state(item):
+    """The live state of an ItemInstance."""
+    return _state({field: getattr(item, field) for field in STATE_FIELDS})
+
+
+def publish_items(variant_id, items=(), deleted=(), session=None):
+    """Send item states and deleted item ids to the variant's live viewers."""
+    get_broker().publish(
+        channel_name(variant_id), {'session': session, 'items': list(items), 'deleted': list(deleted)}
+    )
+
+
+def snapshot(variant_id):
+    """The states of a variant's items, in canvas order."""
+    rows = ItemInstance.objects.filter(variant_id=variant_id).order_by('created_at', 'id').values(*STATE_FIELDS)
+    return [_state(row) for row in writebehind.overlay_rows(list(rows))]
+
+
+def parse_op(op):
+    """(item id, base version, {column: value}) of one edit; raises ValueError."""
+    if not isinstance(op, dict):
+        raise ValueError('Each operation must be an object.')
+    try:
+        item_id, version = int(op['id']), int(op['version'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Each operation needs an integer id and version.')
+    fields = {}
+    if 'transform' in op:
+        if not isinstance(op['transform'], dict):
+            raise ValueError('transform must be an object.')
+        fields['transform'] = op['transform']
+    if 'bbox' in op:
+        try:
+            fields.update(BBoxField().to_internal_value(op['bbox']))
+        except serializers.ValidationError as e:
+            raise ValueError(f'bbox: {e.detail[0]}')
+    if not fields:
+        raise ValueError('Each operation must set transform or bbox.')
+    return item_id, version, fields
+
+
+def write_ops(variant, ops, written, session):
+    """
+    Apply coalesced edits ({item id: (base version, fields)}) to a variant's
+    items in one transaction. `written` holds the versions this session
+    wrote last, which an edit may be based on without knowing. Returns
+    (accepted states, rejected states), or None if the project is gone.
+    """
+    accepted_ids = []
+    with transaction.atomic():
+        # Also serializes concurrent sessions' writes to the variant
+        if not DesignVariant.objects.filter(pk=variant.id, project__deleted_at__isnull=True).update(
+            revision=F('revision') + 1
+        ):
+            return None
+        # Edits based on buffered versions need those written first
+        writebehind.flush(item_ids=list(ops))
+        for item_id, (base, fields) in sorted(ops.items()):
+            expected = max(base, written.get(item_id, base))
+            if ItemInstance.objects.filter(pk=item_id, variant_id=variant.id, version=expected).update(
+                version=F('version') + 1, **fields
+            ):
+                accepted_ids.append(item_id)
+        states = {
+            row['id']: _state(row)
+            for row in ItemInstance.objects.filter(pk__in=list(ops), variant_id=variant.id).values(*STATE_FIELDS)
+        }
+        accepted = [states[item_id] for item_id in accepted_ids]
+        if accepted:
+            transaction.on_commit(lambda: publish_items(variant.id, accepted, session=session))
+    rejected = [
+        states.get(item_id, {'id': item_id, 'deleted': True})
+        for item_id in sorted(ops) if item_id not in accepted_ids
+    ]
+    return accepted, rejected
+
+
+def _in_thread(func):
+    """Run a database function from async code, like a request would."""
+    def run(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=True)
+
+
+class Session:
+    """One client's live connection to a variant."""
+
+    def __init__(self, variant, send):
+        self.id = uuid.uuid4().hex
+        self.variant = variant
+        self._send = send
+        self.pending = {}  # item id -> (base version, fields), not yet written
+        self.written = {}  # item id -> version this session last wrote
+        self.outgoing = {}  # item id -> state, not yet sent
+        self.deleted = set()
+
+    async def send(self, message):
+        await self._send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def receive(self, message):
+        """Queue the edits in a client message; answers invalid ones with an error."""
+        text = message.get('text')
+        if text is None:
+            text = (message.get('bytes') or b'').decode('utf-8', 'replace')
+        try:
+            if len(text) > MAX_MESSAGE_BYTES:
+                raise ValueError(f'Messages are limited to {MAX_MESSAGE_BYTES} bytes.')
+            try:
+                data = json.loads(text)
+            except ValueError:
+                raise ValueError('Invalid JSON.')
+            if not isinstance(data, dict) or data.get('type') != 'ops' or not isinstance(data.get('ops'), list):
+                raise ValueError('Expected {"type": "ops", "ops": [...]}.')
+            if len(data['ops']) > settings.LIVE_MAX_OPS:
+                raise ValueError(f'At most {settings.LIVE_MAX_OPS} operations per message.')
+            ops = [parse_op(op) for op in data['ops']]
+        except ValueError as e:
+            await self.send({'type': 'error', 'error': str(e)})
+            return
+        for item_id, version, fields in ops:
+            previous = self.pending.get(item_id, (version, {}))[1]
+            self.pending[item_id] = (version, {**previous, **fields})
+
+    def queue(self, update):
+        """Queue a published update for sending, keeping each item's newest state."""
+        for state in update['items']:
+            current = self.outgoing.get(state['id'])
+            if current is None or state['version'] >= current['version']:
+                self.outgoing[state['id']] = {**state, 'session': update['session']}
+        for item_id in update['deleted']:
+            self.outgoing.pop(item_id, None)
+            self.deleted.add(item_id)
+
+    async def write(self, notify=True):
+        """
+        Write the pending edits; returns False if the variant's project is gone.
+        Rejections are sent to the client unless `notify` is off.
+        """
+        ops, self.pending = self.pending, {}
+        result = await _in_thread(write_ops)(self.variant, ops, self.written, self.id)
+        if result is None:
+            return False
+        accepted, rejected = result
+        for state in accepted:
+            self.written[state['id']] = state['version']
+        if rejected and notify:
+            await self.send({'type': 'rejected', 'items': rejected})
+        return True
+
+    async def flush(self):
+        """End a frame window: write pending edits and send queued updates."""
+        if self.pending and not await self.write():
+            return False
+        if self.outgoing or self.deleted:
+            items = [self.outgoing[item_id] for item_id in sorted(self.outgoing)]
+            await self.send({'type': 'items', 'items': items, 'deleted': sorted(self.deleted)})
+            self.outgoing, self.deleted = {}, set()
+        return True
+
+    async def run(self, receive, subscription):
+        """Serve the connection until the client disconnects or the project is deleted."""
+        loop = asyncio.get_running_loop()
+        frame = settings.LIVE_FRAME_MS / 1000
+        receiving = asyncio.ensure_future(receive())
+        listening = asyncio.ensure_future(subscription.get(timeout=settings.SSE_HEARTBEAT_SECONDS))
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                done, _ = await asyncio.wait(
+                    {receiving, listening}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if receiving in done:
+                    message = receiving.result()
+                    if message['type'] == 'websocket.disconnect':
+                        return
+                    await self.receive(message)
+                    receiving = asyncio.ensure_future(receive())
+                if listening in done:
+                    update = listening.result()
+                    if update is not None:
+                        self.queue(update)
+                    listening = asyncio.ensure_future(subscription.get(timeout=settings.SSE_HEARTBEAT_SECONDS))
+
+                if deadline is None:
+                    if self.pending or self.outgoing or self.deleted:
+                        deadline = loop.time() + frame
+                elif loop.time() >= deadline:
+                    deadline = None
+                    if not await self.flush():
+                        await self._send({'type': 'websocket.close', 'code': CLOSE_GONE})
+                        return
+        finally:
+            receiving.cancel()
+            listening.cancel()
+            if self.pending:
+                # Keep the last edits of a client that disconnected mid-frame;
+                # the socket may be closed, so nothing is sent
+                await self.write(notify=False)
+
+
+def live_scope(variant_id):
+    return f'live:{variant_id}'
+
+
+async def _user(scope, pk):
+    """The user of a WebSocket handshake: JWT in the Authorization header or a live ?token=."""
+    header = dict(scope.get('headers') or []).get(b'authorization')
+    if header:
+        return await user_for_token(JWTAuthentication().get_raw_token(header))
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [''])[0]
+    return await url_token_user(token, live_scope(pk))
+
+
+async def variant_socket(scope, receive, send, pk):
+    """ASGI WebSocket application for /api/projects/variants/{pk}/live/."""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    user = await _user(scope, pk)
+    variant = None
+    if user is not None:
+        variant = await DesignVariant.objects.filter(
+            pk=pk, owner=user, project__deleted_at__isnull=True
+        ).only('id', 'project_id').afirst()
+    if variant is None:
+        # Closing before accepting refuses the handshake
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    # Subscribe before reading the snapshot so no update is missed
+    subscription = await get_broker().subscribe(channel_name(variant.id))
+    try:
+        session = Session(variant, send)
+        items = await _in_thread(snapshot)(variant.id)
+        await send({'type': 'websocket.accept'})
+        await session.send({'type': 'snapshot', 'session': session.id, 'items': items})
+        await session.run(receive, subscription)
+    finally:
+        await subscription.close()
@@ -0,0 +1,86 @@
+"""
+Responsive derivatives of project images and design variants.
+
+Each ProjectImage and DesignVariant is rendered once, by the
+generate_derivatives task, into a fixed set of resized copies stored
+through the upload backend and recorded in metadata:
+    metadata['derivatives'] = {
+        "thumb": {"url", "width", "height", "format"},
+        "medium": {...},
+        "webp": {...},
+        "source": <image_url the derivatives were rendered from>,
+    }
+Serializers expose them with srcset(), so grids and strips load a
+thumbnail instead of the full-size original.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# name -> (max width, Pillow format, save options). Images are never upscaled.
+DERIVATIVES = {
+    'thumb': (320, 'JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+    'medium': (1024, 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': (1024, 'WEBP', {'quality': 80, 'method': 4}),
+}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+# Refuse to decode absurdly large sources (decompression bombs)
+MAX_SOURCE_PIXELS = 50_000_000
+
+
+def _resize(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def render(content):
+    """
+    Render every derivative of the image bytes in `content`.
+    Returns {name: (bytes, width, height, format)}.
+    """
+    image = Image.open(BytesIO(content))
+    if image.width * image.height > MAX_SOURCE_PIXELS:
+        raise ValueError('Source image is too large')
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    resized = {}
+    rendered = {}
+    for name, (width, image_format, options) in DERIVATIVES.items():
+        # Derivatives sharing a width share one resample
+        if width not in resized:
+            resized[width] = _resize(image, width)
+        output = BytesIO()
+        resized[width].save(output, image_format, **options)
+        rendered[name] = (output.getvalue(), resized[width].width, resized[width].height, image_format)
+    return rendered
+
+
+def is_current(obj):
+    """True if `obj` already has derivatives of its current image."""
+    derivatives = (obj.metadata or {}).get('derivatives') or {}
+    return derivatives.get('source') == obj.image_url and all(name in derivatives for name in DERIVATIVES)
+
+
+def srcset(obj):
+    """
+    Map of derivative name -> URL for `obj`, plus the original.
+    Until the derivatives are rendered only the original is listed.
+    """
+    return srcset_map(obj.image_url, (obj.metadata or {}).get('derivatives'))
+
+
+def srcset_map(image_url, derivatives):
+    """srcset() from an image URL and its metadata['derivatives']."""
+    if not image_url:
+        return None
+    urls = {'original': image_url}
+    derivatives = derivatives or {}
+    if derivatives.get('source') == image_url:
+        for name in DERIVATIVES:
+            if name in derivatives:
+                urls[name] = derivatives[name]['url']
+    return urls
@@ -0,0 +1,130 @@
+"""
+Upload fingerprints for reusing already-stored photos.
+
+Every uploaded ProjectImage records two hashes:
+- content_hash: SHA-256 of the file bytes (exact duplicates)
+- perceptual_hash: 64-bit difference hash (dHash) of the pixels, as 16
+  hex digits. Re-encoded, resized or re-exported copies of a photo differ
+  in only a few bits (near duplicates).
+
+Before storing a new upload, find_duplicate() looks for an image of the
+same owner with the same content hash, or a perceptual hash within
+settings.UPLOAD_DUPLICATE_DISTANCE bits, and reuse() points a new
+ProjectImage at the existing asset instead of uploading it again.
+
+The distance defaults to 0: similar but different photos of a room can
+also be a few bits apart, and reusing one silently replaces the other.
+Near matches are looked up by hash band (models.PHASH_BANDS), so the
+distance is capped at one bit less than the number of bands.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .models import PHASH_BANDS, ProjectImage, phash_band
+
+HASH_SIZE = 8
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def perceptual_hash(image):
+    """
+    dHash of a PIL image: shrink to 9x8 greyscale and record whether each
+    pixel is brighter than its right neighbour.
+    """
+    small = ImageOps.exif_transpose(image).convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:016x}'
+
+
+def fingerprint(content):
+    """
+    Return {'content_hash', 'perceptual_hash'} for file bytes.
+    perceptual_hash is empty if the bytes are not a readable image.
+    """
+    try:
+        phash = perceptual_hash(Image.open(BytesIO(content)))
+    except Exception:
+        phash = ''
+    return {'content_hash': content_hash(content), 'perceptual_hash': phash}
+
+
+def distance(a, b):
+    """Number of differing bits between two perceptual hashes."""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def find_duplicate(owner, content_hash='', perceptual_hash=''):
+    """
+    Return the owner's stored image matching the fingerprint, or None.
+    Exact matches use the content_hash index; near matches only compare
+    the images sharing a hash band, found through the band indexes.
+    """
+    # Not from deleted projects, whose files are about to be removed
+    images = ProjectImage.objects.filter(project__owner=owner, project__deleted_at__isnull=True)
+    if content_hash:
+        exact = images.filter(content_hash=content_hash).order_by('created_at', 'id').first()
+        if exact:
+            return exact
+
+    max_distance = min(settings.UPLOAD_DUPLICATE_DISTANCE, PHASH_BANDS - 1)
+    if not perceptual_hash or max_distance < 0:
+        return None
+    if max_distance == 0:
+        return images.filter(perceptual_hash=perceptual_hash).order_by('created_at', 'id').first()
+
+    best = None
+    for image_id, candidate in near_candidates(images, perceptual_hash).values_list('id', 'perceptual_hash'):
+        bits = distance(perceptual_hash, candidate)
+        if bits <= max_distance and (best is None or bits < best[0]):
+            best = (bits, image_id)
+            if bits == 0:
+                break
+    return ProjectImage.objects.get(pk=best[1]) if best else None
+
+
+def near_candidates(images, perceptual_hash):
+    """
+    The images sharing at least one hash band with `perceptual_hash`: every
+    hash fewer than PHASH_BANDS bits away is among them.
+    """
+    bands = {f'band{band}': phash_band(band) for band in range(PHASH_BANDS)}
+    shared = Q()
+    for band in range(PHASH_BANDS):
+        shared |= Q(**{f'band{band}': perceptual_hash[band * 4:band * 4 + 4]})
+    return images.alias(**bands).filter(shared).order_by('created_at', 'id')
+
+
+def reuse(duplicate, project, image_type):
+    """
+    Record `duplicate`'s stored asset as an image of `project` without
+    uploading it again. Returns (project_image, created); an identical
+    image already in the project is returned as is.
+    """
+    existing = project.images.filter(
+        type=image_type,
+        image_url=duplicate.image_url,
+    ).first()
+    if existing:
+        return existing, False
+    image = ProjectImage.objects.create(
+        project=project,
+        type=image_type,
+        image_url=duplicate.image_url,
+        metadata=dict(duplicate.metadata, reused_from=duplicate.id),
+        content_hash=duplicate.content_hash,
+        perceptual_hash=duplicate.perceptual_hash,
+    )
+    return image, True
@@ -0,0 +1,137 @@
+"""
+Content-addressed deduplication for variant generation.
+
+Every generation request is keyed by a hash of the base image identity,
+the prompt and the generation parameters:
+- while a generation for a key is in flight, duplicates attach to its task
+- once it finishes, the resulting variant is reused for
+  GENERATION_CACHE_TTL seconds (or until the variant is deleted)
+
+Hit/miss counters are kept in the cache and exposed by generation_stats().
+
+Each user may also hold at most GENERATION_MAX_CONCURRENT_PER_USER queued
+or running generations (acquire_slots/release_slots), so one user cannot
+monopolize the worker pool, and fair_priority() orders queued tasks so
+users with fewer generations in flight are served first.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+INFLIGHT_PREFIX = 'generation-inflight:'
+RESULT_PREFIX = 'generation-result:'
+STATS_PREFIX = 'generation-stats:'
+SLOTS_PREFIX = 'generation-slots:'
+STATS = ('hits', 'inflight_joins', 'misses')
+
+
+def generation_key(base_image, prompt, params=None):
+    """Hash identifying the output of one generation request."""
+    identity = {
+        'image': base_image.metadata.get('cloudinary_id') or base_image.image_url,
+        'image_id': base_image.id,
+        'prompt': ' '.join(prompt.split()),
+        'params': params or {},
+    }
+    encoded = json.dumps(identity, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _count(stat):
+    key = STATS_PREFIX + stat
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+
+def claim(key, task_id):
+    """
+    Look up `key` before queueing a generation.
+    Returns ('cached', result), ('inflight', task_id) or ('new', task_id).
+    """
+    result = cache.get(RESULT_PREFIX + key)
+    if result is not None:
+        _count('hits')
+        return 'cached', result
+    if cache.add(INFLIGHT_PREFIX + key, task_id, timeout=settings.GENERATION_INFLIGHT_TTL):
+        _count('misses')
+        return 'new', task_id
+    existing = cache.get(INFLIGHT_PREFIX + key)
+    if existing is None:
+        # The in-flight generation just finished; retry once against the result
+        return claim(key, task_id)
+    _count('inflight_joins')
+    return 'inflight', existing
+
+
+def record_result(key, task_id, variant):
+    """Cache a finished generation and release the in-flight claim."""
+    cache.set(
+        RESULT_PREFIX + key,
+        {'task_id': task_id, 'variant_id': variant.id, 'image_url': variant.image_url},
+        timeout=settings.GENERATION_CACHE_TTL,
+    )
+    cache.delete(INFLIGHT_PREFIX + key)
+
+
+def release(key):
+    """Drop the in-flight claim of a failed generation so it can be retried."""
+    cache.delete(INFLIGHT_PREFIX + key)
+
+
+def evict(key):
+    """Forget a cached result, e.g. when its variant is deleted."""
+    cache.delete(RESULT_PREFIX + key)
+
+
+def generation_stats():
+    values = cache.get_many([STATS_PREFIX + stat for stat in STATS])
+    stats = {stat: values.get(STATS_PREFIX + stat, 0) for stat in STATS}
+    lookups = sum(stats.values())
+    reused = stats['hits'] + stats['inflight_joins']
+    stats['hit_rate'] = round(reused / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def acquire_slots(user_id, count):
+    """
+    Reserve `count` generation slots for a user. Returns False (reserving
+    nothing) if that would exceed the per-user limit. Slots expire with the
+    in-flight TTL so a crashed worker cannot lock a user out for good.
+    """
+    key = SLOTS_PREFIX + str(user_id)
+    cache.add(key, 0, timeout=settings.GENERATION_INFLIGHT_TTL)
+    try:
+        in_use = cache.incr(key, count)
+    except ValueError:
+        cache.set(key, count, timeout=settings.GENERATION_INFLIGHT_TTL)
+        in_use = count
+    if in_use > settings.GENERATION_MAX_CONCURRENT_PER_USER:
+        release_slots(user_id, count)
+        return False
+    return True
+
+
+def release_slots(user_id, count):
+    key = SLOTS_PREFIX + str(user_id)
+    try:
+        if cache.decr(key, count) < 0:
+            cache.delete(key)
+    except ValueError:
+        # Expired; nothing left to release
+        pass
+
+
+def fair_priority(user_id, base):
+    """
+    Celery priority for a user's next generation task (0 is served first).
+    Users with more generations in flight are pushed back, so one heavy
+    user's queue does not delay everyone else.
+    """
+    in_use = cache.get(SLOTS_PREFIX + str(user_id), 0)
+    return max(0, min(9, base + in_use // 2))
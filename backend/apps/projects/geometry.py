@@ -0,0 +1,125 @@
+"""
+Bounding-box geometry for item spatial queries.
+
+ItemInstance stores its bbox as typed columns (bbox_x, bbox_y, bbox_width,
+bbox_height). On PostgreSQL the expressions below build native `box`
+values over them, served by a GiST index on (variant, ItemBox()). Other
+databases (tests, local SQLite) use the in-memory RTree instead (see
+spatial.py).
+"""
+import math
+
+from django.db.models import BooleanField, F, Func, Value
+
+
+class Point(Func):
+    function = 'point'
+    arity = 2
+
+
+class Box(Func):
+    function = 'box'
+    arity = 2
+
+    @classmethod
+    def from_bounds(cls, x1, y1, x2, y2):
+        return cls(Point(Value(float(x1)), Value(float(y1))), Point(Value(float(x2)), Value(float(y2))))
+
+
+class ItemBox(Box):
+    """box() of an ItemInstance's bbox columns (the indexed expression)."""
+
+    def __init__(self, **extra):
+        super().__init__(
+            Point(F('bbox_x'), F('bbox_y')),
+            Point(F('bbox_x') + F('bbox_width'), F('bbox_y') + F('bbox_height')),
+            **extra
+        )
+
+
+class Overlaps(Func):
+    """`a && b`: the boxes intersect (touching edges count)."""
+    arg_joiner = ' && '
+    template = '(%(expressions)s)'
+    arity = 2
+    output_field = BooleanField()
+
+
+class Contains(Func):
+    """`a @> b`: box a contains box b."""
+    arg_joiner = ' @> '
+    template = '(%(expressions)s)'
+    arity = 2
+    output_field = BooleanField()
+
+
+def intersects(a, b):
+    """Closed-interval intersection of two (x1, y1, x2, y2) boxes, like `&&`."""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def overlap_area(a, b):
+    """Area shared by two (x1, y1, x2, y2) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return width * height if width > 0 and height > 0 else 0.0
+
+
+class RTree:
+    """
+    Static R-tree over (id, x1, y1, x2, y2) entries, bulk-loaded with
+    Sort-Tile-Recursive packing: entries are sorted into vertical slices
+    by x, then packed into nodes by y, level by level.
+    """
+
+    def __init__(self, entries, capacity=16):
+        self.capacity = capacity
+        # Leaves: (x1, y1, x2, y2, id); inner nodes: (x1, y1, x2, y2, children)
+        level = [(x1, y1, x2, y2, item_id) for item_id, x1, y1, x2, y2 in entries]
+        self.root = None
+        self.height = 0
+        if not level:
+            return
+        while True:
+            level = self._pack(level)
+            self.height += 1
+            if len(level) == 1:
+                break
+        self.root = level[0]
+
+    def _pack(self, boxes):
+        capacity = self.capacity
+        node_count = math.ceil(len(boxes) / capacity)
+        slices = math.ceil(math.sqrt(node_count))
+        per_slice = slices * capacity
+        boxes = sorted(boxes, key=lambda b: b[0] + b[2])
+        nodes = []
+        for start in range(0, len(boxes), per_slice):
+            column = sorted(boxes[start:start + per_slice], key=lambda b: b[1] + b[3])
+            for offset in range(0, len(column), capacity):
+                children = column[offset:offset + capacity]
+                nodes.append((
+                    min(b[0] for b in children),
+                    min(b[1] for b in children),
+                    max(b[2] for b in children),
+                    max(b[3] for b in children),
+                    children,
+                ))
+        return nodes
+
+    def search(self, x1, y1, x2, y2):
+        """Ids of entries intersecting the box (touching edges count)."""
+        if self.root is None:
+            return []
+        query = (x1, y1, x2, y2)
+        found = []
+        stack = [(self.root, self.height)]
+        while stack:
+            node, depth = stack.pop()
+            for child in node[4]:
+                if intersects(child, query):
+                    if depth == 1:
+                        found.append(child[4])
+                    else:
+                        stack.append((child, depth - 1))
+        return found
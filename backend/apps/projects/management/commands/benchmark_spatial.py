@@ -0,0 +1,108 @@
+"""
+Benchmark the item spatial queries on a synthetic variant.
+
+Creates one variant with --items randomly placed items inside a
+transaction that is rolled back afterwards, then times region queries,
+point hit-tests and the overlap report for each available implementation
+against a linear scan, checking they return the same items.
+"""
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.projects.geometry import RTree
+from apps.projects.models import Project, DesignVariant, ItemInstance
+from apps.projects.spatial import PostgresSpatialQueries, RTreeSpatialQueries, linear_scan
+
+CANVAS = (4000, 3000)
+
+
+class Command(BaseCommand):
+    help = 'Time region, hit-test and overlap queries on a variant with many items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, items=5000, queries=200, seed=0, **options):
+        rng = random.Random(seed)
+        with transaction.atomic():
+            variant = self._variant(rng, items)
+            self._run(rng, variant, items, queries)
+            transaction.set_rollback(True)
+
+    def _variant(self, rng, count):
+        user = User.objects.create(username=f'spatial-benchmark-{uuid.uuid4().hex[:8]}')
+        project = Project.objects.create(name='Spatial benchmark', owner=user)
+        variant = DesignVariant.objects.create(project=project, image_url='https://example.com/benchmark.jpg')
+        ItemInstance.objects.bulk_create(
+            [
+                ItemInstance(
+                    variant=variant,
+                    name=f'item {index}',
+                    category='benchmark',
+                    bbox_x=rng.uniform(0, CANVAS[0]),
+                    bbox_y=rng.uniform(0, CANVAS[1]),
+                    bbox_width=rng.uniform(20, 300),
+                    bbox_height=rng.uniform(20, 300),
+                )
+                for index in range(count)
+            ],
+            batch_size=1000,
+        )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {ItemInstance._meta.db_table}')
+        return variant
+
+    def _time(self, label, runs, function):
+        started = time.perf_counter()
+        results = [function(*args) for args in runs]
+        elapsed = (time.perf_counter() - started) / max(1, len(runs))
+        self.stdout.write(f'  {label:<28} {elapsed * 1000:9.3f} ms/query')
+        return results
+
+    def _run(self, rng, variant, count, queries):
+        items = ItemInstance.objects.filter(variant=variant)
+        regions = []
+        for _ in range(queries):
+            x, y = rng.uniform(0, CANVAS[0]), rng.uniform(0, CANVAS[1])
+            regions.append((x, y, x + rng.uniform(50, 600), y + rng.uniform(50, 600)))
+        points = [(rng.uniform(0, CANVAS[0]), rng.uniform(0, CANVAS[1])) for _ in range(queries)]
+
+        implementations = [('r-tree', RTreeSpatialQueries())]
+        if connection.vendor == 'postgresql':
+            implementations.insert(0, ('postgres gist', PostgresSpatialQueries()))
+
+        self.stdout.write(f'{count} items, {queries} queries ({connection.vendor})')
+        self.stdout.write('region:')
+        expected = self._time('linear scan', regions, lambda *r: sorted(linear_scan(items, *r)))
+        boxes = RTreeSpatialQueries()._boxes(items)
+        tree = RTree((item_id, *bounds) for item_id, bounds in boxes.items())
+        self._check('r-tree (prebuilt)', expected, self._time(
+            'r-tree (prebuilt, search)', regions, lambda *r: sorted(tree.search(*r))
+        ))
+        for label, spatial in implementations:
+            self._check(label, expected, self._time(
+                label, regions, lambda *r: sorted(spatial.region(items, *r).values_list('id', flat=True))
+            ))
+
+        self.stdout.write('hit test:')
+        for label, spatial in implementations:
+            self._time(label, points, lambda x, y: list(spatial.hit_test(items, x, y).values_list('id', flat=True)))
+
+        self.stdout.write('overlaps:')
+        reports = [self._time(label, [()], lambda: spatial.overlaps(variant.id)) for label, spatial in implementations]
+        pair_sets = [{(a, b) for a, b, _ in report[0]} for report in reports]
+        self.stdout.write(f'  {len(pair_sets[0])} overlapping pairs')
+        if any(pairs != pair_sets[0] for pairs in pair_sets):
+            self.stdout.write(self.style.ERROR('  overlap reports differ between implementations'))
+
+    def _check(self, label, expected, actual):
+        if actual != expected:
+            self.stdout.write(self.style.ERROR(f'  {label} returned different items than the linear scan'))
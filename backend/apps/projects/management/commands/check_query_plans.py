@@ -0,0 +1,36 @@
+"""
+Check that PostgreSQL can serve the hot queries from their indexes
+(querysets.indexed_queries and the catalog's search.indexed_queries).
+The test suite runs the same check (QueryPlanTests in each app's tests);
+this command reports every query at once, optionally with its plan.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.catalog.search import indexed_queries as catalog_queries
+from apps.projects.querysets import index_plan, indexed_queries
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot project and catalog queries and fail if an expected index is not used'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def handle(self, *args, verbose_plans=False, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans can only be checked on PostgreSQL')
+
+        failures = []
+        for label, queryset, index in indexed_queries() + catalog_queries():
+            plan = index_plan(queryset)
+            if verbose_plans:
+                self.stdout.write(f'{label}:\n{plan}\n')
+            if index in plan:
+                self.stdout.write(f'ok       {label} ({index})')
+            else:
+                self.stdout.write(f'MISSING  {label} ({index})')
+                failures.append(label)
+
+        if failures:
+            raise CommandError(f'Expected indexes not used by: {", ".join(failures)}')
@@ -0,0 +1,35 @@
+"""
+Load a project export archive (GET /api/projects/{id}/export/) as a new
+project. Entries are read line by line and inserted in batches, so large
+archives import in constant memory; see archive.py.
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.projects.archive import InvalidArchive, import_archive
+
+
+class Command(BaseCommand):
+    help = 'Import a project export archive for a user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='Path to the .zip export')
+        parser.add_argument('--owner', required=True, help='Username of the new project owner')
+        parser.add_argument('--name', help='Project name (default: the exported name)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--skip-assets', action='store_true',
+                            help='Keep the exported image URLs instead of re-storing the archived files')
+
+    def handle(self, *args, archive, owner, name=None, batch_size=500, skip_assets=False, **options):
+        try:
+            user = User.objects.get(username=owner)
+        except User.DoesNotExist:
+            raise CommandError(f'Unknown user: {owner}')
+        try:
+            project, counts = import_archive(
+                archive, user, name=name, batch_size=batch_size, upload_assets=not skip_assets
+            )
+        except (InvalidArchive, OSError) as e:
+            raise CommandError(str(e))
+        summary = ', '.join(f'{count} {label}' for label, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Imported project {project.id} ({summary})'))
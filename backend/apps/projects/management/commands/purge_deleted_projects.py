@@ -0,0 +1,19 @@
+"""
+Queue purge_project for every tombstoned project, e.g. after purges that
+ran out of retries. Purging is idempotent, so re-queuing is safe.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.projects.models import Project
+from apps.projects.tasks import purge_project
+
+
+class Command(BaseCommand):
+    help = 'Queue purge_project for projects that were deleted but not yet purged'
+
+    def handle(self, *args, **options):
+        queued = 0
+        for project_id in Project.objects.filter(deleted_at__isnull=False).values_list('id', flat=True).iterator():
+            purge_project.delay(project_id)
+            queued += 1
+        self.stdout.write(f'Projects: queued {queued}')
@@ -0,0 +1,26 @@
+"""
+Queue responsive derivatives for images and variants that lack them,
+e.g. rows created before the derivative pipeline existed.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.projects import derivatives
+from apps.projects.models import ProjectImage, DesignVariant
+from apps.projects.tasks import generate_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Queue generate_derivatives for images and variants without current derivatives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render existing derivatives too')
+
+    def handle(self, *args, force=False, **options):
+        for model in (ProjectImage, DesignVariant):
+            queued = 0
+            rows = model.objects.only('id', 'image_url', 'metadata').iterator(chunk_size=500)
+            for obj in rows:
+                if force or not derivatives.is_current(obj):
+                    generate_derivatives.delay(model._meta.model_name, obj.id, force=force)
+                    queued += 1
+            self.stdout.write(f'{model.__name__}: queued {queued}')
@@ -0,0 +1,203 @@
+"""
+Run-length encoded segmentation masks.
+
+Masks are stored inline on ItemInstance (mask_rle, mask_height,
+mask_width, mask_area) in COCO-style RLE: the pixels are read in column-
+major order and stored as alternating run lengths, starting with a run
+of background (0) pixels, which may be empty. The run lengths are packed
+as LEB128 varints (7 bits per byte, high bit = more bytes follow), so a
+typical object mask takes a few hundred bytes. The API sends them
+base64-encoded:
+    {"size": [height, width], "counts": "<base64>", "area": <pixels>}
+
+Encoding and decoding are vectorized with NumPy; area is computed from
+the runs without decoding.
+"""
+import base64
+import binascii
+
+import numpy as np
+
+# Refuse masks larger than this (decoding allocates one byte per pixel)
+MAX_PIXELS = 50_000_000
+# Largest run length a varint may hold (unpacked into int64)
+MAX_RUN = 2 ** 63 - 1
+
+
+class InvalidMask(ValueError):
+    """Raised for malformed RLE data."""
+
+
+def pack_varints(values):
+    """Pack integers from 0 to MAX_RUN as LEB128 varints."""
+    try:
+        values = np.asarray(values, dtype=np.uint64)
+    except OverflowError:
+        raise InvalidMask('Run length too large')
+    if values.size == 0:
+        return b''
+    if values.max() > MAX_RUN:
+        raise InvalidMask('Run length too large')
+    # One 7-bit group, plus one per 7-bit threshold reached (exact in integers)
+    groups = np.ones(values.shape, dtype=np.int64)
+    for shift in range(7, 64, 7):
+        groups += values >= np.uint64(1 << shift)
+
+    # One output byte per 7-bit group: value index and group number
+    owner = np.repeat(np.arange(values.size), groups)
+    starts = np.cumsum(groups) - groups
+    group = np.arange(owner.size) - starts[owner]
+    data = (values[owner] >> (7 * group).astype(np.uint64)) & np.uint64(0x7F)
+    more = group < groups[owner] - 1
+    return (data | (more.astype(np.uint64) << np.uint64(7))).astype(np.uint8).tobytes()
+
+
+def unpack_varints(data):
+    """Inverse of pack_varints."""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if raw[-1] & 0x80:
+        raise InvalidMask('Truncated run length')
+    ends = np.flatnonzero((raw & 0x80) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.arange(raw.size) - np.repeat(starts, ends - starts + 1)
+    if group.max() > 8:
+        raise InvalidMask('Run length too large')
+    parts = (raw & 0x7F).astype(np.int64) << (7 * group)
+    return np.add.reduceat(parts, starts)
+
+
+def encode(mask):
+    """
+    Encode a 2-D mask (non-zero = foreground).
+    Returns (rle_bytes, height, width, area).
+    """
+    mask = np.asarray(mask)
+    if mask.ndim != 2:
+        raise InvalidMask('Mask must be two-dimensional')
+    height, width = mask.shape
+    flat = mask.ravel(order='F') != 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(boundaries)
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return pack_varints(counts), height, width, int(flat.sum())
+
+
+def counts_of(rle, height, width):
+    """Run lengths of an RLE mask, checked against its size."""
+    counts = unpack_varints(rle)
+    pixels = height * width
+    # Bound each run first: a sum of unchecked int64 runs can wrap around
+    if counts.size and int(counts.max()) > pixels:
+        raise InvalidMask(f'Run lengths cover more than {pixels} pixels')
+    total = sum(counts.tolist())
+    if total != pixels:
+        raise InvalidMask(f'Run lengths cover {total} pixels, expected {pixels}')
+    return counts
+
+
+def decode(rle, height, width):
+    """Decode to a (height, width) boolean array."""
+    counts = counts_of(rle, height, width)
+    values = np.arange(counts.size) % 2 == 1
+    flat = np.repeat(values, counts)
+    return flat.reshape((width, height)).T
+
+
+def area(rle):
+    """Foreground pixels: the sum of the odd (foreground) runs."""
+    return int(unpack_varints(rle)[1::2].sum())
+
+
+def iou(first, second):
+    """Intersection over union of two decoded masks of the same size."""
+    if first.shape != second.shape:
+        return 0.0
+    union = np.logical_or(first, second).sum()
+    if not union:
+        return 0.0
+    return float(np.logical_and(first, second).sum() / union)
+
+
+def label_map(masks, height, width):
+    """
+    Merge masks into one label map: pixel value k is masks[k - 1]'s label,
+    0 is background. Later masks are drawn over earlier ones.
+    `masks` is a list of decoded boolean arrays.
+    """
+    labels = np.zeros((height, width), dtype=np.uint32)
+    for index, mask in enumerate(masks, start=1):
+        labels[mask] = index
+    return labels
+
+
+def encode_labels(labels):
+    """
+    Run-length encode a label map (column-major).
+    Returns (values_bytes, counts_bytes): each run's label and length.
+    """
+    flat = np.asarray(labels).ravel(order='F')
+    if flat.size == 0:
+        return b'', b''
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    counts = np.diff(np.concatenate((starts, [flat.size])))
+    return pack_varints(flat[starts]), pack_varints(counts)
+
+
+def payload(item):
+    """API representation of an item's inline mask, or None."""
+    if item.mask_height is None:
+        return None
+    return {
+        'size': [item.mask_height, item.mask_width],
+        'counts': to_base64(bytes(item.mask_rle)),
+        'area': item.mask_area,
+    }
+
+
+def parse(data):
+    """
+    Validate an API mask {size: [height, width], counts} where counts is
+    base64 RLE or a plain list of run lengths. Returns model field values.
+    """
+    if not isinstance(data, dict):
+        raise InvalidMask('Expected an object with size and counts.')
+    size = data.get('size')
+    if (not isinstance(size, (list, tuple)) or len(size) != 2
+            or not all(isinstance(n, int) and not isinstance(n, bool) and n > 0 for n in size)):
+        raise InvalidMask('size must be [height, width] with positive integers.')
+    height, width = size
+    if height * width > MAX_PIXELS:
+        raise InvalidMask('Mask is too large.')
+    counts = data.get('counts')
+    if isinstance(counts, str):
+        rle = from_base64(counts)
+    elif isinstance(counts, list):
+        if not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in counts):
+            raise InvalidMask('counts must be non-negative integers.')
+        if any(n > height * width for n in counts):
+            raise InvalidMask(f'Run lengths cover more than {height * width} pixels')
+        rle = pack_varints(counts)
+    else:
+        raise InvalidMask('counts must be a base64 string or a list of run lengths.')
+    runs = counts_of(rle, height, width)
+    return {
+        'mask_rle': rle,
+        'mask_height': height,
+        'mask_width': width,
+        'mask_area': int(runs[1::2].sum()),
+    }
+
+
+def to_base64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def from_base64(text):
+    try:
+        return base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidMask('counts is not valid base64')
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:42
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counts(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+
+    def child_count(model_name):
+        model = apps.get_model('projects', model_name)
+        counts = (
+            model.objects.filter(project=OuterRef('pk'))
+            .order_by()
+            .values('project')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    Project.objects.update(
+        cached_image_count=child_count('ProjectImage'),
+        cached_variant_count=child_count('DesignVariant'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='cached_image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='cached_variant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,186 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:05
+
+import json
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The encoding as of this migration, frozen here so later changes to
+# versioning.py cannot change what it writes or reads.
+KEYFRAME_INTERVAL = max(1, getattr(settings, 'VERSION_KEYFRAME_INTERVAL', 20))
+COMPRESS_THRESHOLD = getattr(settings, 'VERSION_COMPRESS_THRESHOLD', 2048)
+
+
+def _escape(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def _same(a, b):
+    # 1 == True and 1 == 1.0 in Python, but not in JSON
+    return type(a) is type(b) and a == b
+
+
+def make_patch(old, new, path=''):
+    """Return the list of patch operations that turn `old` into `new`."""
+    if _same(old, new):
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f'{path}/{_escape(key)}'})
+        for key, value in new.items():
+            child = f'{path}/{_escape(key)}'
+            if key not in old:
+                ops.append({'op': 'add', 'path': child, 'value': value})
+            else:
+                ops.extend(make_patch(old[key], value, child))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        common = min(len(old), len(new))
+        for index in range(common):
+            ops.extend(make_patch(old[index], new[index], f'{path}/{index}'))
+        for index in range(common, len(new)):
+            ops.append({'op': 'add', 'path': f'{path}/{index}', 'value': new[index]})
+        # Remove from the end so earlier indexes stay valid
+        for index in range(len(old) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': f'{path}/{index}'})
+        return ops
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def _apply_op(doc, tokens, op, value):
+    """
+    Apply one operation, copying only the containers along the path so
+    earlier snapshots that share structure with `doc` are left untouched.
+    """
+    if not tokens:
+        if op == 'remove':
+            raise ValueError('Cannot remove the document root')
+        return value
+
+    if isinstance(doc, list):
+        container = list(doc)
+        key = len(container) if tokens[0] == '-' else int(tokens[0])
+    elif isinstance(doc, dict):
+        container = dict(doc)
+        key = tokens[0]
+    else:
+        raise ValueError(f'Cannot resolve path token {tokens[0]!r}')
+
+    if len(tokens) > 1:
+        container[key] = _apply_op(container[key], tokens[1:], op, value)
+    elif op == 'remove':
+        del container[key]
+    elif op == 'add' and isinstance(container, list):
+        container.insert(key, value)
+    else:
+        container[key] = value
+    return container
+
+
+def apply_patch(doc, ops):
+    """Return a new document with `ops` applied to `doc`."""
+    for operation in ops:
+        path = operation['path']
+        tokens = [_unescape(token) for token in path.split('/')[1:]] if path else []
+        doc = _apply_op(doc, tokens, operation['op'], operation.get('value'))
+    return doc
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+
+def encode_payload(value):
+    """Return (payload, payload_zlib); exactly one of them is set."""
+    raw = _dumps(value).encode()
+    if len(raw) > COMPRESS_THRESHOLD:
+        return None, zlib.compress(raw)
+    return value, None
+
+
+def decode_payload(payload, payload_zlib):
+    if payload_zlib is not None:
+        return json.loads(zlib.decompress(bytes(payload_zlib)))
+    return payload
+
+
+def encode_version(previous_snapshot, snapshot, sequence):
+    """
+    Choose how to store `snapshot` as version number `sequence`.
+    Returns (is_keyframe, payload, payload_zlib).
+    """
+    is_keyframe = previous_snapshot is None or (sequence - 1) % KEYFRAME_INTERVAL == 0
+    if not is_keyframe:
+        ops = make_patch(previous_snapshot, snapshot)
+        # Rewrites of most of the scene are cheaper as a keyframe
+        if len(_dumps(ops)) < len(_dumps(snapshot)):
+            return (False,) + encode_payload(ops)
+    return (True,) + encode_payload(snapshot)
+
+
+
+def encode_history(apps, schema_editor):
+    """Convert full snapshots into keyframes and JSON-patch deltas."""
+    Version = apps.get_model('projects', 'Version')
+    project_ids = Version.objects.values_list('project_id', flat=True).distinct().order_by()
+    for project_id in project_ids.iterator():
+        previous = None
+        versions = Version.objects.filter(project_id=project_id).order_by('created_at', 'id')
+        for sequence, version in enumerate(versions.iterator(), start=1):
+            version.sequence = sequence
+            version.is_keyframe, version.payload, version.payload_zlib = encode_version(
+                previous, version.snapshot, sequence
+            )
+            version.save(update_fields=['sequence', 'is_keyframe', 'payload', 'payload_zlib'])
+            previous = version.snapshot
+
+
+def decode_history(apps, schema_editor):
+    """Rebuild full snapshots from keyframes and deltas."""
+    Version = apps.get_model('projects', 'Version')
+    state = None
+    for version in Version.objects.order_by('project_id', 'sequence').iterator():
+        data = decode_payload(version.payload, version.payload_zlib)
+        state = data if version.is_keyframe else apply_patch(state, data)
+        version.snapshot = state
+        version.save(update_fields=['snapshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_project_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='sequence',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='is_keyframe',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='payload',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='payload_zlib',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(encode_history, decode_history),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Drops the full snapshots that 0003 rewrote into keyframes and deltas,
+    and makes sequence numbers unique within a project.
+    """
+
+    dependencies = [
+        ('projects', '0003_version_deltas'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='version',
+            name='snapshot',
+        ),
+        migrations.AddConstraint(
+            model_name='version',
+            constraint=models.UniqueConstraint(fields=('project', 'sequence'), name='unique_version_sequence'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0004_remove_version_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='designvariant',
+            index=models.Index(fields=['project', '-created_at', '-id'], name='variant_project_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='iteminstance',
+            index=models.Index(fields=['variant', '-created_at', '-id'], name='item_variant_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='version',
+            index=models.Index(fields=['project', '-created_at', '-id'], name='version_project_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_owners(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    DesignVariant = apps.get_model('projects', 'DesignVariant')
+    ItemInstance = apps.get_model('projects', 'ItemInstance')
+
+    DesignVariant.objects.update(
+        owner_id=Subquery(Project.objects.filter(pk=OuterRef('project_id')).values('owner_id')[:1])
+    )
+    variants = DesignVariant.objects.filter(pk=OuterRef('variant_id'))
+    ItemInstance.objects.update(
+        project_id=Subquery(variants.values('project_id')[:1]),
+        owner_id=Subquery(variants.values('owner_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('projects', '0007_project_revision'),
+    ]
+
+    operations = [
+        # Nullable until backfilled; 0009 makes them required
+        migrations.AddField(
+            model_name='designvariant',
+            name='owner',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='owner',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='project',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projects.project'),
+        ),
+        migrations.RunPython(backfill_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    Makes the owner and project columns backfilled by 0008 required.
+    Separate from 0008 because the backfill writes these foreign keys,
+    leaving deferred constraint checks pending, and PostgreSQL rejects
+    ALTER TABLE on a table with pending trigger events.
+    """
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('projects', '0008_denormalized_owner'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='designvariant',
+            name='owner',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='iteminstance',
+            name='owner',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='iteminstance',
+            name='project',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projects.project'),
+        ),
+        migrations.AddIndex(
+            model_name='designvariant',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='variant_owner_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='iteminstance',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='item_owner_keyset_idx'),
+        ),
+    ]
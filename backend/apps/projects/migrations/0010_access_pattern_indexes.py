@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:02
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_denormalized_owner_required'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='designvariant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['metadata'], name='variant_metadata_gin_idx', opclasses=['jsonb_path_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', '-updated_at'], name='project_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=models.Index(fields=['project', 'type', 'created_at'], name='image_project_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['metadata'], name='image_metadata_gin_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
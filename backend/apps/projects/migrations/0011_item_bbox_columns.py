@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:20
+
+from django.db import migrations, models
+
+BBOX_KEYS = (('bbox_x', 'x'), ('bbox_y', 'y'), ('bbox_width', 'width'), ('bbox_height', 'height'))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def bbox_to_columns(apps, schema_editor):
+    ItemInstance = apps.get_model('projects', 'ItemInstance')
+    batch = []
+    for item in ItemInstance.objects.only('id', 'bbox').iterator(chunk_size=1000):
+        bbox = item.bbox if isinstance(item.bbox, dict) else {}
+        for column, key in BBOX_KEYS:
+            setattr(item, column, _number(bbox.get(key)))
+        batch.append(item)
+        if len(batch) == 1000:
+            ItemInstance.objects.bulk_update(batch, [column for column, _ in BBOX_KEYS])
+            batch = []
+    ItemInstance.objects.bulk_update(batch, [column for column, _ in BBOX_KEYS])
+
+
+def columns_to_bbox(apps, schema_editor):
+    ItemInstance = apps.get_model('projects', 'ItemInstance')
+    batch = []
+    for item in ItemInstance.objects.iterator(chunk_size=1000):
+        item.bbox = {key: getattr(item, column) for column, key in BBOX_KEYS}
+        batch.append(item)
+        if len(batch) == 1000:
+            ItemInstance.objects.bulk_update(batch, ['bbox'])
+            batch = []
+    ItemInstance.objects.bulk_update(batch, ['bbox'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0010_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iteminstance',
+            name='bbox_x',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='bbox_y',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='bbox_width',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='bbox_height',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(bbox_to_columns, columns_to_bbox),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:20
+
+import apps.projects.geometry
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+BOX_INDEX = django.contrib.postgres.indexes.GistIndex(apps.projects.geometry.ItemBox(), name='item_bbox_gist_idx')
+
+
+def add_box_index(apps, schema_editor):
+    # Only PostgreSQL has box types; other databases use the in-memory R-tree
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('projects', 'ItemInstance'), BOX_INDEX)
+
+
+def remove_box_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('projects', 'ItemInstance'), BOX_INDEX)
+
+
+class Migration(migrations.Migration):
+    """
+    Drops the bbox JSON that 0011 copied into columns and indexes the box
+    of those columns (PostgreSQL only).
+    """
+
+    dependencies = [
+        ('projects', '0011_item_bbox_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='iteminstance',
+            name='bbox',
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='iteminstance', index=BOX_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(add_box_index, remove_box_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_item_bbox_gist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iteminstance',
+            name='mask_area',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='mask_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='mask_rle',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='iteminstance',
+            name='mask_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+        ('projects', '0014_project_tombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iteminstance',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.product'),
+        ),
+    ]
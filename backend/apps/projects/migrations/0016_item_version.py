@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:09
+
+from django.db import migrations, models
+
+VERSION_FIELD = models.PositiveIntegerField(default=1, editable=False)
+
+
+def _version_field(model):
+    field = VERSION_FIELD.clone()
+    field.set_attributes_from_name('version')
+    field.model = model
+    return field
+
+
+def add_version(apps, schema_editor):
+    model = apps.get_model('projects', 'ItemInstance')
+    if schema_editor.connection.vendor == 'sqlite':
+        # SQLite would rebuild the table with every index in the model
+        # state, including the PostgreSQL-only box index (see 0012)
+        table, column = schema_editor.quote_name(model._meta.db_table), schema_editor.quote_name('version')
+        schema_editor.execute(
+            f'ALTER TABLE {table} ADD COLUMN {column} integer unsigned NOT NULL DEFAULT 1 CHECK ({column} >= 0)'
+        )
+    else:
+        schema_editor.add_field(model, _version_field(model))
+
+
+def remove_version(apps, schema_editor):
+    model = apps.get_model('projects', 'ItemInstance')
+    if schema_editor.connection.vendor == 'sqlite':
+        table, column = schema_editor.quote_name(model._meta.db_table), schema_editor.quote_name('version')
+        schema_editor.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+    else:
+        schema_editor.remove_field(model, _version_field(model))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_iteminstance_product'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(model_name='iteminstance', name='version', field=VERSION_FIELD),
+            ],
+            database_operations=[
+                migrations.RunPython(add_version, remove_version),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:51
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0016_item_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=models.Index(django.db.models.functions.text.Substr('perceptual_hash', 1, 4), name='image_phash_band0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=models.Index(django.db.models.functions.text.Substr('perceptual_hash', 5, 4), name='image_phash_band1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=models.Index(django.db.models.functions.text.Substr('perceptual_hash', 9, 4), name='image_phash_band2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=models.Index(django.db.models.functions.text.Substr('perceptual_hash', 13, 4), name='image_phash_band3_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:05
+
+import apps.projects.geometry
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations
+from django.db.models import F
+
+OLD_INDEX = django.contrib.postgres.indexes.GistIndex(apps.projects.geometry.ItemBox(), name='item_bbox_gist_idx')
+NEW_INDEX = django.contrib.postgres.indexes.GistIndex(
+    F('variant'), apps.projects.geometry.ItemBox(), name='item_variant_bbox_gist_idx'
+)
+
+
+def swap_box_index(apps, schema_editor):
+    # Only PostgreSQL has box types; other databases use the in-memory R-tree
+    if schema_editor.connection.vendor == 'postgresql':
+        model = apps.get_model('projects', 'ItemInstance')
+        schema_editor.add_index(model, NEW_INDEX)
+        schema_editor.remove_index(model, OLD_INDEX)
+
+
+def restore_box_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        model = apps.get_model('projects', 'ItemInstance')
+        schema_editor.add_index(model, OLD_INDEX)
+        schema_editor.remove_index(model, NEW_INDEX)
+
+
+class Migration(migrations.Migration):
+    """
+    Replaces the item box index with one on (variant, box), so spatial
+    queries only search their own variant (PostgreSQL only; the variant
+    column needs btree_gist).
+    """
+
+    dependencies = [
+        ('projects', '0017_image_phash_bands'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveIndex(model_name='iteminstance', name='item_bbox_gist_idx'),
+                migrations.AddIndex(model_name='iteminstance', index=NEW_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(swap_box_index, restore_box_index),
+            ],
+        ),
+    ]
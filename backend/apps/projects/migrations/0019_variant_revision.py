@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0018_item_variant_bbox_gist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='designvariant',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
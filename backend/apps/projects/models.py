@@ -8,27 +8,117 @@ Architecture:
 - ItemInstance: Individual furniture/decor items in a variant
 - Version: Version history with snapshots for undo/redo
 """
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Substr
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+
+from . import versioning
+from .geometry import ItemBox
+
+
+class ProjectQuerySet(models.QuerySet):
+    def live(self):
+        """Projects that have not been deleted (see purge.py)."""
+        return self.filter(deleted_at__isnull=True)
 
 
 class Project(models.Model):
     """
     Main project container.
     Each project can have multiple images, variants, and versions.
+
+    Deleting through the API only sets deleted_at (a tombstone); the rows
+    and stored files are removed in the background by purge_project.
     """
     name = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='projects')
+    # Denormalized child counts, kept in sync by signals and bulk_create
+    cached_image_count = models.PositiveIntegerField(default=0)
+    cached_variant_count = models.PositiveIntegerField(default=0)
+    # Bumped by every write to the project's images, variants or versions;
+    # item writes bump their variant's revision instead, so live edits do
+    # not all update this row. Validates cached responses (see caching.py)
+    revision = models.PositiveBigIntegerField(default=0)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)  # Tombstone
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProjectQuerySet.as_manager()
+
     class Meta:
         db_table = 'projects'
         ordering = ['-updated_at']
+        indexes = [
+            # A user's project list, most recently updated first
+            models.Index(fields=['owner', '-updated_at'], name='project_owner_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.owner.username}"
 
+    @staticmethod
+    def adjust_counter(field, deltas):
+        """
+        Apply {project_id: delta} to a counter column without touching
+        updated_at. Adding or removing children also bumps the revision.
+        """
+        for project_id, delta in deltas.items():
+            if delta:
+                Project.objects.filter(pk=project_id).update(
+                    **{field: F(field) + delta, 'revision': F('revision') + 1}
+                )
+
+    @staticmethod
+    def bump_revision(project_ids):
+        """Record that the children of these projects changed."""
+        Project.objects.filter(pk__in=project_ids).update(revision=F('revision') + 1)
+
+    def refresh_counts(self):
+        """Recompute the denormalized counts from the child tables."""
+        self.cached_image_count = self.images.count()
+        self.cached_variant_count = self.variants.count()
+        Project.objects.filter(pk=self.pk).update(
+            cached_image_count=self.cached_image_count,
+            cached_variant_count=self.cached_variant_count,
+        )
+
+
+class ProjectChildQuerySet(models.QuerySet):
+    """
+    QuerySet for rows counted on their Project.
+    bulk_create skips signals, so it updates the counter itself.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if any(field.name == 'owner' for field in self.model._meta.fields):
+            missing = {obj.project_id for obj in objs if obj.owner_id is None}
+            owners = dict(Project.objects.filter(pk__in=missing).values_list('pk', 'owner_id'))
+            for obj in objs:
+                if obj.owner_id is None:
+                    obj.owner_id = owners.get(obj.project_id)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        Project.adjust_counter(
+            self.model.project_counter_field,
+            Counter(obj.project_id for obj in objs),
+        )
+        return objs
+
+
+# Near-duplicate lookups split the 64-bit perceptual hash into bands of
+# 16 bits (4 hex digits), each indexed: two hashes differing in fewer bits
+# than there are bands must share at least one band (see fingerprints.py)
+PHASH_BANDS = 4
+
+
+def phash_band(band):
+    """The `band`th 4-digit slice of perceptual_hash, as an expression."""
+    return Substr('perceptual_hash', band * 4 + 1, 4)
+
 
 class ProjectImage(models.Model):
     """
@@ -45,11 +135,29 @@ class ProjectImage(models.Model):
     type = models.CharField(max_length=20, choices=IMAGE_TYPES, default='original')
     image_url = models.URLField(max_length=500)  # Cloudinary URL
     metadata = models.JSONField(default=dict, blank=True)  # Store dimensions, etc.
+    # Upload fingerprints for reusing stored photos (see fingerprints.py)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    perceptual_hash = models.CharField(max_length=16, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ProjectChildQuerySet.as_manager()
+    project_counter_field = 'cached_image_count'
+
     class Meta:
         db_table = 'project_images'
         ordering = ['-created_at']
+        indexes = [
+            # A project's images of one type, e.g. the base image for generation
+            models.Index(fields=['project', 'type', 'created_at'], name='image_project_type_idx'),
+            # metadata containment lookups, e.g. {"cloudinary_id": ...}
+            GinIndex(fields=['metadata'], opclasses=['jsonb_path_ops'], name='image_metadata_gin_idx'),
+            models.Index(fields=['content_hash'], name='image_content_hash_idx'),
+            models.Index(fields=['perceptual_hash'], name='image_perceptual_hash_idx'),
+            models.Index(phash_band(0), name='image_phash_band0_idx'),
+            models.Index(phash_band(1), name='image_phash_band1_idx'),
+            models.Index(phash_band(2), name='image_phash_band2_idx'),
+            models.Index(phash_band(3), name='image_phash_band3_idx'),
+        ]
 
     def __str__(self):
         return f"{self.project.name} - {self.type} - {self.id}"
@@ -61,17 +169,62 @@ class DesignVariant(models.Model):
     Each variant represents a different design option.
     """
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='variants')
+    # Denormalized project.owner, so ownership checks need no join
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', editable=False)
     image_url = models.URLField(max_length=500)  # Cloudinary URL
     metadata = models.JSONField(default=dict, blank=True)  # AI params, generation info
+    # Bumped by every write to the variant's items (see caching.py)
+    revision = models.PositiveBigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ProjectChildQuerySet.as_manager()
+    project_counter_field = 'cached_variant_count'
+
     class Meta:
         db_table = 'design_variants'
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a project's variants
+            models.Index(fields=['project', '-created_at', '-id'], name='variant_project_keyset_idx'),
+            # Ownership-scoped listing and lookups
+            models.Index(fields=['owner', '-created_at', '-id'], name='variant_owner_keyset_idx'),
+            # metadata containment lookups, e.g. {"batch_id": ...} or {"params": {...}}
+            GinIndex(fields=['metadata'], opclasses=['jsonb_path_ops'], name='variant_metadata_gin_idx'),
+        ]
 
     def __str__(self):
         return f"Variant {self.id} - {self.project.name}"
 
+    @staticmethod
+    def bump_revision(variant_ids):
+        """Record that the items of these variants changed."""
+        DesignVariant.objects.filter(pk__in=variant_ids).update(revision=F('revision') + 1)
+
+    def save(self, *args, **kwargs):
+        if 'project' in self._state.fields_cache:
+            self.owner_id = self.project.owner_id
+        elif self.owner_id is None:
+            self.owner_id = Project.objects.values_list('owner_id', flat=True).get(pk=self.project_id)
+        super().save(*args, **kwargs)
+
+
+class ItemInstanceQuerySet(models.QuerySet):
+    """bulk_create fills the denormalized project and owner from the variants."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        missing = {obj.variant_id for obj in objs if obj.project_id is None or obj.owner_id is None}
+        parents = {
+            variant_id: (project_id, owner_id)
+            for variant_id, project_id, owner_id in DesignVariant.objects.filter(
+                pk__in=missing
+            ).values_list('pk', 'project_id', 'owner_id')
+        }
+        for obj in objs:
+            if obj.variant_id in parents:
+                obj.project_id, obj.owner_id = parents[obj.variant_id]
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class ItemInstance(models.Model):
     """
@@ -79,35 +232,149 @@ class ItemInstance(models.Model):
     Stores bounding box, segmentation mask, and transform data.
     """
     variant = models.ForeignKey(DesignVariant, on_delete=models.CASCADE, related_name='items')
+    # Denormalized variant.project and variant.owner, kept in sync by save()
+    # and bulk_create, so ownership checks need no join
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+', editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', editable=False)
     name = models.CharField(max_length=255)
     category = models.CharField(max_length=100)  # e.g., 'sofa', 'table', 'lamp'
-    bbox = models.JSONField(default=dict)  # {x, y, width, height}
-    mask_url = models.URLField(max_length=500, blank=True, null=True)  # Segmentation mask
+    # The catalog product this item is, once matched or chosen
+    product = models.ForeignKey(
+        'catalog.Product', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # Bounding box in image pixels; read and written as `bbox` {x, y, width, height}
+    bbox_x = models.FloatField(default=0)
+    bbox_y = models.FloatField(default=0)
+    bbox_width = models.FloatField(default=0)
+    bbox_height = models.FloatField(default=0)
+    mask_url = models.URLField(max_length=500, blank=True, null=True)  # Legacy hosted segmentation mask
+    # Inline segmentation mask, run-length encoded (see masks.py); read and
+    # written as `mask` {size, counts, area}
+    mask_rle = models.BinaryField(null=True, blank=True)
+    mask_height = models.PositiveIntegerField(null=True, blank=True)
+    mask_width = models.PositiveIntegerField(null=True, blank=True)
+    mask_area = models.PositiveIntegerField(null=True, blank=True)  # Foreground pixels
     transform = models.JSONField(default=dict)  # {rotation, scale, position} for canvas
+    # Incremented by every write, so concurrent live edits can detect
+    # conflicts (see collaboration.py)
+    version = models.PositiveIntegerField(default=1, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ItemInstanceQuerySet.as_manager()
+
     class Meta:
         db_table = 'item_instances'
         ordering = ['created_at']
+        indexes = [
+            # Keyset pagination of a variant's items
+            models.Index(fields=['variant', '-created_at', '-id'], name='item_variant_keyset_idx'),
+            # Ownership-scoped listing and lookups
+            models.Index(fields=['owner', '-created_at', '-id'], name='item_owner_keyset_idx'),
+            # Region, hit-test and overlap queries within a variant (see
+            # spatial.py); the variant column needs the btree_gist extension
+            GistIndex(F('variant'), ItemBox(), name='item_variant_bbox_gist_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.category}) - Variant {self.variant.id}"
 
+    @property
+    def bbox(self):
+        return {'x': self.bbox_x, 'y': self.bbox_y, 'width': self.bbox_width, 'height': self.bbox_height}
+
+    @bbox.setter
+    def bbox(self, value):
+        value = value or {}
+        self.bbox_x = float(value.get('x', 0))
+        self.bbox_y = float(value.get('y', 0))
+        self.bbox_width = float(value.get('width', 0))
+        self.bbox_height = float(value.get('height', 0))
+
+    @property
+    def bounds(self):
+        """(x1, y1, x2, y2) corners of the bounding box."""
+        return (self.bbox_x, self.bbox_y, self.bbox_x + self.bbox_width, self.bbox_y + self.bbox_height)
+
+    def save(self, *args, **kwargs):
+        if 'variant' in self._state.fields_cache:
+            self.project_id, self.owner_id = self.variant.project_id, self.variant.owner_id
+        elif self.project_id is None or self.owner_id is None:
+            self.project_id, self.owner_id = DesignVariant.objects.values_list(
+                'project_id', 'owner_id'
+            ).get(pk=self.variant_id)
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        # Incremented in the database, so racing writers never share a version
+        self.version = F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        if not isinstance(self.version, int):  # Unless a post_save handler read it back
+            self.refresh_from_db(fields=['version'])
+
+
+class VersionQuerySet(models.QuerySet):
+    def delete(self):
+        # Deleting a delta breaks every later version (see versioning.py);
+        # history goes with its project (cascade or purge.py)
+        raise ValueError('Version history is append-only; versions are deleted with their project.')
+
 
 class Version(models.Model):
     """
     Version history for projects.
     Stores snapshots of project state for undo/redo functionality.
+
+    Snapshots are delta-encoded against the previous version with periodic
+    keyframes (see versioning.py); `snapshot` rebuilds the full state.
+    History is append-only.
     """
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='versions')
-    snapshot = models.JSONField(default=dict)  # Complete state snapshot
+    sequence = models.PositiveIntegerField(editable=False)  # 1-based position in project history
+    is_keyframe = models.BooleanField(default=True, editable=False)  # payload is a full snapshot
+    payload = models.JSONField(null=True, blank=True, editable=False)  # Snapshot or JSON-patch ops
+    payload_zlib = models.BinaryField(null=True, blank=True)  # zlib-compressed payload when large
     prompt = models.TextField(blank=True)  # AI generation prompt if applicable
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = VersionQuerySet.as_manager()
+
     class Meta:
         db_table = 'versions'
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a project's history
+            models.Index(fields=['project', '-created_at', '-id'], name='version_project_keyset_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'sequence'], name='unique_version_sequence'),
+        ]
 
     def __str__(self):
         return f"Version {self.id} - {self.project.name} - {self.created_at}"
 
+    @property
+    def snapshot(self):
+        """Complete state snapshot, rebuilt from the nearest keyframe."""
+        if '_snapshot' not in self.__dict__:
+            versioning.materialize([self])
+        return self.__dict__.get('_snapshot')
+
+    @snapshot.setter
+    def snapshot(self, value):
+        self._snapshot = value
+        self._snapshot_dirty = True
+
+    def save(self, *args, **kwargs):
+        if not getattr(self, '_snapshot_dirty', False):
+            return super().save(*args, **kwargs)
+        if not self._state.adding:
+            raise ValueError('Version snapshots are immutable; record a new version instead.')
+        with transaction.atomic():
+            versioning.prepare_new_version(self)
+            super().save(*args, **kwargs)
+        self._snapshot_dirty = False
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Version history is append-only; versions are deleted with their project.')
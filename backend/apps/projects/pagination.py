@@ -0,0 +1,117 @@
+"""
+Pagination classes for project endpoints.
+"""
+import base64
+import json
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on a composite ordering.
+
+    The cursor encodes the ordering values of the last row on the page, and
+    the next page is fetched by comparing against those values. Each
+    page costs one indexed range scan however deep it is, unlike OFFSET.
+    Back each ordering with a matching composite index.
+    """
+    ordering = ('-created_at', '-id')
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        self.last = self.page[-1] if self.page else None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, position):
+        """
+        Q for rows strictly after `position` in ordering order:
+        a <= x AND ((a < x) OR (a = x AND b < y) OR ...)
+        The redundant leading bound lets the planner use an index range scan.
+        """
+        first = self.fields[0]
+        bound_lookup = 'lte' if self.ordering[0].startswith('-') else 'gte'
+        bound = Q(**{f'{first}__{bound_lookup}': position[first]})
+        clauses = []
+        for index, name in enumerate(self.ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            equal = {f: position[f] for f in self.fields[:index]}
+            clauses.append(Q(**equal, **{f'{field}__{lookup}': position[field]}))
+        return bound & reduce(or_, clauses)
+
+    def encode_cursor(self, row):
+        values = [getattr(row, field) for field in self.fields]
+        raw = json.dumps([
+            v.isoformat() if hasattr(v, 'isoformat') else str(v) if isinstance(v, Decimal) else v
+            for v in values
+        ])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return {field: self.to_python(model, field, value) for field, value in zip(self.fields, values)}
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def to_python(self, model, field, value):
+        """A cursor value as the ordering field's type; override for annotations."""
+        return model._meta.get_field(field).to_python(value)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,52 @@
+"""
+Progress reporting for long-running generation tasks.
+
+Each update is stored as the task's latest status in the cache (for the
+status endpoint) and published on the realtime broker (for the event
+stream), so clients no longer poll the variants endpoint.
+
+Status shape:
+    {"task_id", "project_id", "state", "percent", "variant_id"?, "message"?}
+States: queued -> running -> done | error
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .realtime import get_broker
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+TERMINAL_STATES = (DONE, ERROR)
+
+
+def status_key(task_id):
+    return f'task-status:{task_id}'
+
+
+def channel_name(task_id):
+    return f'task:{task_id}'
+
+
+def publish_progress(task_id, project_id, state, percent=0, **extra):
+    """Record and broadcast a status update for `task_id`."""
+    status = {
+        'task_id': str(task_id),
+        'project_id': project_id,
+        'state': state,
+        'percent': percent,
+        **extra,
+    }
+    cache.set(status_key(task_id), status, settings.TASK_STATUS_TTL)
+    get_broker().publish(channel_name(task_id), status)
+    return status
+
+
+def get_status(task_id):
+    """Return the latest status for `task_id`, or None if unknown or expired."""
+    return cache.get(status_key(task_id))
+
+
+async def aget_status(task_id):
+    return await cache.aget(status_key(task_id))
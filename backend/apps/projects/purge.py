@@ -0,0 +1,126 @@
+"""
+Background removal of deleted projects.
+
+Deleting a project through the API only sets Project.deleted_at, which
+hides it from every endpoint at once. The purge_project task then:
+1. deletes the stored files its images and variants point at (uploaded
+   originals, derivatives, renders) with the backend's bulk delete, except
+   files that rows of other projects still reference: reused uploads
+   (fingerprints.reuse) share the original's files
+2. deletes the child rows in batches of PURGE_BATCH_SIZE by id range,
+   each batch its own short statement, then the project row
+
+Files go first so a failed storage call can be retried while the rows
+still record them; both steps are safe to repeat.
+"""
+import re
+from urllib.parse import urlparse
+
+from django.db import connection
+from django.db.models import Q
+
+from . import generation
+from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version
+from .storage import get_upload_backend
+
+# Stored file ids of derivatives and renders, as they appear in their URLs
+_STORED_ID = {
+    'derivatives': re.compile(r'(dreamspace/derivatives/[^/]+/\d+/[^/.]+)'),
+    'renders': re.compile(r'(dreamspace/renders/[0-9a-f]+)'),
+}
+# Files checked against other projects per query
+_REFCOUNT_BATCH = 100
+
+
+def owned_assets(row, storage_key):
+    """
+    The stored files an image or variant points at, as
+    (metadata containment lookup, (public_id, url)) pairs.
+    """
+    metadata = row.metadata or {}
+    public_id = metadata.get(storage_key)
+    if public_id:
+        yield {storage_key: public_id}, (public_id, row.image_url)
+    for kind, pattern in _STORED_ID.items():
+        for name, record in (metadata.get(kind) or {}).items():
+            if not isinstance(record, dict) or not record.get('url'):
+                continue
+            match = pattern.search(urlparse(record['url']).path)
+            if match:
+                yield {kind: {name: {'url': record['url']}}}, (match.group(1), record['url'])
+
+
+def _shared_urls(project_id, lookups, storage_key):
+    """URLs among `lookups`' files that rows outside the project still use."""
+    condition = Q()
+    for lookup in lookups:
+        condition |= Q(metadata__contains=lookup)
+    urls = set()
+    for model in (ProjectImage, DesignVariant):
+        for row in model.objects.exclude(project_id=project_id).filter(condition).only('image_url', 'metadata'):
+            urls.update(url for _, (_, url) in owned_assets(row, storage_key))
+    return urls
+
+
+def delete_assets(project_id, batch_size):
+    """Delete the project's unshared stored files; returns how many."""
+    backend = get_upload_backend()
+    deleted = 0
+    seen = set()
+    pending = []
+
+    def flush():
+        nonlocal deleted
+        shared = _shared_urls(project_id, [lookup for lookup, _ in pending], backend.metadata_key)
+        assets = [asset for _, asset in pending if asset[1] not in shared]
+        if assets:
+            backend.delete_assets(assets)
+            deleted += len(assets)
+        pending.clear()
+
+    for model in (ProjectImage, DesignVariant):
+        rows = model.objects.filter(project_id=project_id).only('image_url', 'metadata')
+        for row in rows.iterator(chunk_size=batch_size):
+            if row.metadata.get('generation_key'):
+                generation.evict(row.metadata['generation_key'])
+            for lookup, asset in owned_assets(row, backend.metadata_key):
+                if asset[1] not in seen:
+                    seen.add(asset[1])
+                    pending.append((lookup, asset))
+                if len(pending) >= _REFCOUNT_BATCH:
+                    flush()
+    if pending:
+        flush()
+    return deleted
+
+
+def delete_rows(model, project_id, batch_size):
+    """Delete the project's rows of `model` in id-range batches; returns how many."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.get_field('project').column)
+    ids = model.objects.filter(project_id=project_id).order_by('id').values_list('id', flat=True)
+    deleted = 0
+    while True:
+        # The batch's highest id, or the last id for the final partial batch
+        bound = list(ids[batch_size - 1:batch_size]) or list(ids.reverse()[:1])
+        if not bound:
+            return deleted
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE {column} = %s AND id <= %s', [project_id, bound[0]])
+            deleted += cursor.rowcount
+
+
+def purge(project_id, batch_size):
+    """
+    Remove a tombstoned project completely. Returns counts of deleted rows
+    and files, or None if the project is gone or not deleted.
+    """
+    if not Project.objects.filter(pk=project_id, deleted_at__isnull=False).exists():
+        return None
+    counts = {'files': delete_assets(project_id, batch_size)}
+    # Items reference variants, so they go first
+    for model in (ItemInstance, DesignVariant, ProjectImage, Version):
+        counts[model._meta.model_name] = delete_rows(model, project_id, batch_size)
+    # Anything created since is removed with the project row
+    Project.objects.filter(pk=project_id).delete()
+    return counts
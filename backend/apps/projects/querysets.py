@@ -0,0 +1,149 @@
+"""
+Query plans for project endpoints.
+
+The detail serializers nest several levels of related rows. Building the
+querysets here keeps the number of queries per request fixed no matter how
+many images, variants or items a project has (see tests.py).
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .geometry import Box, ItemBox, Overlaps
+from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version, phash_band
+
+# Queries needed to serialize one project with ProjectSerializer:
+# project (+owner), images, variants, items, recent versions.
+PROJECT_DETAIL_QUERIES = 5
+
+
+def item_prefetch():
+    """
+    Prefetch for a variant's items in canvas order. The mask run lengths
+    are only read by the mask endpoints, so they are not loaded here.
+    """
+    return Prefetch('items', queryset=ItemInstance.objects.defer('mask_rle').order_by('created_at', 'id'))
+
+
+def variant_prefetch():
+    """Prefetch for a project's variants, newest first, with their items."""
+    return Prefetch(
+        'variants',
+        queryset=DesignVariant.objects.order_by('-created_at', '-id').prefetch_related(item_prefetch()),
+    )
+
+
+def recent_versions_prefetch():
+    """
+    Prefetch for a project's latest PROJECT_DETAIL_VERSIONS versions, newest
+    first, into `recent_versions`. The slice is applied per project in SQL,
+    so the query stays bounded however long the history grows.
+    """
+    versions = Version.objects.only('id', 'project', 'sequence', 'prompt', 'created_at').order_by('-created_at', '-id')
+    return Prefetch('versions', queryset=versions[:settings.PROJECT_DETAIL_VERSIONS], to_attr='recent_versions')
+
+
+def with_detail_relations(queryset):
+    """
+    Attach everything ProjectSerializer reads to a Project queryset.
+    Each relation is loaded with one ordered query.
+    """
+    return queryset.select_related('owner').prefetch_related(
+        Prefetch('images', queryset=ProjectImage.objects.order_by('-created_at', '-id')),
+        variant_prefetch(),
+        recent_versions_prefetch(),
+    )
+
+
+def _child_count(model):
+    """Correlated COUNT subquery over a Project child table."""
+    counts = (
+        model.objects.filter(project=OuterRef('pk'))
+        .order_by()
+        .values('project')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def with_list_counts(queryset):
+    """
+    Annotate image_count and variant_count for ProjectListSerializer.
+
+    Reads the denormalized counter columns when PROJECT_LIST_USE_COUNTERS
+    is enabled; otherwise counts with per-table subqueries (avoiding the
+    images x variants row explosion of joining both relations).
+    """
+    queryset = queryset.select_related('owner')
+    if getattr(settings, 'PROJECT_LIST_USE_COUNTERS', False):
+        return queryset.annotate(
+            image_count=F('cached_image_count'),
+            variant_count=F('cached_variant_count'),
+        )
+    return queryset.annotate(
+        image_count=_child_count(ProjectImage),
+        variant_count=_child_count(DesignVariant),
+    )
+
+
+def with_cover(queryset):
+    """
+    Annotate each project's newest original image (cover_url) and its
+    derivatives (cover_derivatives) for the project grid.
+    """
+    newest = ProjectImage.objects.filter(project=OuterRef('pk'), type='original').order_by('-created_at', '-id')
+    return queryset.annotate(
+        cover_url=Subquery(newest.values('image_url')[:1]),
+        cover_derivatives=Subquery(newest.values('metadata__derivatives')[:1]),
+    )
+
+
+def indexed_queries():
+    """
+    The hot queries and the index each must be able to use, as
+    (label, queryset, index name). Checked against the planner by the
+    query plan tests and `manage.py check_query_plans`.
+    """
+    return [
+        ('project list', Project.objects.live().filter(owner_id=0).order_by('-updated_at'),
+         'project_owner_updated_idx'),
+        ('base image', ProjectImage.objects.filter(project_id=0, type='original').order_by('-created_at')[:1],
+         'image_project_type_idx'),
+        ('image by storage id', ProjectImage.objects.filter(metadata__contains={'cloudinary_id': ''}),
+         'image_metadata_gin_idx'),
+        ('image by content hash', ProjectImage.objects.filter(content_hash=''),
+         'image_content_hash_idx'),
+        ('image by hash band', ProjectImage.objects.alias(band=phash_band(0)).filter(band=''),
+         'image_phash_band0_idx'),
+        ('project variants', DesignVariant.objects.filter(project_id=0).order_by('-created_at', '-id'),
+         'variant_project_keyset_idx'),
+        ('user variants', DesignVariant.objects.filter(owner_id=0).order_by('-created_at', '-id'),
+         'variant_owner_keyset_idx'),
+        ('variants by metadata', DesignVariant.objects.filter(metadata__contains={'batch_id': ''}),
+         'variant_metadata_gin_idx'),
+        ('variant items', ItemInstance.objects.filter(variant_id=0).order_by('-created_at', '-id'),
+         'item_variant_keyset_idx'),
+        ('user items', ItemInstance.objects.filter(owner_id=0).order_by('-created_at', '-id'),
+         'item_owner_keyset_idx'),
+        ('item region',
+         ItemInstance.objects.filter(Overlaps(ItemBox(), Box.from_bounds(0, 0, 100, 100)), variant_id=0).order_by(),
+         'item_variant_bbox_gist_idx'),
+        ('version history', Version.objects.filter(project_id=0).order_by('-created_at', '-id'),
+         'version_project_keyset_idx'),
+    ]
+
+
+def index_plan(queryset):
+    """
+    PostgreSQL's EXPLAIN output for a queryset with sequential scans and
+    explicit sorts disabled: on small development and test tables the
+    planner would rightly prefer them, and the question is whether an
+    index is usable, not whether it pays off yet.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+        return queryset.explain()
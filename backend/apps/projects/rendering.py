@@ -0,0 +1,157 @@
+"""
+Flattened renders of design variants, for sharing, export and link previews.
+
+A render composites the variant's image with its items: each moved,
+scaled or rotated item is cut out of the image (its bbox, clipped by its
+mask when it has one) and pasted at its transform, in canvas order.
+Transforms are in image pixels, like bbox:
+    {"x", "y"}            new top-left corner (default: the bbox corner)
+    {"rotation"}          degrees clockwise about that corner
+    {"scaleX", "scaleY"}  negative values flip
+Items without a transform are already in place in the image.
+
+Renders are cached by a hash of everything that affects the output
+(render_state), so an unchanged variant is never rendered twice. The
+result is stored once under dreamspace/renders/<key>, remembered in the
+default cache for RENDER_CACHE_TTL seconds (so reverting to an earlier
+state reuses its render) and recorded in the variant's metadata:
+    metadata['renders'] = {"jpeg": {"key", "url", "width", "height", "format"}, ...}
+"""
+import hashlib
+import json
+import math
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, ImageOps
+
+from . import masks
+from .derivatives import MAX_SOURCE_PIXELS
+
+# Bump when the compositing changes, so every cached render is replaced
+RENDERER_VERSION = 1
+# output name -> (Pillow format, extension, save options)
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 90, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', 'png', {'optimize': True}),
+}
+
+
+def render_state(variant, items, output):
+    """Everything that affects a render of `variant` as `output`."""
+    return {
+        'renderer': RENDERER_VERSION,
+        'output': output,
+        'image_url': variant.image_url,
+        'items': [
+            [
+                item.id,
+                [item.bbox_x, item.bbox_y, item.bbox_width, item.bbox_height],
+                item.transform or {},
+                hashlib.sha1(bytes(item.mask_rle)).hexdigest() if item.mask_height is not None else None,
+                [item.mask_height, item.mask_width],
+            ]
+            for item in items
+        ],
+    }
+
+
+def state_key(state):
+    encoded = json.dumps(state, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:32]
+
+
+def variant_items(variant):
+    return list(variant.items.order_by('created_at', 'id'))
+
+
+def current_render(variant, output, items=None):
+    """
+    (key, record) for the variant's current state; record is None when
+    no render of that state exists yet.
+    """
+    key = state_key(render_state(variant, variant_items(variant) if items is None else items, output))
+    record = (variant.metadata or {}).get('renders', {}).get(output)
+    if record and record.get('key') == key:
+        return key, record
+    return key, cache.get(f'variant-render:{key}')
+
+
+def remember(key, record):
+    cache.set(f'variant-render:{key}', record, settings.RENDER_CACHE_TTL)
+
+
+def _placement(item):
+    """(x, y, scale_x, scale_y, rotation), or None for an item left in place."""
+    transform = item.transform or {}
+    try:
+        x = float(transform.get('x', item.bbox_x))
+        y = float(transform.get('y', item.bbox_y))
+        scale_x = float(transform.get('scaleX', 1))
+        scale_y = float(transform.get('scaleY', 1))
+        rotation = float(transform.get('rotation', 0))
+    except (TypeError, ValueError):
+        return None
+    if not all(math.isfinite(value) for value in (x, y, scale_x, scale_y, rotation)):
+        return None
+    if (x, y, scale_x, scale_y, rotation % 360) == (item.bbox_x, item.bbox_y, 1, 1, 0):
+        return None
+    return x, y, scale_x, scale_y, rotation
+
+
+def _cutout(source, item):
+    """The item's pixels as RGBA, transparent outside its mask."""
+    box = tuple(round(value) for value in item.bounds)
+    piece = source.crop(box).convert('RGBA')
+    if item.mask_height is not None:
+        mask = masks.decode(bytes(item.mask_rle), item.mask_height, item.mask_width)
+        alpha = Image.fromarray(mask.astype('uint8') * 255, 'L')
+        if alpha.size != source.size:
+            alpha = alpha.resize(source.size, Image.NEAREST)
+        piece.putalpha(alpha.crop(box))
+    return piece
+
+
+def composite(content, items, output):
+    """
+    Flatten the image bytes in `content` with `items` (in canvas order).
+    Returns (bytes, width, height).
+    """
+    image_format, _, options = FORMATS[output]
+    source = Image.open(BytesIO(content))
+    if source.width * source.height > MAX_SOURCE_PIXELS:
+        raise ValueError('Source image is too large')
+    source = ImageOps.exif_transpose(source).convert('RGB')
+    canvas = source.copy()
+
+    for item in items:
+        placement = _placement(item)
+        if placement is None or item.bbox_width < 1 or item.bbox_height < 1:
+            continue
+        x, y, scale_x, scale_y, rotation = placement
+        piece = _cutout(source, item)
+        width, height = round(piece.width * abs(scale_x)), round(piece.height * abs(scale_y))
+        if width < 1 or height < 1:
+            continue
+        if width * height > MAX_SOURCE_PIXELS:
+            raise ValueError(f'Item {item.id} is scaled too large')
+        piece = piece.resize((width, height), Image.BICUBIC)
+        if scale_x < 0:
+            piece = piece.transpose(Image.FLIP_LEFT_RIGHT)
+        if scale_y < 0:
+            piece = piece.transpose(Image.FLIP_TOP_BOTTOM)
+        # Pillow rotates counter-clockwise about the centre; the corner
+        # offset places the expanded result so the item turns about (x, y)
+        offset_x = offset_y = 0.0
+        if rotation % 360:
+            theta = math.radians(rotation)
+            corners = [(0, 0), (width, 0), (0, height), (width, height)]
+            offset_x = min(cx * math.cos(theta) - cy * math.sin(theta) for cx, cy in corners)
+            offset_y = min(cx * math.sin(theta) + cy * math.cos(theta) for cx, cy in corners)
+            piece = piece.rotate(-rotation, resample=Image.BICUBIC, expand=True)
+        canvas.paste(piece, (round(x + offset_x), round(y + offset_y)), piece)
+
+    result = BytesIO()
+    canvas.save(result, image_format, **options)
+    return result.getvalue(), canvas.width, canvas.height
@@ -1,64 +1,314 @@
 """
 Serializers for project-related models.
 """
+import math
+
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version
+from .derivatives import srcset, srcset_map
+from . import masks, writebehind
+from .querysets import recent_versions_prefetch, variant_prefetch
+from .versioning import materialize, decode_payload
+
+
+def absolute_srcset(serializer, urls):
+    """Resolve storage-relative derivative URLs against the request host."""
+    request = serializer.context.get('request')
+    if request is None or not urls:
+        return urls
+    return {name: request.build_absolute_uri(url) for name, url in urls.items()}
 
 
 class ProjectImageSerializer(serializers.ModelSerializer):
     """Serializer for project images."""
+    srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = ProjectImage
-        fields = ('id', 'project', 'type', 'image_url', 'metadata', 'created_at')
+        fields = ('id', 'project', 'type', 'image_url', 'srcset', 'metadata', 'created_at')
         read_only_fields = ('id', 'created_at')
 
+    def get_srcset(self, obj):
+        return absolute_srcset(self, srcset(obj))
+
+
+class BBoxField(serializers.Field):
+    """
+    An item's bounding box as {x, y, width, height}, stored in the typed
+    bbox_* columns of ItemInstance.
+    """
+    keys = (('x', 'bbox_x'), ('y', 'bbox_y'), ('width', 'bbox_width'), ('height', 'bbox_height'))
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, item):
+        return item.bbox
+
+    def to_internal_value(self, data):
+        if not isinstance(data, dict):
+            raise serializers.ValidationError('Expected an object with x, y, width and height.')
+        try:
+            values = {column: float(data[key]) for key, column in self.keys}
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError('x, y, width and height must all be numbers.')
+        if not all(math.isfinite(value) for value in values.values()):
+            raise serializers.ValidationError('Bounding box values must be finite.')
+        if values['bbox_width'] < 0 or values['bbox_height'] < 0:
+            raise serializers.ValidationError('width and height cannot be negative.')
+        return values
+
+
+class MaskField(serializers.Field):
+    """
+    An item's inline segmentation mask: written as {size, counts} (RLE,
+    see masks.py) or null to clear it, read as {size, area} — the run
+    lengths are served by the mask endpoints.
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs.setdefault('allow_null', True)
+        super().__init__(**kwargs)
+
+    def validate_empty_values(self, data):
+        # With source='*' a null must still clear the mask columns
+        if data is None:
+            return True, {'mask_rle': None, 'mask_height': None, 'mask_width': None, 'mask_area': None}
+        return super().validate_empty_values(data)
+
+    def to_representation(self, item):
+        # mask_height rather than mask_rle, which list queries defer
+        if item.mask_height is None:
+            return None
+        return {'size': [item.mask_height, item.mask_width], 'area': item.mask_area}
+
+    def to_internal_value(self, data):
+        try:
+            return masks.parse(data)
+        except masks.InvalidMask as exc:
+            raise serializers.ValidationError(str(exc))
+
+
+class ItemInstanceListSerializer(serializers.ListSerializer):
+    """
+    Shows edits still in the write-behind buffer (see writebehind.py).
+    Items nested in variants are overlaid by the outermost serializer, with
+    one buffer read per response.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        if self.parent is None:
+            writebehind.overlay(items)
+        return super().to_representation(items)
+
 
 class ItemInstanceSerializer(serializers.ModelSerializer):
     """Serializer for item instances within a variant."""
+    bbox = BBoxField(required=False)
+    mask = MaskField(required=False)
     
     class Meta:
         model = ItemInstance
-        fields = ('id', 'variant', 'name', 'category', 'bbox', 'mask_url', 'transform', 'created_at')
-        read_only_fields = ('id', 'created_at')
+        fields = (
+            'id', 'variant', 'name', 'category', 'product', 'bbox', 'mask', 'mask_url', 'transform', 'version',
+            'created_at'
+        )
+        read_only_fields = ('id', 'version', 'created_at')
+        list_serializer_class = ItemInstanceListSerializer
+
+    def validate_variant(self, variant):
+        """Items may only be placed in the requesting user's variants."""
+        request = self.context.get('request')
+        if request and variant.owner_id != request.user.id:
+            raise serializers.ValidationError('Variant not found')
+        return variant
+
+
+class ItemInstanceCreateSerializer(serializers.ModelSerializer):
+    """
+    An item to create in a bulk batch. `client_id` is the editor's
+    temporary id, echoed back with the new database id.
+    """
+    client_id = serializers.CharField(write_only=True, required=False)
+    bbox = BBoxField(required=False)
+    mask = MaskField(required=False)
+    
+    class Meta:
+        model = ItemInstance
+        fields = ('client_id', 'name', 'category', 'product', 'bbox', 'mask', 'mask_url', 'transform')
+
+
+class ItemInstanceUpdateSerializer(serializers.ModelSerializer):
+    """A partial update to an existing item in a bulk batch."""
+    id = serializers.IntegerField()
+    bbox = BBoxField(required=False)
+    mask = MaskField(required=False)
+    
+    class Meta:
+        model = ItemInstance
+        fields = ('id', 'name', 'category', 'product', 'bbox', 'mask', 'mask_url', 'transform')
+        extra_kwargs = {
+            field: {'required': False}
+            for field in ('name', 'category', 'product', 'mask_url', 'transform')
+        }
+
+
+class ItemInstanceBatchSerializer(serializers.Serializer):
+    """
+    Creates, updates and deletes for the items of one variant.
+    Requires `variant` in the serializer context.
+    """
+    create = ItemInstanceCreateSerializer(many=True, required=False)
+    update = ItemInstanceUpdateSerializer(many=True, required=False)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        creates = attrs.setdefault('create', [])
+        updates = attrs.setdefault('update', [])
+        deletes = attrs.setdefault('delete', [])
+
+        client_ids = [item['client_id'] for item in creates if 'client_id' in item]
+        if len(client_ids) != len(set(client_ids)):
+            raise serializers.ValidationError({'create': 'Duplicate client_id values.'})
+
+        update_ids = [item['id'] for item in updates]
+        if len(update_ids) != len(set(update_ids)):
+            raise serializers.ValidationError({'update': 'An item can only be updated once per batch.'})
+        if set(update_ids) & set(deletes):
+            raise serializers.ValidationError({'delete': 'Items cannot be both updated and deleted.'})
+
+        # One query checks every referenced id belongs to this variant
+        referenced = set(update_ids) | set(deletes)
+        existing = {
+            item.id: item
+            for item in self.context['variant'].items.filter(id__in=referenced)
+        }
+        missing = sorted(referenced - existing.keys())
+        if missing:
+            raise serializers.ValidationError({'non_field_errors': [f'Items not found in variant: {missing}']})
+        attrs['instances'] = existing
+        return attrs
+
+
+class DesignVariantListSerializer(serializers.ListSerializer):
+    """Overlays buffered edits on every variant's items at once."""
+
+    def to_representation(self, data):
+        variants = list(data.all() if hasattr(data, 'all') else data)
+        if self.parent is None:
+            writebehind.overlay_variants(variants)
+        return super().to_representation(variants)
 
 
 class DesignVariantSerializer(serializers.ModelSerializer):
     """Serializer for design variants with nested items."""
     items = ItemInstanceSerializer(many=True, read_only=True)
+    srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = DesignVariant
-        fields = ('id', 'project', 'image_url', 'metadata', 'items', 'created_at')
+        fields = ('id', 'project', 'image_url', 'srcset', 'metadata', 'items', 'created_at')
         read_only_fields = ('id', 'created_at')
+        list_serializer_class = DesignVariantListSerializer
+
+    def to_representation(self, instance):
+        if self.parent is None:
+            writebehind.overlay_variants([instance])
+        return super().to_representation(instance)
+
+    def get_extra_kwargs(self):
+        extra_kwargs = super().get_extra_kwargs()
+        if self.instance is not None:
+            # A variant's items and counters belong to its project, so it
+            # cannot be moved to another one
+            extra_kwargs['project'] = {**extra_kwargs.get('project', {}), 'read_only': True}
+        return extra_kwargs
+
+    def validate_project(self, project):
+        """Variants may only be added to the requesting user's projects."""
+        request = self.context.get('request')
+        if request and project.owner_id != request.user.id:
+            raise serializers.ValidationError('Project not found')
+        return project
+
+    def get_srcset(self, obj):
+        return absolute_srcset(self, srcset(obj))
+
+
+class VersionListSerializer(serializers.ListSerializer):
+    """Rebuilds all snapshots in one pass before serializing the list."""
+
+    def to_representation(self, data):
+        versions = list(data.all() if hasattr(data, 'all') else data)
+        materialize(versions)
+        return super().to_representation(versions)
 
 
 class VersionSerializer(serializers.ModelSerializer):
     """Serializer for project versions."""
+    snapshot = serializers.JSONField()
     
     class Meta:
         model = Version
-        fields = ('id', 'project', 'snapshot', 'prompt', 'created_at')
-        read_only_fields = ('id', 'created_at')
+        fields = ('id', 'project', 'sequence', 'snapshot', 'prompt', 'created_at')
+        read_only_fields = ('id', 'sequence', 'created_at')
+        list_serializer_class = VersionListSerializer
+
+
+class VersionSummarySerializer(serializers.ModelSerializer):
+    """A version without its snapshot, as listed in the project detail."""
+
+    class Meta:
+        model = Version
+        fields = ('id', 'sequence', 'prompt', 'created_at')
+        read_only_fields = fields
+
+
+class VersionDeltaSerializer(serializers.ModelSerializer):
+    """
+    Serializer for versions as stored: a full snapshot on keyframes and
+    JSON-patch operations against the previous version otherwise.
+    """
+    payload = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Version
+        fields = ('id', 'project', 'sequence', 'is_keyframe', 'payload', 'prompt', 'created_at')
+        read_only_fields = fields
+
+    def get_payload(self, obj):
+        return decode_payload(obj.payload, obj.payload_zlib)
 
 
 class ProjectSerializer(serializers.ModelSerializer):
     """
     Main project serializer.
-    Includes nested images, variants, and versions.
+    Includes nested images, variants and the latest versions. The version
+    history grows without bound, so `versions` only lists the newest
+    PROJECT_DETAIL_VERSIONS without snapshots; the full history is served
+    paginated (GET /api/projects/{id}/versions/).
     """
     images = ProjectImageSerializer(many=True, read_only=True)
     variants = DesignVariantSerializer(many=True, read_only=True)
-    versions = VersionSerializer(many=True, read_only=True)
+    versions = VersionSummarySerializer(source='recent_versions', many=True, read_only=True)
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     
     class Meta:
         model = Project
         fields = (
-            'id', 'name', 'owner', 'owner_username', 'images', 
-            'variants', 'versions', 'created_at', 'updated_at'
+            'id', 'name', 'owner', 'owner_username', 'images',
+            'variants', 'versions', 'revision', 'created_at', 'updated_at'
         )
-        read_only_fields = ('id', 'owner', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'owner', 'revision', 'created_at', 'updated_at')
+
+    def to_representation(self, instance):
+        if self.parent is None:
+            prefetch_related_objects([instance], variant_prefetch(), recent_versions_prefetch())
+            writebehind.overlay_variants(list(instance.variants.all()))
+        return super().to_representation(instance)
 
     def create(self, validated_data):
         """Create project with current user as owner."""
@@ -67,16 +317,25 @@ class ProjectSerializer(serializers.ModelSerializer):
 
 
 class ProjectListSerializer(serializers.ModelSerializer):
-    """Lightweight serializer for project list view."""
+    """
+    Lightweight serializer for project list view.
+    Counts and the cover image come from queryset annotations
+    (see querysets.with_list_counts and querysets.with_cover).
+    """
     owner_username = serializers.CharField(source='owner.username', read_only=True)
-    image_count = serializers.IntegerField(source='images.count', read_only=True)
-    variant_count = serializers.IntegerField(source='variants.count', read_only=True)
+    image_count = serializers.IntegerField(read_only=True)
+    variant_count = serializers.IntegerField(read_only=True)
+    cover = serializers.SerializerMethodField()
     
     class Meta:
         model = Project
         fields = (
             'id', 'name', 'owner_username', 'image_count', 
-            'variant_count', 'created_at', 'updated_at'
+            'variant_count', 'cover', 'created_at', 'updated_at'
         )
         read_only_fields = ('id', 'created_at', 'updated_at')
 
+    def get_cover(self, obj):
+        urls = srcset_map(getattr(obj, 'cover_url', None), getattr(obj, 'cover_derivatives', None))
+        return absolute_srcset(self, urls)
+
@@ -0,0 +1,85 @@
+"""
+Signal handlers that keep denormalized project data in sync, queue
+background processing of new images and show item changes to live
+viewers (see collaboration.py).
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import collaboration, derivatives, generation
+from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version
+from .tasks import generate_derivatives
+
+
+@receiver(post_save, sender=ProjectImage)
+@receiver(post_save, sender=DesignVariant)
+def increment_project_counter(sender, instance, created, raw=False, **kwargs):
+    """Count a newly created image or variant on its project."""
+    if raw:
+        return
+    if created:
+        Project.adjust_counter(sender.project_counter_field, {instance.project_id: 1})
+    else:
+        Project.bump_revision([instance.project_id])
+
+
+@receiver(post_save, sender=Version)
+def bump_revision_on_version(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        Project.bump_revision([instance.project_id])
+
+
+@receiver(post_save, sender=ItemInstance)
+@receiver(post_delete, sender=ItemInstance)
+def bump_revision_on_item(sender, instance, raw=False, **kwargs):
+    if not raw:
+        DesignVariant.bump_revision([instance.variant_id])
+
+
+@receiver(post_save, sender=ItemInstance)
+def publish_saved_item(sender, instance, raw=False, **kwargs):
+    """Show an item saved outside the live channel to the variant's live viewers."""
+    if raw:
+        return
+    if not isinstance(instance.version, int):
+        # save() incremented the version in the database
+        instance.refresh_from_db(fields=['version'])
+    state = collaboration.item_state(instance)
+    transaction.on_commit(lambda: collaboration.publish_items(instance.variant_id, [state]))
+
+
+@receiver(post_delete, sender=ItemInstance)
+def publish_deleted_item(sender, instance, **kwargs):
+    variant_id, item_id = instance.variant_id, instance.pk
+    transaction.on_commit(lambda: collaboration.publish_items(variant_id, deleted=[item_id]))
+
+
+@receiver(post_save, sender=ProjectImage)
+@receiver(post_save, sender=DesignVariant)
+def queue_derivatives(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Render responsive derivatives of a new image or variant, or a changed image_url."""
+    if raw or (update_fields and 'image_url' not in update_fields):
+        return
+    stale = 'derivatives' in instance.metadata and not derivatives.is_current(instance)
+    if created or stale:
+        model_name, pk = sender._meta.model_name, instance.pk
+        transaction.on_commit(lambda: generate_derivatives.delay(model_name, pk))
+
+
+@receiver(post_delete, sender=ProjectImage)
+@receiver(post_delete, sender=DesignVariant)
+def decrement_project_counter(sender, instance, **kwargs):
+    """
+    Uncount a deleted image or variant.
+    QuerySet.delete() sends post_delete per row, so bulk deletes are covered.
+    """
+    Project.adjust_counter(sender.project_counter_field, {instance.project_id: -1})
+
+
+@receiver(post_delete, sender=DesignVariant)
+def evict_generation_result(sender, instance, **kwargs):
+    """Stop reusing a cached generation once its variant is gone."""
+    key = instance.metadata.get('generation_key')
+    if key:
+        generation.evict(key)
@@ -0,0 +1,94 @@
+"""
+Spatial queries over the items of one variant.
+
+- region: items whose bbox intersects a rectangle
+- hit test: items whose bbox contains a point, topmost (newest) first
+- overlaps: pairs of items whose bboxes share a positive area
+
+On PostgreSQL these run in SQL against the GiST index on the variant and
+the item box (geometry.ItemBox), so a query only visits its variant's
+entries. Other databases (tests, local development) load the
+variant's boxes and answer from an in-memory R-tree. spatial_queries()
+picks the implementation for the current database.
+"""
+from django.db import connection
+
+from .geometry import Box, Contains, ItemBox, Overlaps, RTree, intersects, overlap_area
+from .models import ItemInstance
+
+
+class PostgresSpatialQueries:
+    """Spatial queries in SQL, served by item_variant_bbox_gist_idx."""
+
+    def region(self, items, x1, y1, x2, y2):
+        return items.filter(Overlaps(ItemBox(), Box.from_bounds(x1, y1, x2, y2)))
+
+    def hit_test(self, items, x, y):
+        return items.filter(Contains(ItemBox(), Box.from_bounds(x, y, x, y)))
+
+    def overlaps(self, variant_id):
+        """[(item_id, other_id, area)] with item_id < other_id, largest overlap first."""
+        box = 'box(point({t}.bbox_x, {t}.bbox_y), point({t}.bbox_x + {t}.bbox_width, {t}.bbox_y + {t}.bbox_height))'
+        a, b = box.format(t='a'), box.format(t='b')
+        sql = f"""
+            SELECT a.id, b.id, area({a} # {b}) AS shared
+            FROM {ItemInstance._meta.db_table} a
+            JOIN {ItemInstance._meta.db_table} b
+              ON b.variant_id = a.variant_id AND a.id < b.id AND {a} && {b}
+            WHERE a.variant_id = %s AND area({a} # {b}) > 0
+            ORDER BY shared DESC, a.id, b.id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [variant_id])
+            return [(first, second, float(shared)) for first, second, shared in cursor.fetchall()]
+
+
+class RTreeSpatialQueries:
+    """Spatial queries answered from an in-memory R-tree of the variant's items."""
+
+    def _boxes(self, items):
+        return {
+            item_id: (x, y, x + width, y + height)
+            for item_id, x, y, width, height in items.order_by().values_list(
+                'id', 'bbox_x', 'bbox_y', 'bbox_width', 'bbox_height'
+            )
+        }
+
+    def _tree(self, boxes):
+        return RTree((item_id, *bounds) for item_id, bounds in boxes.items())
+
+    def region(self, items, x1, y1, x2, y2):
+        found = self._tree(self._boxes(items)).search(x1, y1, x2, y2)
+        return items.filter(id__in=found)
+
+    def hit_test(self, items, x, y):
+        return self.region(items, x, y, x, y)
+
+    def overlaps(self, variant_id):
+        boxes = self._boxes(ItemInstance.objects.filter(variant_id=variant_id))
+        tree = self._tree(boxes)
+        pairs = []
+        for item_id, bounds in boxes.items():
+            for other_id in tree.search(*bounds):
+                if item_id < other_id:
+                    shared = overlap_area(bounds, boxes[other_id])
+                    if shared > 0:
+                        pairs.append((item_id, other_id, shared))
+        pairs.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+        return pairs
+
+
+def spatial_queries():
+    if connection.vendor == 'postgresql':
+        return PostgresSpatialQueries()
+    return RTreeSpatialQueries()
+
+
+def linear_scan(items, x1, y1, x2, y2):
+    """Reference region query without any index (used by the benchmark)."""
+    query = (x1, y1, x2, y2)
+    return [
+        item_id
+        for item_id, x, y, width, height in items.values_list('id', 'bbox_x', 'bbox_y', 'bbox_width', 'bbox_height')
+        if intersects((x, y, x + width, y + height), query)
+    ]
@@ -0,0 +1,341 @@
+"""
+Direct-to-storage uploads.
+
+Instead of proxying files through a Django worker, the API issues a signed,
+short-lived upload ticket. The client sends the file straight to the
+storage backend, then the upload is confirmed either by the client
+(upload-complete) or by the storage provider's callback, and the
+ProjectImage is recorded.
+
+The backend is chosen with settings.UPLOAD_BACKEND:
+- CloudinaryUploadBackend: signed uploads to Cloudinary (production)
+- LocalUploadBackend: Django's default storage (tests, local development)
+
+Stored files are read back (derivatives, renders, exports, model LODs)
+with fetch() and open(), which only request URLs on the backend's own
+storage host or in settings.UPLOAD_FETCH_HOSTS: image URLs are client
+input, and the workers must not request internal addresses for them.
+"""
+import hashlib
+import hmac
+import time
+import uuid
+from io import BytesIO
+from urllib.parse import urlparse
+from urllib.request import HTTPRedirectHandler, build_opener
+
+import cloudinary.api
+import cloudinary.uploader
+import cloudinary.utils
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from .models import Project, ProjectImage
+
+TICKET_SALT = 'dreamspace.upload-ticket'
+
+
+class InvalidUpload(Exception):
+    """Raised when a ticket or storage result cannot be trusted."""
+
+
+class UntrustedURL(ValueError):
+    """Raised when asked to fetch a URL outside the storage hosts."""
+
+
+class _CheckedRedirects(HTTPRedirectHandler):
+    """Follows redirects only to URLs the backend may fetch."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.backend.check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class BaseUploadBackend:
+    """Interface for upload storage backends."""
+    # ProjectImage.metadata key holding the backend's asset id
+    metadata_key = 'storage_id'
+
+    def upload_params(self, request, public_id, ticket):
+        """Return (upload_url, form_fields) the client posts the file with."""
+        raise NotImplementedError
+
+    def verify_result(self, result):
+        """
+        Check a storage upload result is authentic and return it normalized
+        to {public_id, url, width, height, format}.
+        """
+        raise NotImplementedError
+
+    def parse_callback(self, request):
+        """Authenticate a storage callback and return (ticket, result)."""
+        raise InvalidUpload('This backend does not send callbacks')
+
+    def is_storage_url(self, url):
+        """True if `url` points at this backend's storage host."""
+        return False
+
+    def check_url(self, url):
+        """Raise UntrustedURL unless `url` may be fetched."""
+        parsed = urlparse(url)
+        allowed = {host.lower() for host in settings.UPLOAD_FETCH_HOSTS}
+        if parsed.scheme in ('http', 'https') and (parsed.hostname in allowed or self.is_storage_url(url)):
+            return
+        raise UntrustedURL(f'Not a storage URL: {url}')
+
+    def fetch(self, url):
+        """Return the bytes of a stored image."""
+        with self.open(url) as response:
+            return response.read()
+
+    def open(self, url):
+        """Open a stored file for streaming reads (a context manager)."""
+        self.check_url(url)
+        return build_opener(_CheckedRedirects(self)).open(url, timeout=30)
+
+    def store_derivative(self, public_id, content, extension):
+        """Store a rendered derivative (see derivatives.py) and return its URL."""
+        raise NotImplementedError
+
+    def delete_assets(self, assets):
+        """Delete stored files, given as (public_id, url) pairs."""
+        raise NotImplementedError
+
+    def normalize(self, result):
+        return {
+            'public_id': result['public_id'],
+            'url': result['secure_url'],
+            'width': result.get('width'),
+            'height': result.get('height'),
+            'format': result.get('format'),
+        }
+
+
+class CloudinaryUploadBackend(BaseUploadBackend):
+    """Signed direct uploads to Cloudinary."""
+    metadata_key = 'cloudinary_id'
+
+    def _sign(self, params):
+        return cloudinary.utils.api_sign_request(params, settings.CLOUDINARY_CONFIG['api_secret'])
+
+    def is_storage_url(self, url):
+        parsed = urlparse(url)
+        return (
+            parsed.scheme == 'https' and parsed.hostname == 'res.cloudinary.com'
+            and parsed.path.startswith(f"/{settings.CLOUDINARY_CONFIG['cloud_name']}/")
+        )
+
+    def upload_params(self, request, public_id, ticket):
+        callback = request.build_absolute_uri(reverse('projects:upload-callback'))
+        params = {
+            'public_id': public_id,
+            'timestamp': int(time.time()),
+            'notification_url': f'{callback}?ticket={ticket}',
+        }
+        fields = dict(params, api_key=settings.CLOUDINARY_CONFIG['api_key'], signature=self._sign(params))
+        url = cloudinary.utils.cloudinary_api_url('upload', cloud_name=settings.CLOUDINARY_CONFIG['cloud_name'])
+        return url, fields
+
+    def verify_result(self, result):
+        try:
+            expected = self._sign({'public_id': result['public_id'], 'version': result['version']})
+        except KeyError:
+            raise InvalidUpload('Incomplete upload result')
+        if not hmac.compare_digest(expected, str(result.get('signature', ''))):
+            raise InvalidUpload('Upload result signature mismatch')
+        return self.normalize(result)
+
+    def parse_callback(self, request):
+        timestamp = request.headers.get('X-Cld-Timestamp', '')
+        signature = request.headers.get('X-Cld-Signature', '')
+        body = request.body.decode()
+        secret = settings.CLOUDINARY_CONFIG['api_secret']
+        expected = hashlib.sha1(f'{body}{timestamp}{secret}'.encode()).hexdigest()
+        if not timestamp.isdigit() or int(timestamp) < time.time() - 7200:
+            raise InvalidUpload('Stale callback')
+        if not hmac.compare_digest(expected, signature):
+            raise InvalidUpload('Callback signature mismatch')
+        return request.query_params.get('ticket', ''), request.data
+
+    def store_derivative(self, public_id, content, extension):
+        result = cloudinary.uploader.upload(
+            BytesIO(content),
+            public_id=public_id,
+            format=extension,
+            overwrite=True,
+            **settings.CLOUDINARY_CONFIG
+        )
+        return result['secure_url']
+
+    # Admin API limit on public ids per delete_resources call
+    delete_batch_size = 100
+
+    def delete_assets(self, assets):
+        public_ids = sorted({public_id for public_id, _ in assets})
+        for start in range(0, len(public_ids), self.delete_batch_size):
+            cloudinary.api.delete_resources(
+                public_ids[start:start + self.delete_batch_size], **settings.CLOUDINARY_CONFIG
+            )
+
+
+class LocalUploadBackend(BaseUploadBackend):
+    """
+    Stores uploads with Django's default storage through the local upload
+    endpoint. Results are signed with SECRET_KEY like Cloudinary's.
+    """
+    salt = 'dreamspace.local-upload'
+
+    def upload_params(self, request, public_id, ticket):
+        url = request.build_absolute_uri(reverse('projects:upload-local'))
+        return url, {'token': signing.Signer(salt=self.salt).sign(public_id)}
+
+    def _signature(self, public_id, version):
+        return signing.Signer(salt=self.salt).signature(f'{public_id}:{version}')
+
+    def receive(self, request):
+        """Store a file posted to the local upload endpoint; return the result."""
+        try:
+            public_id = signing.Signer(salt=self.salt).unsign(request.data.get('token', ''))
+        except signing.BadSignature:
+            raise InvalidUpload('Invalid upload token')
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise InvalidUpload('No file provided')
+
+        content = upload.read()
+        try:
+            image = Image.open(BytesIO(content))
+            width, height, image_format = image.width, image.height, (image.format or '').lower()
+        except Exception:
+            raise InvalidUpload('File is not an image')
+
+        name = default_storage.save(f'{public_id}.{image_format or "bin"}', BytesIO(content))
+        version = int(time.time())
+        return {
+            'public_id': public_id,
+            'version': version,
+            'secure_url': request.build_absolute_uri(default_storage.url(name)),
+            'width': width,
+            'height': height,
+            'format': image_format,
+            'signature': self._signature(public_id, version),
+        }
+
+    def _stored_name(self, url):
+        """Storage name of one of our own files, or None."""
+        path = urlparse(url).path
+        prefix = urlparse(default_storage.base_url).path
+        if prefix and path.startswith(prefix):
+            return path[len(prefix):]
+        return None
+
+    def fetch(self, url):
+        # Read our own files from storage rather than over HTTP
+        name = self._stored_name(url)
+        if name is not None:
+            with default_storage.open(name) as stored:
+                return stored.read()
+        return super().fetch(url)
+
+    def open(self, url):
+        name = self._stored_name(url)
+        if name is not None:
+            return default_storage.open(name)
+        return super().open(url)
+
+    def delete_assets(self, assets):
+        for _, url in assets:
+            name = self._stored_name(url)
+            if name is not None:
+                default_storage.delete(name)
+
+    def store_derivative(self, public_id, content, extension):
+        name = f'{public_id}.{extension}'
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        return default_storage.url(default_storage.save(name, BytesIO(content)))
+
+    def verify_result(self, result):
+        try:
+            expected = self._signature(result['public_id'], result['version'])
+        except KeyError:
+            raise InvalidUpload('Incomplete upload result')
+        if not hmac.compare_digest(expected, str(result.get('signature', ''))):
+            raise InvalidUpload('Upload result signature mismatch')
+        return self.normalize(result)
+
+
+def get_upload_backend():
+    return import_string(settings.UPLOAD_BACKEND)()
+
+
+def issue_ticket(request, project, image_type):
+    """Create a signed upload ticket for one image of `project`."""
+    public_id = f'dreamspace/projects/{project.id}/{uuid.uuid4().hex}'
+    ticket = signing.dumps(
+        {'project': project.id, 'user': request.user.id, 'type': image_type, 'public_id': public_id},
+        salt=TICKET_SALT,
+    )
+    upload_url, fields = get_upload_backend().upload_params(request, public_id, ticket)
+    return {
+        'ticket': ticket,
+        'upload_url': upload_url,
+        'fields': fields,
+        'expires_in': settings.UPLOAD_TICKET_TTL,
+    }
+
+
+def redeem_ticket(ticket, enforce_ttl=True):
+    """
+    Decode a ticket. Storage callbacks skip the TTL: they are already
+    authenticated and may arrive after the ticket lifetime.
+    """
+    max_age = settings.UPLOAD_TICKET_TTL if enforce_ttl else None
+    try:
+        return signing.loads(ticket, salt=TICKET_SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise InvalidUpload('Upload ticket expired')
+    except signing.BadSignature:
+        raise InvalidUpload('Invalid upload ticket')
+
+
+def complete_upload(ticket_data, result):
+    """
+    Record the ProjectImage for a verified upload.
+    Idempotent: the client confirmation and the storage callback may both
+    arrive. Returns (project_image, created).
+    """
+    backend = get_upload_backend()
+    asset = backend.verify_result(result)
+    if asset['public_id'] != ticket_data['public_id']:
+        raise InvalidUpload('Upload result does not match ticket')
+
+    with transaction.atomic():
+        project = Project.objects.live().select_for_update().filter(pk=ticket_data['project']).first()
+        if project is None:
+            raise InvalidUpload('Project no longer exists')
+        # Containment (@>) so the lookup can use the metadata GIN index
+        lookup = {backend.metadata_key: asset['public_id']}
+        existing = project.images.filter(metadata__contains=lookup).first()
+        if existing:
+            return existing, False
+        image = ProjectImage.objects.create(
+            project=project,
+            type=ticket_data['type'],
+            image_url=asset['url'],
+            metadata={
+                'width': asset['width'],
+                'height': asset['height'],
+                'format': asset['format'],
+                backend.metadata_key: asset['public_id'],
+            },
+        )
+    return image, True
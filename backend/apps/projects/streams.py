@@ -0,0 +1,171 @@
+"""
+Streaming endpoints, served by the ASGI application: server-sent event
+streams and project export archives.
+
+These are plain async Django views rather than DRF views so a connected
+client holds no worker thread while it waits for updates. Under ASGI,
+Django buffers a synchronous iterator completely before sending it, so
+synchronous producers are pulled one chunk at a time (iterate_in_thread).
+
+Browsers cannot set headers on a download link, an EventSource or a
+WebSocket, so those URLs authenticate with a short-lived token signed for
+that one URL (issue_url_token) rather than the access token, which would
+end up in browser history and proxy logs.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from . import writebehind
+from .archive import export_chunks
+from .models import Project
+from .progress import aget_status, channel_name, TERMINAL_STATES
+from .realtime import get_broker
+
+URL_TOKEN_SALT = 'dreamspace.projects.url-token'
+
+
+def issue_url_token(user, scope):
+    """
+    A signed token authenticating `user` for one URL `scope` (such as
+    'export:12') for URL_TOKEN_TTL seconds.
+    """
+    return signing.dumps({'scope': scope, 'user': user.id}, salt=URL_TOKEN_SALT)
+
+
+async def url_token_user(token, scope):
+    """The active user a token was issued to for `scope`, or None if invalid or expired."""
+    try:
+        data = signing.loads(token, salt=URL_TOKEN_SALT, max_age=settings.URL_TOKEN_TTL)
+    except signing.BadSignature:
+        return None
+    if data.get('scope') != scope:
+        return None
+    return await get_user_model().objects.filter(pk=data['user'], is_active=True).afirst()
+
+
+async def authenticate(request, scope):
+    """
+    Resolve the user of an async view: the JWT in the Authorization header,
+    or a ?token= issued for `scope`.
+    """
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    if header:
+        return await user_for_token(auth.get_raw_token(header))
+    return await url_token_user(request.GET.get('token', ''), scope)
+
+
+async def user_for_token(raw_token):
+    """The user a raw JWT access token belongs to, or None."""
+    if not raw_token:
+        return None
+    auth = JWTAuthentication()
+    try:
+        validated = auth.get_validated_token(raw_token)
+        return await sync_to_async(auth.get_user)(validated)
+    except (InvalidToken, TokenError):
+        return None
+
+
+async def iterate_in_thread(iterator):
+    """
+    Yield from a synchronous iterator without blocking the event loop.
+    Every step runs in the same thread, so database cursors stay valid.
+    """
+    sentinel = object()
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await step(iterator, sentinel)) is not sentinel:
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+def task_events_scope(project_id, task_id):
+    return f'task-events:{project_id}:{task_id}'
+
+
+def export_scope(project_id):
+    return f'export:{project_id}'
+
+
+def _event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+async def task_events(request, pk, task_id):
+    """
+    GET /api/projects/{id}/tasks/{task_id}/events/
+    Stream progress updates for a generation task as server-sent events.
+    Sends the current state first and closes after done or error.
+    EventSource cannot set headers: pass ?token= from
+    POST /api/projects/{id}/tasks/{task_id}/events-token/.
+    """
+    user = await authenticate(request, task_events_scope(pk, task_id))
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    if not await Project.objects.live().filter(pk=pk, owner=user).aexists():
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    # Subscribe before reading the current state so no update is missed
+    subscription = await get_broker().subscribe(channel_name(task_id))
+    current = await aget_status(task_id)
+    if current is None or current['project_id'] != pk:
+        await subscription.close()
+        return JsonResponse({'error': 'Unknown task'}, status=404)
+
+    async def stream():
+        try:
+            yield _event('progress', current)
+            if current['state'] in TERMINAL_STATES:
+                return
+            while True:
+                update = await subscription.get(timeout=settings.SSE_HEARTBEAT_SECONDS)
+                if update is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield _event('progress', update)
+                if update['state'] in TERMINAL_STATES:
+                    return
+        finally:
+            await subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def project_export(request, pk):
+    """
+    GET /api/projects/{id}/export/
+    Download the project (images, variants, items, version history and
+    the stored image files) as a streamed ZIP archive; see archive.py.
+    ?assets=0 leaves out the image files.
+
+    For a plain download link, pass ?token= from
+    POST /api/projects/{id}/export-token/.
+    """
+    user = await authenticate(request, export_scope(pk))
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    project = await Project.objects.live().filter(pk=pk, owner=user).afirst()
+    if project is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    await sync_to_async(writebehind.flush)(project_ids=[project.id])
+    include_assets = request.GET.get('assets', '1') not in ('0', 'false')
+    response = StreamingHttpResponse(
+        iterate_in_thread(export_chunks(project, include_assets)), content_type='application/zip'
+    )
+    response['Content-Disposition'] = f'attachment; filename="project-{project.id}.zip"'
+    response['Cache-Control'] = 'no-store'
+    response['X-Accel-Buffering'] = 'no'
+    return response
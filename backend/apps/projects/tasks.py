@@ -4,14 +4,61 @@ Celery tasks for async AI processing.
 This is a STUB implementation for MVP.
 In production, replace with actual AI model integration.
 """
+import logging
+
+import cloudinary.exceptions
 import cloudinary.uploader
-from celery import shared_task
+from celery import chord, group, shared_task
+from django.apps import apps
+from django.core.cache import cache
 from django.conf import settings
-from .models import Project, ProjectImage, DesignVariant
+from django.db import DatabaseError, transaction
+from django.db.models import Prefetch
+from . import derivatives, fingerprints, generation, purge, rendering, writebehind
+from .models import Project, ProjectImage, DesignVariant, ItemInstance
+from .progress import publish_progress, RUNNING, DONE, ERROR
+from .storage import UntrustedURL, get_upload_backend
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def generate_variant(project_id, prompt=''):
+
+def _render_stub(cloudinary_id, image_url, label):
+    """
+    STUB: In real implementation, this would:
+    1. Download the base image
+    2. Run it through AI model with the prompt
+    3. Upload the generated result
+    
+    For now, just duplicate the image with a different URL
+    (In production, this would be the AI-generated image)
+    """
+    if cloudinary_id:
+        # Create a transformed version (example: apply sepia effect as "generation")
+        return cloudinary.CloudinaryImage(cloudinary_id).build_url(
+            transformation=[
+                {'effect': 'sepia:50'},
+                {'overlay': f'text:Arial_30:{label}'},
+            ]
+        )
+    # Fallback: just use the same URL
+    return image_url
+
+
+def _fail(task_id, project_id, message, cache_key=None, user_id=None):
+    """Report a failed generation and free its dedup claim and user slot."""
+    if cache_key:
+        generation.release(cache_key)
+    if user_id:
+        generation.release_slots(user_id, 1)
+    publish_progress(task_id, project_id, ERROR, percent=100, message=message)
+    return {
+        'status': 'error',
+        'message': message
+    }
+
+
+@shared_task(bind=True)
+def generate_variant(self, project_id, prompt='', params=None, cache_key=None, user_id=None):
     """
     STUB: Generate a design variant for a project.
     
@@ -22,39 +69,26 @@ def generate_variant(project_id, prompt=''):
     - Use Stable Diffusion / DALL-E for image generation
     - Apply style transfer or room redesign models
     - Perform object detection and segmentation
+    
+    Progress is published under the task id (see progress.py). When
+    `cache_key` is given, the result is recorded for dedup (generation.py);
+    with `user_id`, the user's concurrency slot is released when done.
     """
+    task_id = self.request.id
     try:
         project = Project.objects.get(id=project_id)
+        publish_progress(task_id, project_id, RUNNING, percent=10)
         
         # Get the first original image as base
         base_image = project.images.filter(type='original').first()
         
         if not base_image:
-            return {
-                'status': 'error',
-                'message': 'No original image found in project'
-            }
-        
-        # STUB: In real implementation, this would:
-        # 1. Download the base image
-        # 2. Run it through AI model with the prompt
-        # 3. Upload the generated result
+            return _fail(task_id, project_id, 'No original image found in project', cache_key, user_id)
         
-        # For now, just duplicate the image with a different URL
-        # (In production, this would be the AI-generated image)
-        cloudinary_id = base_image.metadata.get('cloudinary_id', '')
-        
-        if cloudinary_id:
-            # Create a transformed version (example: apply sepia effect as "generation")
-            transformed_url = cloudinary.CloudinaryImage(cloudinary_id).build_url(
-                transformation=[
-                    {'effect': 'sepia:50'},
-                    {'overlay': 'text:Arial_30:AI Generated'},
-                ]
-            )
-        else:
-            # Fallback: just use the same URL
-            transformed_url = base_image.image_url
+        transformed_url = _render_stub(
+            base_image.metadata.get('cloudinary_id', ''), base_image.image_url, 'AI Generated'
+        )
+        publish_progress(task_id, project_id, RUNNING, percent=70)
         
         # Create DesignVariant
         variant = DesignVariant.objects.create(
@@ -62,11 +96,18 @@ def generate_variant(project_id, prompt=''):
             image_url=transformed_url,
             metadata={
                 'prompt': prompt,
+                'params': params or {},
+                'generation_key': cache_key,
                 'base_image_id': base_image.id,
                 'generation_type': 'stub',
                 'note': 'This is a stub implementation. Replace with real AI model.'
             }
         )
+        if cache_key:
+            generation.record_result(cache_key, task_id, variant)
+        if user_id:
+            generation.release_slots(user_id, 1)
+        publish_progress(task_id, project_id, DONE, percent=100, variant_id=variant.id)
         
         return {
             'status': 'success',
@@ -76,13 +117,243 @@ def generate_variant(project_id, prompt=''):
         }
         
     except Project.DoesNotExist:
-        return {
-            'status': 'error',
-            'message': f'Project {project_id} not found'
-        }
+        return _fail(task_id, project_id, f'Project {project_id} not found', cache_key, user_id)
     except Exception as e:
-        return {
-            'status': 'error',
-            'message': str(e)
-        }
+        return _fail(task_id, project_id, str(e), cache_key, user_id)
 
+
+def start_generation_batch(project_id, base_image, prompt, count, params, batch_id, user_id, priority=None):
+    """
+    Queue `count` variant options for one prompt as a Celery chord:
+    the base image is resolved once, the options render in parallel and
+    a single callback inserts all variants.
+    """
+    base = {
+        'project_id': project_id,
+        'id': base_image.id,
+        'cloudinary_id': base_image.metadata.get('cloudinary_id', ''),
+        'image_url': base_image.image_url,
+    }
+    options = group(
+        generate_option.s(base, index, prompt, params, batch_id, count).set(priority=priority)
+        for index in range(count)
+    )
+    callback = store_batch_variants.s(project_id, prompt, params, batch_id, user_id, count)
+    return chord(options)(callback)
+
+
+@shared_task
+def generate_option(base, index, prompt, params, batch_id, count):
+    """
+    STUB: Render option `index` of a batch from the shared base image.
+    Returns the option for store_batch_variants; never raises, so one
+    failed option does not sink the batch.
+    """
+    try:
+        image_url = _render_stub(base['cloudinary_id'], base['image_url'], f'AI Option {index + 1}')
+    except Exception as e:
+        return {'index': index, 'error': str(e)}
+
+    finished_key = f'generation-batch-finished:{batch_id}'
+    cache.add(finished_key, 0, timeout=settings.GENERATION_INFLIGHT_TTL)
+    finished = cache.incr(finished_key)
+    publish_progress(batch_id, base['project_id'], RUNNING, percent=int(90 * finished / count))
+    return {'index': index, 'image_url': image_url, 'base_image_id': base['id']}
+
+
+@shared_task
+def store_batch_variants(options, project_id, prompt, params, batch_id, user_id, count):
+    """Insert every rendered option with one bulk insert and finish the batch."""
+    cache.delete(f'generation-batch-finished:{batch_id}')
+    generation.release_slots(user_id, count)
+
+    rendered = sorted((o for o in options if 'error' not in o), key=lambda o: o['index'])
+    if not rendered:
+        return _fail(batch_id, project_id, 'All options failed')
+
+    variants = DesignVariant.objects.bulk_create([
+        DesignVariant(
+            project_id=project_id,
+            image_url=option['image_url'],
+            metadata={
+                'prompt': prompt,
+                'params': params or {},
+                'base_image_id': option['base_image_id'],
+                'batch_id': batch_id,
+                'option': option['index'],
+                'generation_type': 'stub',
+            }
+        )
+        for option in rendered
+    ])
+    variant_ids = [variant.id for variant in variants]
+    # bulk_create sends no post_save, so queue the derivatives here
+    for variant_id in variant_ids:
+        generate_derivatives.delay('designvariant', variant_id)
+    publish_progress(batch_id, project_id, DONE, percent=100, variant_ids=variant_ids)
+    return {
+        'status': 'success',
+        'variant_ids': variant_ids,
+        'failed': count - len(rendered),
+    }
+
+
+@shared_task(bind=True, max_retries=3)
+def generate_derivatives(self, model_name, pk, force=False):
+    """
+    Render the responsive derivatives (derivatives.DERIVATIVES) of a
+    ProjectImage or DesignVariant and record them in its metadata.
+    Skipped if they already exist for the current image, unless `force`.
+    Fetch failures are retried with backoff.
+    
+    Images uploaded directly to storage are fingerprinted here, since the
+    API never sees their bytes (see fingerprints.py).
+    """
+    model = apps.get_model('projects', model_name)
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        return {'status': 'error', 'message': f'{model_name} {pk} not found'}
+    if derivatives.is_current(obj) and not force:
+        return {'status': 'skipped', 'derivatives': obj.metadata['derivatives']}
+
+    backend = get_upload_backend()
+    source = obj.image_url
+    try:
+        content = backend.fetch(source)
+    except UntrustedURL as e:
+        logger.warning('Cannot render derivatives of %s %s: %s', model_name, pk, e)
+        return {'status': 'error', 'message': str(e)}
+    except OSError as e:
+        raise self.retry(exc=e, countdown=10 * 2 ** self.request.retries)
+
+    try:
+        rendered = derivatives.render(content)
+    except Exception as e:
+        logger.warning('Cannot render derivatives of %s %s: %s', model_name, pk, e)
+        return {'status': 'error', 'message': str(e)}
+
+    recorded = {'source': source}
+    for name, (data, width, height, image_format) in rendered.items():
+        extension = derivatives.EXTENSIONS[image_format]
+        url = backend.store_derivative(f'dreamspace/derivatives/{model_name}/{pk}/{name}', data, extension)
+        recorded[name] = {'url': url, 'width': width, 'height': height, 'format': extension}
+
+    with transaction.atomic():
+        obj = model.objects.select_for_update().filter(pk=pk).first()
+        # Deleted or re-pointed at another image while rendering
+        if obj is None or obj.image_url != source:
+            return {'status': 'stale'}
+        changes = {'metadata': dict(obj.metadata or {}, derivatives=recorded)}
+        if model is ProjectImage and not obj.content_hash:
+            changes.update(fingerprints.fingerprint(content))
+        model.objects.filter(pk=pk).update(**changes)
+        Project.bump_revision([obj.project_id])
+
+    return {'status': 'success', 'derivatives': recorded}
+
+
+@shared_task(bind=True, max_retries=3)
+def render_variant(self, variant_id, output='jpeg'):
+    """
+    Render the flattened variant (see rendering.py) and record it in its
+    metadata. Reuses an existing render of the same state; fetch failures
+    are retried with backoff.
+    """
+    variant = DesignVariant.objects.filter(pk=variant_id).first()
+    if variant is None:
+        return {'status': 'error', 'message': f'Variant {variant_id} not found'}
+    items = rendering.variant_items(variant)
+    key, record = rendering.current_render(variant, output, items)
+
+    if record is None:
+        try:
+            content = get_upload_backend().fetch(variant.image_url)
+        except UntrustedURL as e:
+            logger.warning('Cannot render variant %s: %s', variant_id, e)
+            cache.delete(f'variant-render-queued:{key}')
+            return {'status': 'error', 'message': str(e)}
+        except OSError as e:
+            raise self.retry(exc=e, countdown=10 * 2 ** self.request.retries)
+        try:
+            data, width, height = rendering.composite(content, items, output)
+        except Exception as e:
+            logger.warning('Cannot render variant %s: %s', variant_id, e)
+            cache.delete(f'variant-render-queued:{key}')
+            return {'status': 'error', 'message': str(e)}
+        extension = rendering.FORMATS[output][1]
+        url = get_upload_backend().store_derivative(f'dreamspace/renders/{key}', data, extension)
+        record = {'key': key, 'url': url, 'width': width, 'height': height, 'format': extension}
+        rendering.remember(key, record)
+    cache.delete(f'variant-render-queued:{key}')
+
+    with transaction.atomic():
+        variant = DesignVariant.objects.select_for_update().filter(pk=variant_id).first()
+        if variant is None:
+            return {'status': 'stale'}
+        if (variant.metadata or {}).get('renders', {}).get(output) != record:
+            metadata = dict(variant.metadata or {})
+            metadata['renders'] = dict(metadata.get('renders', {}), **{output: record})
+            DesignVariant.objects.filter(pk=variant_id).update(metadata=metadata)
+            Project.bump_revision([variant.project_id])
+
+    return {'status': 'success', 'render': record}
+
+
+def queue_render(variant, output, key, **options):
+    """
+    Queue render_variant unless a render of the same state is already
+    queued. Returns the task id, or None if it was already queued.
+    """
+    if not cache.add(f'variant-render-queued:{key}', 1, timeout=settings.RENDER_QUEUED_TTL):
+        return None
+    return render_variant.apply_async((variant.id, output), **options).id
+
+
+def start_project_render(project, output):
+    """
+    Queue renders for every variant of `project` whose current state has
+    not been rendered, on the bulk queue. Returns {variant_id: task_id or
+    None (already queued)} for the queued variants and the records of the
+    current ones.
+    """
+    variants = project.variants.order_by('-created_at', '-id').prefetch_related(
+        Prefetch('items', queryset=ItemInstance.objects.order_by('created_at', 'id'))
+    )
+    queued, current = {}, {}
+    for variant in variants:
+        key, record = rendering.current_render(variant, output, list(variant.items.all()))
+        if record is not None:
+            current[variant.id] = record
+        else:
+            queued[variant.id] = queue_render(variant, output, key, queue='bulk')
+    return queued, current
+
+
+@shared_task(bind=True, max_retries=5)
+def purge_project(self, project_id):
+    """
+    Delete a tombstoned project's stored files and rows in batches
+    (see purge.py). Storage failures are retried with backoff.
+    """
+    try:
+        counts = purge.purge(project_id, settings.PURGE_BATCH_SIZE)
+    except (cloudinary.exceptions.Error, OSError) as e:
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
+    if counts is None:
+        return {'status': 'skipped'}
+    return {'status': 'success', 'deleted': counts}
+
+
+@shared_task(bind=True, max_retries=5)
+def flush_item_writes(self):
+    """
+    Write the item edits buffered since the last flush to the database
+    (see writebehind.py). Database errors are retried with backoff.
+    """
+    # Edits buffered from now on queue the next flush
+    cache.delete(writebehind.FLUSH_QUEUED_KEY)
+    try:
+        written = writebehind.flush()
+    except DatabaseError as e:
+        raise self.retry(exc=e, countdown=2 * 2 ** self.request.retries)
+    return {'status': 'success', 'written': written}
@@ -0,0 +1,977 @@
+"""
+Tests for the projects app.
+"""
+import base64
+import hashlib
+import json
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from unittest import mock, skipUnless
+from urllib.request import Request
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import collaboration, fingerprints, generation, masks, purge, rendering, writebehind
+from .geometry import RTree, intersects
+from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version
+from .querysets import PROJECT_DETAIL_QUERIES, index_plan, indexed_queries, with_detail_relations
+from .realtime import get_broker
+from .progress import DONE, publish_progress
+from .serializers import ProjectSerializer
+from .storage import CloudinaryUploadBackend, LocalUploadBackend, UntrustedURL, _CheckedRedirects
+from .tasks import generate_derivatives
+from .throttling import GenerationTokenBucketThrottle
+
+
+class ProjectTestCase(TestCase):
+    """A user with an authenticated API client."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_project(self, name='Living room', variants=0, items=0, versions=0):
+        project = Project.objects.create(owner=self.user, name=name)
+        ProjectImage.objects.create(project=project, image_url='https://example.com/room.jpg')
+        for v in range(variants):
+            variant = DesignVariant.objects.create(project=project, image_url=f'https://example.com/{v}.jpg')
+            ItemInstance.objects.bulk_create([
+                ItemInstance(variant=variant, name=f'Item {i}', category='sofa') for i in range(items)
+            ])
+        for n in range(versions):
+            Version.objects.create(project=project, snapshot={'step': n}, prompt=f'Step {n}')
+        return project
+
+
+class ProjectDetailQueryTests(ProjectTestCase):
+    """The project detail must not run more queries as the project grows."""
+
+    def test_serializer_runs_fixed_queries(self):
+        project = self.make_project(variants=5, items=4, versions=30)
+        with self.assertNumQueries(PROJECT_DETAIL_QUERIES):
+            detail = with_detail_relations(Project.objects.filter(pk=project.pk)).get()
+            data = ProjectSerializer(detail).data
+        self.assertEqual(len(data['variants']), 5)
+        self.assertEqual({len(variant['items']) for variant in data['variants']}, {4})
+        self.assertEqual([version['prompt'] for version in data['versions']][:2], ['Step 29', 'Step 28'])
+
+    @override_settings(PROJECT_DETAIL_VERSIONS=3)
+    def test_versions_are_the_latest_few(self):
+        project = self.make_project(versions=8)
+        response = self.client.get(f'/api/projects/{project.id}/')
+        self.assertEqual([version['prompt'] for version in response.data['versions']], ['Step 7', 'Step 6', 'Step 5'])
+        self.assertNotIn('snapshot', response.data['versions'][0])
+
+    def test_request_queries_do_not_grow(self):
+        counts = []
+        for size in (1, 8):
+            project = self.make_project(name=f'Size {size}', variants=size, items=size, versions=size * 5)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(f'/api/projects/{project.id}/')
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ConditionalResponseTests(ProjectTestCase):
+    """ETags, 304s and cached bodies follow project and item revisions."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.project = self.make_project(variants=2, items=1)
+        self.variant, self.other = self.project.variants.order_by('id')
+        self.item = self.variant.items.get()
+        self.url = f'/api/projects/{self.project.id}/'
+
+    def move(self, item, x):
+        response = self.client.patch(f'/api/projects/items/{item.id}/', {'transform': {'x': x}}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unchanged_project_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('item_instances' in query['sql'] for query in ctx.captured_queries))
+        self.assertEqual(self.client.get(self.url)['ETag'], etag)
+
+    def test_item_writes_bump_the_variant_not_the_project(self):
+        etag = self.client.get(self.url)['ETag']
+        revision = Project.objects.get(pk=self.project.pk).revision
+        self.move(self.item, 40)
+        self.assertEqual(Project.objects.get(pk=self.project.pk).revision, revision)
+        self.assertEqual(DesignVariant.objects.get(pk=self.variant.pk).revision, 1)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        items = {item['id']: item for variant in response.data['variants'] for item in variant['items']}
+        self.assertEqual(items[self.item.id]['transform'], {'x': 40})
+
+    def test_variant_responses_follow_their_own_items(self):
+        masks_url = f'/api/projects/variants/{self.variant.id}/masks/'
+        etag = self.client.get(masks_url)['ETag']
+        self.move(self.other.items.get(), 10)
+        self.assertEqual(self.client.get(masks_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.move(self.item, 10)
+        self.assertEqual(self.client.get(masks_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_live_edits_bump_the_variant(self):
+        revision = Project.objects.get(pk=self.project.pk).revision
+        accepted, rejected = collaboration.write_ops(
+            self.variant, {self.item.id: (self.item.version, {'transform': {'x': 5}})}, {}, None
+        )
+        self.assertEqual(([state['id'] for state in accepted], rejected), ([self.item.id], []))
+        self.assertEqual(Project.objects.get(pk=self.project.pk).revision, revision)
+        self.assertEqual(DesignVariant.objects.get(pk=self.variant.pk).revision, 1)
+
+
+class KeysetPaginationTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project(variants=7)
+        self.url = f'/api/projects/{self.project.id}/variants/'
+
+    def pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(variant['id'] for variant in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def expected(self):
+        return list(self.project.variants.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_cursors_walk_every_row_once(self):
+        self.assertEqual(self.pages(f'{self.url}?page_size=3'), self.expected())
+
+    def test_equal_created_at_is_ordered_by_id(self):
+        self.project.variants.update(created_at=self.project.created_at)
+        ids = self.pages(f'{self.url}?page_size=2')
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(ids, self.expected())
+
+    def test_invalid_cursors_are_not_found(self):
+        short = base64.urlsafe_b64encode(json.dumps(['2024-01-01T00:00:00+00:00']).encode()).decode()
+        for cursor in ('not-a-cursor', short):
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+
+class VariantProjectTests(ProjectTestCase):
+
+    def test_variant_cannot_move_to_another_project(self):
+        source = self.make_project(variants=1, items=2)
+        target = self.make_project(name='Bedroom')
+        variant = source.variants.get()
+
+        response = self.client.patch(f'/api/projects/variants/{variant.id}/', {'project': target.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['project'], source.id)
+        variant.refresh_from_db()
+        self.assertEqual(variant.project_id, source.id)
+        self.assertEqual(set(variant.items.values_list('project_id', flat=True)), {source.id})
+        source.refresh_from_db()
+        target.refresh_from_db()
+        self.assertEqual((source.cached_variant_count, target.cached_variant_count), (1, 0))
+
+    def test_variant_created_in_own_project(self):
+        project = self.make_project()
+        response = self.client.post(
+            '/api/projects/variants/', {'project': project.id, 'image_url': 'https://example.com/new.jpg'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['project'], project.id)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTests(TestCase):
+    """The hot queries must stay servable from their indexes."""
+
+    def test_hot_queries_use_their_indexes(self):
+        for label, queryset, index in indexed_queries():
+            with self.subTest(label):
+                self.assertIn(index, index_plan(queryset))
+
+
+class VersionHistoryTests(ProjectTestCase):
+    """Deleting a version would break the delta chain of the later ones."""
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project(versions=3)
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(self.admin)
+
+    def test_versions_cannot_be_deleted_singly(self):
+        version = self.project.versions.get(sequence=2)
+        with self.assertRaises(ValueError):
+            version.delete()
+        with self.assertRaises(ValueError):
+            Version.objects.filter(pk=version.pk).delete()
+        self.assertEqual(self.project.versions.count(), 3)
+
+    def test_admin_is_read_only(self):
+        version = self.project.versions.get(sequence=2)
+        self.assertEqual(self.client.get('/admin/projects/version/add/').status_code, 403)
+        self.assertEqual(self.client.get(f'/admin/projects/version/{version.pk}/delete/').status_code, 403)
+        response = self.client.post(f'/admin/projects/version/{version.pk}/change/', {'prompt': 'edited'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(f'/admin/projects/version/{version.pk}/change/').status_code, 200)
+
+    def test_history_is_deleted_with_its_project(self):
+        response = self.client.post(f'/admin/projects/project/{self.project.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Version.objects.filter(project_id=self.project.pk).exists())
+
+
+class SpatialTests(ProjectTestCase):
+    """Region, hit and overlap queries; PostgreSQL runs them in SQL, SQLite on the R-tree."""
+
+    def setUp(self):
+        super().setUp()
+        project = self.make_project(variants=2)
+        self.variant, other = project.variants.order_by('id')
+        self.url = f'/api/projects/variants/{self.variant.id}/items'
+        self.sofa = self.item(self.variant, 0, 0, 100, 50)
+        self.table = self.item(self.variant, 80, 40, 40, 40)
+        self.lamp = self.item(self.variant, 300, 300, 10, 10)
+        self.item(other, 0, 0, 500, 500)
+
+    def item(self, variant, x, y, width, height):
+        return ItemInstance.objects.create(
+            variant=variant, name='Item', category='sofa',
+            bbox_x=x, bbox_y=y, bbox_width=width, bbox_height=height,
+        )
+
+    def test_rtree_matches_a_linear_scan(self):
+        rng = random.Random(7)
+        entries = []
+        for n in range(500):
+            x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+            entries.append((n, x, y, x + rng.uniform(1, 50), y + rng.uniform(1, 50)))
+        tree = RTree(entries, capacity=4)
+        self.assertGreater(tree.height, 2)
+        for _ in range(50):
+            x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+            query = (x, y, x + rng.uniform(0, 200), y + rng.uniform(0, 200))
+            expected = {entry[0] for entry in entries if intersects(entry[1:], query)}
+            self.assertEqual(set(tree.search(*query)), expected)
+        self.assertEqual(RTree([]).search(0, 0, 1, 1), [])
+
+    def test_region_lists_intersecting_items_of_the_variant(self):
+        response = self.client.get(f'{self.url}/region/', {'x': 90, 'y': 45, 'width': 5, 'height': 5})
+        self.assertEqual([item['id'] for item in response.data], [self.sofa.id, self.table.id])
+        response = self.client.get(f'{self.url}/region/', {'x': 200, 'y': 200, 'width': 50, 'height': 50})
+        self.assertEqual(response.data, [])
+
+    def test_hit_lists_topmost_item_first(self):
+        response = self.client.get(f'{self.url}/hit/', {'x': 90, 'y': 45})
+        self.assertEqual([item['id'] for item in response.data], [self.table.id, self.sofa.id])
+        response = self.client.get(f'{self.url}/hit/', {'x': 305, 'y': 305})
+        self.assertEqual([item['id'] for item in response.data], [self.lamp.id])
+
+    def test_overlaps_list_shared_areas(self):
+        response = self.client.get(f'{self.url}/overlaps/')
+        pair = {'items': [self.sofa.id, self.table.id], 'area': 200.0}
+        self.assertEqual(response.data, {'count': 1, 'pairs': [pair]})
+
+    def test_coordinates_are_required(self):
+        response = self.client.get(f'{self.url}/region/', {'x': 1, 'y': 'top'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MaskTests(ProjectTestCase):
+
+    def test_varints_round_trip_at_group_boundaries(self):
+        values = [0, 1, 2 ** 7 - 1, 2 ** 7, 2 ** 56 - 1, 2 ** 56, 2 ** 63 - 1]
+        self.assertEqual(masks.unpack_varints(masks.pack_varints(values)).tolist(), values)
+        self.assertEqual(len(masks.pack_varints([2 ** 63 - 1])), 9)
+
+    def test_oversized_run_lengths_are_invalid(self):
+        for value in (2 ** 63, 2 ** 70):
+            with self.assertRaises(masks.InvalidMask):
+                masks.pack_varints([value])
+        variant = self.make_project(variants=1).variants.get()
+        response = self.client.post(
+            f'/api/projects/variants/{variant.id}/items/',
+            {'name': 'Sofa', 'category': 'sofa', 'mask': {'size': [2, 2], 'counts': [2 ** 70]}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('mask', response.data)
+
+    def test_runs_that_wrap_around_are_invalid(self):
+        # Four runs of 2**62 plus four of 1 add up to 4 in int64
+        rle = masks.pack_varints([2 ** 62, 1] * 4)
+        with self.assertRaises(masks.InvalidMask):
+            masks.decode(rle, 2, 2)
+        variant = self.make_project(variants=1).variants.get()
+        response = self.client.post(
+            f'/api/projects/variants/{variant.id}/items/',
+            {'name': 'Sofa', 'category': 'sofa', 'mask': {'size': [2, 2], 'counts': masks.to_base64(rle)}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(variant.items.exists())
+
+
+class FingerprintTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+
+    def stored(self, perceptual_hash, content_hash=''):
+        return ProjectImage.objects.create(
+            project=self.project, image_url='https://example.com/stored.jpg',
+            content_hash=content_hash, perceptual_hash=perceptual_hash,
+        )
+
+    def test_exact_matches_are_reused_by_default(self):
+        same_bytes = self.stored('0f0f0f0f0f0f0f0f', content_hash='a' * 64)
+        same_pixels = self.stored('123456789abcdef0')
+        self.assertEqual(fingerprints.find_duplicate(self.user, content_hash='a' * 64), same_bytes)
+        self.assertEqual(fingerprints.find_duplicate(self.user, perceptual_hash='123456789abcdef0'), same_pixels)
+
+    def test_similar_photos_are_not_reused_by_default(self):
+        self.stored('123456789abcdef0')
+        self.assertIsNone(fingerprints.find_duplicate(self.user, perceptual_hash='123456789abcdef1'))
+
+    @override_settings(UPLOAD_DUPLICATE_DISTANCE=3)
+    def test_near_matches_share_a_hash_band(self):
+        near = self.stored('123456789abcdef0')
+        self.stored('fedcba9876543210')
+        # Three bits apart, all in the last band: found through the first
+        self.assertEqual(fingerprints.find_duplicate(self.user, perceptual_hash='123456789abcdef7'), near)
+        candidates = fingerprints.near_candidates(ProjectImage.objects.all(), '1234ffffffffffff')
+        self.assertEqual(list(candidates), [near])
+
+    @override_settings(UPLOAD_DUPLICATE_DISTANCE=8)
+    def test_distance_is_capped_below_the_band_count(self):
+        self.stored('0000000000000000')
+        # Four bits apart, one per band: no band is shared
+        self.assertIsNone(fingerprints.find_duplicate(self.user, perceptual_hash='0001000100010001'))
+
+
+@override_settings(
+    GENERATION_BUCKET_CAPACITY=5, GENERATION_BUCKET_REFILL_PER_MINUTE=0.001,
+    GENERATION_BUCKET_STORE='apps.projects.throttling.CacheBuckets',
+)
+class TokenBucketTests(ProjectTestCase):
+
+    def tearDown(self):
+        cache.delete('throttle_generation_test')
+        cache.delete(f'throttle_generation_{self.user.pk}')
+
+    def test_concurrent_takes_do_not_overspend(self):
+        throttle = GenerationTokenBucketThrottle()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            missing = list(pool.map(lambda _: throttle.take('throttle_generation_test', 1, 1000.0), range(20)))
+        self.assertEqual(sum(1 for deficit in missing if deficit == 0), 5)
+
+    def test_rejected_requests_are_refunded(self):
+        project = self.make_project()
+        for _ in range(3):
+            response = self.client.post(f'/api/projects/{project.id}/generate-batch/', {'count': 99}, format='json')
+            self.assertEqual(response.status_code, 400)
+        throttle = GenerationTokenBucketThrottle()
+        self.assertEqual(throttle.take(f'throttle_generation_{self.user.pk}', 5, time.time()), 0)
+
+
+@override_settings(
+    GENERATION_MAX_CONCURRENT_PER_USER=4,
+    GENERATION_BUCKET_STORE='apps.projects.throttling.CacheBuckets',
+)
+class GenerationSlotTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.project = self.make_project()
+        self.url = f'/api/projects/{self.project.id}/generate/'
+
+    def slots(self):
+        return cache.get(generation.SLOTS_PREFIX + str(self.user.id), 0)
+
+    def test_busy_users_are_served_later(self):
+        self.assertEqual(generation.fair_priority(self.user.id, base=2), 2)
+        self.assertTrue(generation.acquire_slots(self.user.id, 4))
+        self.assertEqual(generation.fair_priority(self.user.id, base=2), 4)
+        self.assertEqual(generation.fair_priority(self.user.id, base=8), 9)
+        self.assertEqual(generation.fair_priority(0, base=2), 2)
+
+    def test_slots_are_capped_per_user(self):
+        self.assertTrue(generation.acquire_slots(self.user.id, 3))
+        self.assertFalse(generation.acquire_slots(self.user.id, 2))
+        self.assertEqual(self.slots(), 3)
+        generation.release_slots(self.user.id, 3)
+        self.assertEqual(self.slots(), 0)
+        generation.release_slots(self.user.id, 1)
+        self.assertEqual(self.slots(), 0)
+
+    def test_finished_generation_releases_its_slot(self):
+        response = self.client.post(self.url, {'prompt': 'Warm'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.slots(), 0)
+        self.assertEqual(self.project.variants.count(), 1)
+
+    def test_failed_generation_releases_its_slot_and_claim(self):
+        with mock.patch('apps.projects.tasks._render_stub', side_effect=RuntimeError('model down')):
+            response = self.client.post(self.url, {'prompt': 'Warm'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.slots(), 0)
+        self.assertFalse(self.project.variants.exists())
+        retry = self.client.post(self.url, {'prompt': 'Warm'}, format='json')
+        self.assertEqual(retry.data['message'], 'Generation started')
+
+    def test_full_slots_are_refused(self):
+        generation.acquire_slots(self.user.id, 4)
+        response = self.client.post(self.url, {'prompt': 'Warm'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        generation.release_slots(self.user.id, 4)
+        retry = self.client.post(self.url, {'prompt': 'Warm'}, format='json')
+        self.assertEqual(retry.data['message'], 'Generation started')
+
+    def test_batch_releases_every_slot(self):
+        with mock.patch('apps.projects.tasks._render_stub', side_effect=RuntimeError('model down')):
+            response = self.client.post(
+                f'/api/projects/{self.project.id}/generate-batch/', {'prompt': 'Warm', 'count': 3}, format='json'
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.slots(), 0)
+
+
+class UrlTokenTests(ProjectTestCase):
+    """Links, event streams and sockets take scoped tokens, never access tokens."""
+
+    def test_export_link_uses_a_project_scoped_token(self):
+        project = self.make_project()
+        other = self.make_project(name='Bedroom')
+        response = self.client.post(f'/api/projects/{project.id}/export-token/')
+        self.assertEqual(response.status_code, 200)
+        token = response.data['token']
+
+        anonymous = APIClient()
+        download = anonymous.get(f'/api/projects/{project.id}/export/', {'token': token, 'assets': '0'})
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(download['Content-Type'], 'application/zip')
+        self.assertEqual(anonymous.get(f'/api/projects/{other.id}/export/', {'token': token}).status_code, 401)
+        with override_settings(URL_TOKEN_TTL=-1):
+            self.assertEqual(anonymous.get(f'/api/projects/{project.id}/export/', {'token': token}).status_code, 401)
+
+    def test_export_does_not_accept_access_tokens_in_the_url(self):
+        project = self.make_project()
+        access = str(AccessToken.for_user(self.user))
+        anonymous = APIClient()
+        response = anonymous.get(f'/api/projects/{project.id}/export/', {'access_token': access})
+        self.assertEqual(response.status_code, 401)
+        anonymous.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(anonymous.get(f'/api/projects/{project.id}/export/', {'assets': '0'}).status_code, 200)
+
+    def test_event_stream_uses_a_task_scoped_token(self):
+        project = self.make_project()
+        publish_progress('task-1', project.id, DONE, percent=100)
+        publish_progress('task-2', project.id, DONE, percent=100)
+        self.assertEqual(self.client.post(f'/api/projects/{project.id}/tasks/unknown/events-token/').status_code, 404)
+        response = self.client.post(f'/api/projects/{project.id}/tasks/task-1/events-token/')
+        self.assertEqual(response.status_code, 200)
+        token = response.data['token']
+
+        anonymous = APIClient()
+        stream = anonymous.get(f'/api/projects/{project.id}/tasks/task-1/events/', {'token': token})
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(stream['Content-Type'], 'text/event-stream')
+        self.assertEqual(
+            anonymous.get(f'/api/projects/{project.id}/tasks/task-2/events/', {'token': token}).status_code, 401
+        )
+        access = str(AccessToken.for_user(self.user))
+        self.assertEqual(
+            anonymous.get(f'/api/projects/{project.id}/tasks/task-1/events/', {'access_token': access}).status_code,
+            401,
+        )
+
+
+class LiveSessionTests(TransactionTestCase):
+    """Sessions close their database connections like requests do, so these run outside a test transaction."""
+
+    setUp = ProjectTestCase.setUp
+    make_project = ProjectTestCase.make_project
+
+    def test_edits_are_written_without_sending_after_disconnect(self):
+        variant = self.make_project(variants=1, items=2).variants.get()
+        fresh, stale = variant.items.order_by('id')
+        ItemInstance.objects.filter(pk=stale.pk).update(version=stale.version + 1)
+        messages = iter([
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'ops', 'ops': [
+                {'id': fresh.id, 'version': fresh.version, 'transform': {'x': 1}},
+                {'id': stale.id, 'version': stale.version, 'transform': {'x': 2}},
+            ]})},
+            {'type': 'websocket.disconnect', 'code': 1001},
+        ])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            raise OSError('socket closed')
+
+        async def run():
+            subscription = await get_broker().subscribe(collaboration.channel_name(variant.id))
+            try:
+                await collaboration.Session(variant, send).run(receive, subscription)
+            finally:
+                await subscription.close()
+
+        async_to_sync(run)()
+        fresh.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual(fresh.transform, {'x': 1})
+        self.assertNotEqual(stale.transform, {'x': 2})
+
+    def handshake(self, variant, query):
+        messages = iter([{'type': 'websocket.connect'}, {'type': 'websocket.disconnect', 'code': 1000}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'websocket', 'headers': [], 'query_string': query.encode()}
+        async_to_sync(collaboration.variant_socket)(scope, receive, send, variant.id)
+        return sent[0]
+
+    def test_socket_opens_with_a_variant_scoped_token(self):
+        project = self.make_project(variants=2)
+        variant, other = project.variants.order_by('id')
+        response = self.client.post(f'/api/projects/variants/{variant.id}/live-token/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['url'].startswith('ws://'))
+        token = response.data['token']
+
+        self.assertEqual(self.handshake(variant, f'token={token}'), {'type': 'websocket.accept'})
+        refused = {'type': 'websocket.close', 'code': collaboration.CLOSE_FORBIDDEN}
+        self.assertEqual(self.handshake(other, f'token={token}'), refused)
+        self.assertEqual(self.handshake(variant, f'access_token={AccessToken.for_user(self.user)}'), refused)
+
+
+@override_settings(ITEM_WRITE_BEHIND=True, ITEM_WRITE_BUFFER='apps.projects.writebehind.InMemoryBuffer')
+class WriteBehindTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        writebehind._buffer.cache_clear()
+        # Flushes are run by the tests, not queued
+        cache.set(writebehind.FLUSH_QUEUED_KEY, 1)
+        self.project = self.make_project(variants=2, items=2)
+        self.item = ItemInstance.objects.filter(project=self.project).order_by('id').first()
+
+    def tearDown(self):
+        cache.delete(writebehind.FLUSH_QUEUED_KEY)
+        writebehind._buffer.cache_clear()
+
+    def drag(self, x):
+        response = self.client.patch(f'/api/projects/items/{self.item.id}/', {'transform': {'x': x}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_transform_patch_is_buffered(self):
+        response = self.drag(10)
+        self.assertEqual(response.data['transform'], {'x': 10})
+        self.assertEqual(response.data['version'], self.item.version + 1)
+        stored = ItemInstance.objects.get(pk=self.item.pk)
+        self.assertEqual((stored.transform, stored.version), (self.item.transform, self.item.version))
+
+    def test_reads_show_buffered_edits(self):
+        self.drag(20)
+        response = self.client.get(f'/api/projects/items/{self.item.id}/')
+        self.assertEqual(response.data['transform'], {'x': 20})
+        buffer = writebehind.get_buffer()
+        with mock.patch.object(buffer, 'get', wraps=buffer.get) as get:
+            response = self.client.get(f'/api/projects/{self.project.id}/')
+        self.assertEqual(get.call_count, 1)
+        items = {item['id']: item for variant in response.data['variants'] for item in variant['items']}
+        self.assertEqual(items[self.item.id]['transform'], {'x': 20})
+
+    def test_flush_persists_buffered_edits(self):
+        self.drag(30)
+        version = self.drag(40).data['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(writebehind.flush(), 1)
+        stored = ItemInstance.objects.get(pk=self.item.pk)
+        self.assertEqual((stored.transform, stored.version), ({'x': 40}, version))
+        self.assertEqual(writebehind.get_buffer().all(), {})
+
+    def test_flush_of_a_variant_reads_its_own_entries(self):
+        other = ItemInstance.objects.filter(project=self.project).exclude(variant_id=self.item.variant_id).first()
+        self.drag(50)
+        self.client.patch(f'/api/projects/items/{other.id}/', {'transform': {'x': 60}}, format='json')
+        buffer = writebehind.get_buffer()
+        with mock.patch.object(buffer, 'all', wraps=buffer.all) as read_all:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(writebehind.flush(variant_ids=[self.item.variant_id]), 1)
+        read_all.assert_not_called()
+        self.assertEqual(ItemInstance.objects.get(pk=self.item.pk).transform, {'x': 50})
+        self.assertEqual(set(buffer.all()), {other.id})
+        self.assertEqual(buffer.ids(project_ids=[self.project.id]), {other.id})
+
+
+class StorageFetchTests(TestCase):
+    """Image URLs are client input; only stored files may be fetched."""
+
+    def test_foreign_urls_are_refused(self):
+        backend = LocalUploadBackend()
+        for url in ('http://169.254.169.254/latest/meta-data/', 'http://localhost:6379/', 'file:///etc/passwd'):
+            with self.subTest(url), self.assertRaises(UntrustedURL):
+                backend.fetch(url)
+
+    @override_settings(CLOUDINARY_CONFIG={'cloud_name': 'dreamspace', 'api_key': '', 'api_secret': ''})
+    def test_cloudinary_urls_must_be_in_the_cloud(self):
+        backend = CloudinaryUploadBackend()
+        backend.check_url('https://res.cloudinary.com/dreamspace/image/upload/v1/room.jpg')
+        for url in (
+            'https://res.cloudinary.com/someone-else/image/upload/v1/room.jpg',
+            'https://res.cloudinary.com@10.0.0.1/dreamspace/room.jpg',
+            'http://res.cloudinary.com/dreamspace/room.jpg',
+        ):
+            with self.subTest(url), self.assertRaises(UntrustedURL):
+                backend.check_url(url)
+
+    @override_settings(UPLOAD_FETCH_HOSTS=['cdn.vendor.example'])
+    def test_redirects_are_checked_too(self):
+        backend = LocalUploadBackend()
+        backend.check_url('https://cdn.vendor.example/chair.glb')
+        request = Request('https://cdn.vendor.example/chair.glb')
+        with self.assertRaises(UntrustedURL):
+            _CheckedRedirects(backend).redirect_request(request, None, 302, 'Found', {}, 'http://10.0.0.1/')
+
+
+@override_settings(UPLOAD_BACKEND='apps.projects.storage.LocalUploadBackend')
+class DerivativeTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.project = self.make_project()
+
+    def stored_image(self, width=1600, height=900):
+        content = BytesIO()
+        Image.new('RGB', (width, height), 'tan').save(content, 'JPEG')
+        content.seek(0)
+        return default_storage.url(default_storage.save('uploads/room.jpg', content))
+
+    def test_derivatives_are_rendered_and_listed_in_srcset(self):
+        image = ProjectImage.objects.create(project=self.project, image_url=self.stored_image())
+        result = generate_derivatives.apply(args=('ProjectImage', image.pk)).get()
+        self.assertEqual(result['status'], 'success')
+        rendered = result['derivatives']
+        self.assertEqual((rendered['thumb']['width'], rendered['medium']['width']), (320, 1024))
+
+        response = self.client.get(f'/api/projects/{self.project.id}/')
+        srcset = next(row['srcset'] for row in response.data['images'] if row['id'] == image.pk)
+        self.assertEqual(set(srcset), {'original', 'thumb', 'medium', 'webp'})
+        self.assertTrue(srcset['thumb'].startswith('http://testserver/'))
+
+    def test_foreign_image_urls_are_not_fetched(self):
+        image = ProjectImage.objects.create(project=self.project, image_url='http://169.254.169.254/latest/meta-data/')
+        with mock.patch('apps.projects.storage.build_opener') as opener, self.assertLogs('apps.projects.tasks'):
+            result = generate_derivatives.apply(args=('ProjectImage', image.pk)).get()
+        opener.assert_not_called()
+        self.assertEqual(result['status'], 'error')
+        image.refresh_from_db()
+        self.assertNotIn('derivatives', image.metadata or {})
+
+
+@override_settings(UPLOAD_BACKEND='apps.projects.storage.LocalUploadBackend')
+class DirectUploadTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.project = self.make_project()
+
+    def ticket(self, project=None, **data):
+        project = project or self.project
+        response = self.client.post(f'/api/projects/{project.id}/upload-ticket/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def upload(self, ticket, token=None):
+        content = BytesIO()
+        Image.new('RGB', (40, 30), 'tan').save(content, 'PNG')
+        content.seek(0)
+        content.name = 'room.png'
+        fields = dict(ticket['fields'], file=content)
+        if token is not None:
+            fields['token'] = token
+        return APIClient().post(ticket['upload_url'], fields, format='multipart')
+
+    def complete(self, ticket, result, project=None):
+        project = project or self.project
+        data = {'ticket': ticket['ticket'], 'result': result}
+        return self.client.post(f'/api/projects/{project.id}/upload-complete/', data, format='json')
+
+    def test_known_content_hash_returns_the_duplicate(self):
+        stored = ProjectImage.objects.create(
+            project=self.make_project(name='Kitchen'), image_url='https://example.com/k.jpg', content_hash='b' * 64
+        )
+        response = self.client.post(
+            f'/api/projects/{self.project.id}/upload-ticket/', {'content_hash': 'B' * 64}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('ticket', response.data)
+        self.assertEqual(response.data['duplicate']['metadata']['reused_from'], stored.id)
+
+    def test_invalid_image_type_is_rejected(self):
+        response = self.client.post(f'/api/projects/{self.project.id}/upload-ticket/', {'type': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_local_upload_needs_the_signed_token(self):
+        ticket = self.ticket()
+        response = self.upload(ticket, token=ticket['fields']['token'] + 'x')
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Invalid upload token'))
+        self.assertEqual(self.upload(ticket).status_code, 201)
+
+    def test_forged_results_are_rejected(self):
+        ticket = self.ticket()
+        result = self.upload(ticket).data
+        forged = dict(result, secure_url='https://attacker.example/room.png', signature='0' * 27)
+        response = self.complete(ticket, forged)
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Upload result signature mismatch'))
+
+        other = self.ticket()
+        response = self.complete(other, result)
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Upload result does not match ticket'))
+
+    def test_tickets_are_bound_to_their_project(self):
+        ticket = self.ticket()
+        result = self.upload(ticket).data
+        response = self.complete(ticket, result, project=self.make_project(name='Kitchen'))
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Ticket was issued for another project'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'stored uploads are found by JSON containment')
+    def test_completing_twice_records_one_image(self):
+        ticket = self.ticket()
+        result = self.upload(ticket).data
+        first = self.complete(ticket, result)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data['metadata']['storage_id'], result['public_id'])
+        second = self.complete(ticket, result)
+        self.assertEqual((second.status_code, second.data['id']), (200, first.data['id']))
+        self.assertEqual(self.project.images.filter(metadata__storage_id=result['public_id']).count(), 1)
+
+
+@override_settings(
+    UPLOAD_BACKEND='apps.projects.storage.CloudinaryUploadBackend',
+    CLOUDINARY_CONFIG={'cloud_name': 'demo', 'api_key': 'key', 'api_secret': 'secret'},
+)
+class UploadCallbackTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        response = self.client.post(f'/api/projects/{self.project.id}/upload-ticket/', {}, format='json')
+        self.ticket = response.data['ticket']
+        public_id = response.data['fields']['public_id']
+        self.body = json.dumps({
+            'public_id': public_id, 'version': 1, 'format': 'jpg', 'width': 40, 'height': 30,
+            'secure_url': f'https://res.cloudinary.com/demo/image/upload/v1/{public_id}.jpg',
+            'signature': CloudinaryUploadBackend()._sign({'public_id': public_id, 'version': 1}),
+        })
+
+    def callback(self, signature=None, timestamp=None):
+        timestamp = str(int(time.time()) if timestamp is None else timestamp)
+        if signature is None:
+            signature = hashlib.sha1(f'{self.body}{timestamp}secret'.encode()).hexdigest()
+        return APIClient().post(
+            f'/api/projects/uploads/callback/?ticket={self.ticket}', self.body, content_type='application/json',
+            HTTP_X_CLD_TIMESTAMP=timestamp, HTTP_X_CLD_SIGNATURE=signature,
+        )
+
+    def test_forged_signatures_are_rejected(self):
+        response = self.callback(signature='0' * 40)
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Callback signature mismatch'))
+        self.assertFalse(self.project.images.exclude(image_url='https://example.com/room.jpg').exists())
+
+    def test_stale_callbacks_are_rejected(self):
+        response = self.callback(timestamp=int(time.time()) - 3 * 3600)
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Stale callback'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'stored uploads are found by JSON containment')
+    def test_signed_callback_records_the_image(self):
+        response = self.callback()
+        self.assertEqual((response.status_code, response.data['created']), (200, True))
+        self.assertEqual(self.callback().data, {'id': response.data['id'], 'created': False})
+
+
+class CompositeTests(TestCase):
+    """A 20x10 item, red on its left half and green on its right, on black."""
+
+    def setUp(self):
+        image = Image.new('RGB', (100, 60), 'black')
+        image.paste((255, 0, 0), (10, 10, 20, 20))
+        image.paste((0, 255, 0), (20, 10, 30, 20))
+        content = BytesIO()
+        image.save(content, 'PNG')
+        self.content = content.getvalue()
+
+    def item(self, transform, mask=None):
+        item = ItemInstance(id=1, bbox_x=10, bbox_y=10, bbox_width=20, bbox_height=10, transform=transform)
+        if mask is not None:
+            item.mask_rle, item.mask_height, item.mask_width, item.mask_area = masks.encode(mask)
+        return item
+
+    def render(self, *items):
+        data, width, height = rendering.composite(self.content, items, 'png')
+        self.assertEqual((width, height), (100, 60))
+        return Image.open(BytesIO(data)).convert('RGB')
+
+    def test_moved_item_is_pasted_at_its_transform(self):
+        image = self.render(self.item({'x': 50, 'y': 30}))
+        self.assertEqual((image.getpixel((55, 35)), image.getpixel((65, 35))), ((255, 0, 0), (0, 255, 0)))
+        self.assertEqual(image.getpixel((15, 15)), (255, 0, 0))
+
+    def test_negative_scale_flips(self):
+        image = self.render(self.item({'x': 50, 'y': 30, 'scaleX': -1}))
+        self.assertEqual((image.getpixel((55, 35)), image.getpixel((65, 35))), ((0, 255, 0), (255, 0, 0)))
+
+    def test_rotation_turns_clockwise_about_the_corner(self):
+        image = self.render(self.item({'x': 50, 'y': 30, 'rotation': 90}))
+        # The left (red) half now points down from the top: x 40-50, y 30-50
+        self.assertEqual((image.getpixel((45, 34)), image.getpixel((45, 46))), ((255, 0, 0), (0, 255, 0)))
+        self.assertEqual(image.getpixel((55, 35)), (0, 0, 0))
+
+    def test_mask_cuts_out_the_item(self):
+        mask = np.zeros((60, 100), dtype=bool)
+        mask[10:20, 10:20] = True
+        image = self.render(self.item({'x': 50, 'y': 30}, mask=mask))
+        self.assertEqual((image.getpixel((55, 35)), image.getpixel((65, 35))), ((255, 0, 0), (0, 0, 0)))
+
+    def test_items_in_place_are_not_redrawn(self):
+        self.assertEqual(rendering.composite(self.content, [self.item({})], 'png'),
+                         rendering.composite(self.content, [], 'png'))
+
+
+@override_settings(UPLOAD_BACKEND='apps.projects.storage.LocalUploadBackend')
+class RenderReuseTests(ProjectTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        content = BytesIO()
+        Image.new('RGB', (100, 60), 'tan').save(content, 'PNG')
+        content.seek(0)
+        image_url = default_storage.url(default_storage.save('uploads/variant.png', content))
+        project = self.make_project()
+        self.variant = DesignVariant.objects.create(project=project, image_url=image_url)
+        self.item = ItemInstance.objects.create(
+            variant=self.variant, name='Lamp', category='lamp', bbox_x=10, bbox_y=10, bbox_width=20, bbox_height=10,
+            transform={'x': 10},
+        )
+        self.url = f'/api/projects/variants/{self.variant.id}/render/?output=png'
+
+    def move(self, x):
+        ItemInstance.objects.filter(pk=self.item.pk).update(transform={'x': x})
+
+    def test_renders_are_reused_by_state(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        with mock.patch('apps.projects.rendering.composite', wraps=rendering.composite) as composite:
+            first = self.client.post(self.url)
+            self.assertEqual(first.status_code, 202)
+            rendered = self.client.get(self.url)
+            self.assertEqual((rendered.status_code, rendered.data['key']), (200, first.data['key']))
+            self.assertEqual(self.client.post(self.url).status_code, 200)
+
+            self.move(40)
+            moved = self.client.post(self.url)
+            self.assertNotEqual(moved.data['key'], first.data['key'])
+            self.move(10)
+            reverted = self.client.post(self.url)
+        self.assertEqual((reverted.status_code, reverted.data['key']), (200, first.data['key']))
+        self.assertEqual(composite.call_count, 2)
+
+
+class PurgeTests(ProjectTestCase):
+
+    def test_deleted_project_is_hidden_before_the_purge(self):
+        project = self.make_project(variants=1, items=2)
+        variant = project.variants.get()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.client.delete(f'/api/projects/{project.id}/').status_code, 204)
+        # Tombstoned but not yet purged
+        self.assertTrue(Project.objects.filter(pk=project.pk, deleted_at__isnull=False).exists())
+        self.assertEqual(self.client.get(f'/api/projects/{project.id}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/projects/').data['results'], [])
+        self.assertEqual(self.client.get(f'/api/projects/variants/{variant.id}/').status_code, 404)
+
+        callbacks[0]()
+        self.assertFalse(Project.objects.filter(pk=project.pk).exists())
+        self.assertFalse(ItemInstance.objects.filter(variant=variant).exists())
+
+    def test_rows_are_deleted_in_batches(self):
+        project = self.make_project(variants=2, items=3, versions=3)
+        self.assertIsNone(purge.purge(project.id, batch_size=2))
+
+        Project.objects.filter(pk=project.pk).update(deleted_at=timezone.now())
+        table = ItemInstance._meta.db_table
+        with CaptureQueriesContext(connection) as ctx:
+            counts = purge.purge(project.id, batch_size=2)
+        self.assertEqual(counts, {
+            'files': 0, 'iteminstance': 6, 'designvariant': 2, 'projectimage': 1, 'version': 3,
+        })
+        item_deletes = [q for q in ctx.captured_queries if q['sql'].startswith(f'DELETE FROM "{table}"')]
+        self.assertEqual(len(item_deletes), 3)
+        self.assertFalse(Project.objects.filter(pk=project.pk).exists())
+        # Safe to repeat
+        self.assertIsNone(purge.purge(project.id, batch_size=2))
+
+    @skipUnless(connection.vendor == 'postgresql', 'needs JSON containment lookups')
+    def test_files_shared_with_other_projects_are_kept(self):
+        project, other = self.make_project(), self.make_project(name='Kitchen')
+        own = 'https://example.com/media/uploads/own.jpg'
+        shared = 'https://example.com/media/uploads/shared.jpg'
+        render = 'https://example.com/media/dreamspace/renders/0a1b2c.png'
+        ProjectImage.objects.create(project=project, image_url=own, metadata={'storage_id': 'uploads/own'})
+        ProjectImage.objects.create(project=project, image_url=shared, metadata={'storage_id': 'uploads/shared'})
+        ProjectImage.objects.create(project=other, image_url=shared, metadata={'storage_id': 'uploads/shared'})
+        DesignVariant.objects.create(project=project, image_url=own, metadata={'renders': {'png': {'url': render}}})
+        Project.objects.filter(pk=project.pk).update(deleted_at=timezone.now())
+
+        backend = mock.Mock(metadata_key='storage_id')
+        with mock.patch('apps.projects.purge.get_upload_backend', return_value=backend):
+            counts = purge.purge(project.id, batch_size=2)
+        deleted = [asset for call in backend.delete_assets.call_args_list for asset in call.args[0]]
+        self.assertCountEqual(deleted, [('uploads/own', own), ('dreamspace/renders/0a1b2c', render)])
+        self.assertEqual(counts['files'], 2)
+        self.assertTrue(other.images.filter(image_url=shared).exists())
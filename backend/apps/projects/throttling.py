@@ -0,0 +1,137 @@
+"""
+Throttles for expensive endpoints.
+"""
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+
+class RedisBuckets:
+    """Token buckets in Redis (GENERATION_BUCKET_REDIS_URL), shared by every API process."""
+
+    # Refills and takes in one step; returns the missing tokens ('0' if taken)
+    TAKE_SCRIPT = """
+        local capacity, rate, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        if tokens < cost then
+            return tostring(cost - tokens)
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'updated', tostring(now))
+        redis.call('EXPIRE', KEYS[1], ARGV[5])
+        return '0'
+    """
+    # Gives tokens back, up to the capacity
+    REFUND_SCRIPT = """
+        local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+        if tokens then
+            redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + tonumber(ARGV[2]))))
+        end
+    """
+
+    def __init__(self, url=None):
+        import redis
+
+        self.client = redis.Redis.from_url(url or settings.GENERATION_BUCKET_REDIS_URL)
+        self._take = self.client.register_script(self.TAKE_SCRIPT)
+        self._refund = self.client.register_script(self.REFUND_SCRIPT)
+
+    def take(self, key, cost, capacity, rate, now, timeout):
+        return float(self._take(keys=[key], args=[capacity, rate, now, cost, timeout]))
+
+    def refund(self, key, tokens, capacity, timeout):
+        self._refund(keys=[key], args=[capacity, tokens])
+
+
+class CacheBuckets:
+    """
+    Token buckets in the Django cache, for tests and local development:
+    a lock serializes them within one process only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, capacity, rate, now, timeout):
+        with self._lock:
+            tokens, updated = cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - updated) * rate)
+            if tokens < cost:
+                return cost - tokens
+            cache.set(key, (tokens - cost, now), timeout=timeout)
+            return 0
+
+    def refund(self, key, tokens, capacity, timeout):
+        with self._lock:
+            state = cache.get(key)
+            if state is not None:
+                cache.set(key, (min(capacity, state[0] + tokens), state[1]), timeout=timeout)
+
+
+@lru_cache(maxsize=None)
+def _buckets(path):
+    return import_string(path)()
+
+
+def get_buckets():
+    """Return the configured bucket store (one instance per process)."""
+    return _buckets(settings.GENERATION_BUCKET_STORE)
+
+
+class GenerationTokenBucketThrottle(BaseThrottle):
+    """
+    Per-user token bucket admitting generation requests before anything is
+    enqueued. Each user's bucket holds up to GENERATION_BUCKET_CAPACITY
+    tokens and refills at GENERATION_BUCKET_REFILL_PER_MINUTE. A request
+    costs one token per variant it generates, so short bursts are allowed
+    but sustained load is limited to the refill rate.
+
+    Refilling and taking tokens is one atomic step (a Lua script on Redis),
+    so concurrent requests cannot spend the same tokens twice. Throttles
+    run before the view validates the request, so views give the tokens
+    of requests they reject back with refund().
+    """
+    cache_format = 'throttle_generation_{ident}'
+
+    def __init__(self):
+        self.capacity = settings.GENERATION_BUCKET_CAPACITY
+        self.rate = settings.GENERATION_BUCKET_REFILL_PER_MINUTE / 60.0
+        # An untouched bucket is full again by then
+        self.timeout = int(self.capacity / self.rate) + 1
+        self.deficit = 0
+
+    def get_cost(self, request, view):
+        cost = getattr(view, 'generation_cost', None)
+        return max(1, cost(request)) if cost else 1
+
+    def allow_request(self, request, view):
+        if not request.user.is_authenticated:
+            return True
+        key = self.cache_format.format(ident=request.user.pk)
+        cost = min(self.get_cost(request, view), self.capacity)
+        self.deficit = self.take(key, cost, time.time())
+        if self.deficit == 0:
+            request.generation_charge = (key, cost)
+        return self.deficit == 0
+
+    def take(self, key, cost, now):
+        """Take `cost` tokens from the bucket at `key`; returns how many were missing (0 if taken)."""
+        return get_buckets().take(key, cost, self.capacity, self.rate, now, self.timeout)
+
+    def refund(self, request):
+        """Give back the tokens `request` was charged, if any."""
+        charge = getattr(request, 'generation_charge', None)
+        if charge:
+            key, cost = charge
+            get_buckets().refund(key, cost, self.capacity, self.timeout)
+            request.generation_charge = None
+
+    def wait(self):
+        return self.deficit / self.rate if self.rate else None
@@ -3,7 +3,10 @@ URL patterns for project-related endpoints.
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProjectViewSet, VariantViewSet, ItemInstanceViewSet
+from .streams import project_export, task_events
+from .views import (
+    ProjectViewSet, VariantViewSet, ItemInstanceViewSet, UploadCallbackView, LocalUploadView
+)
 
 app_name = 'projects'
 
@@ -13,6 +16,10 @@ router.register(r'variants', VariantViewSet, basename='variant')
 router.register(r'items', ItemInstanceViewSet, basename='item')
 
 urlpatterns = [
+    path('uploads/callback/', UploadCallbackView.as_view(), name='upload-callback'),
+    path('uploads/local/', LocalUploadView.as_view(), name='upload-local'),
+    path('<int:pk>/tasks/<str:task_id>/events/', task_events, name='task-events'),
+    path('<int:pk>/export/', project_export, name='project-export'),
     path('', include(router.urls)),
 ]
 
@@ -1,20 +1,62 @@
 """
 Views for project management and AI generation.
 """
+import uuid
+
 import cloudinary.uploader
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from .models import Project, ProjectImage, DesignVariant, ItemInstance, Version
 from .serializers import (
     ProjectSerializer, ProjectListSerializer, ProjectImageSerializer,
-    DesignVariantSerializer, ItemInstanceSerializer, VersionSerializer
+    DesignVariantSerializer, ItemInstanceSerializer, ItemInstanceBatchSerializer,
+    VersionSerializer, VersionDeltaSerializer
+)
+from .pagination import KeysetPagination
+from .storage import (
+    InvalidUpload, LocalUploadBackend, complete_upload, get_upload_backend, issue_ticket,
+    redeem_ticket
+)
+from .querysets import (
+    with_detail_relations, with_list_counts, with_cover, item_prefetch
 )
-from .tasks import generate_variant
+from . import collaboration, fingerprints, generation, masks, rendering, writebehind
+from .caching import conditional_response
+from .spatial import spatial_queries
+from .streams import export_scope, issue_url_token, task_events_scope
+from .generation import generation_key
+from .progress import publish_progress, get_status, QUEUED
+from .tasks import (
+    generate_variant, purge_project, queue_render, start_generation_batch, start_project_render
+)
+from .throttling import GenerationTokenBucketThrottle
+
+
+def _render_output(request):
+    """The requested render format (?output=jpeg|png); returns (output, error_response)."""
+    output = request.query_params.get('output', 'jpeg')
+    if output not in rendering.FORMATS:
+        error = f'output must be one of: {", ".join(rendering.FORMATS)}'
+        return None, Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    return output, None
+
+
+def _url_token(request, scope, path, scheme=None):
+    """Response with a token for `scope` and the URL at `path` that takes it."""
+    token = issue_url_token(request.user, scope)
+    url = request.build_absolute_uri(f'{path}?token={token}')
+    if scheme is not None:
+        url = scheme + url[url.index(':'):]
+    return Response({'token': token, 'url': url, 'expires_in': settings.URL_TOKEN_TTL})
 
 
 class ProjectViewSet(viewsets.ModelViewSet):
@@ -29,17 +71,44 @@ class ProjectViewSet(viewsets.ModelViewSet):
     - DELETE /api/projects/{id}/ - delete project
     """
     permission_classes = [IsAuthenticated]
+    # Numeric ids only, so /api/projects/variants/ and /items/ reach their viewsets
+    lookup_value_regex = r'\d+'
     
     def get_queryset(self):
-        """Return projects owned by current user."""
-        return Project.objects.filter(owner=self.request.user)
+        """Return projects owned by current user, except deleted ones."""
+        queryset = Project.objects.live().filter(owner=self.request.user)
+        if self.action == 'list':
+            queryset = with_cover(with_list_counts(queryset))
+        return queryset
     
+    def perform_destroy(self, instance):
+        """
+        Tombstone the project; purge_project deletes its rows and stored
+        files in the background.
+        """
+        Project.objects.filter(pk=instance.pk).update(deleted_at=timezone.now())
+        transaction.on_commit(lambda: purge_project.delay(instance.pk))
+
     def get_serializer_class(self):
         """Use lightweight serializer for list view."""
         if self.action == 'list':
             return ProjectListSerializer
         return ProjectSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serialize the project within a fixed query budget.
+        Conditional and cached: related rows are only loaded when the
+        project changed since the cached response (see caching.py).
+        """
+        project = self.get_object()
+
+        def render():
+            detail = with_detail_relations(Project.objects.filter(pk=project.pk)).get()
+            return Response(self.get_serializer(detail).data)
+
+        return conditional_response(request, project, render)
+
     @action(detail=True, methods=['post'])
     def upload(self, request, pk=None):
         """
@@ -47,6 +116,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
         Upload images to Cloudinary and associate with project.
         
         Expected: multipart/form-data with 'image' file and optional 'type' field
+        
+        A photo the user already stored (same bytes, or the same perceptual
+        hash) is not uploaded again: the existing asset is reused.
         """
         project = self.get_object()
         image_file = request.FILES.get('image')
@@ -58,6 +130,17 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        fingerprint = fingerprints.fingerprint(image_file.read())
+        image_file.seek(0)
+        duplicate = fingerprints.find_duplicate(request.user, **fingerprint)
+        if duplicate:
+            project_image, created = fingerprints.reuse(duplicate, project, image_type)
+            serializer = ProjectImageSerializer(project_image, context={'request': request})
+            return Response(
+                serializer.data,
+                status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+            )
+        
         # Upload to Cloudinary
         try:
             upload_result = cloudinary.uploader.upload(
@@ -76,10 +159,11 @@ class ProjectViewSet(viewsets.ModelViewSet):
                     'height': upload_result.get('height'),
                     'format': upload_result.get('format'),
                     'cloudinary_id': upload_result.get('public_id'),
-                }
+                },
+                **fingerprint
             )
             
-            serializer = ProjectImageSerializer(project_image)
+            serializer = ProjectImageSerializer(project_image, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
             
         except Exception as e:
@@ -88,7 +172,73 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], url_path='upload-ticket')
+    def upload_ticket(self, request, pk=None):
+        """
+        POST /api/projects/{id}/upload-ticket/
+        Issue a short-lived signed ticket for uploading an image directly to
+        storage, bypassing the API workers.
+        
+        Expected: {"type": "original" | "inspo" | "generated"}
+        Returns: {ticket, upload_url, fields, expires_in}. POST the file to
+        upload_url as multipart form data with `fields` and a `file` part,
+        then confirm with upload-complete.
+        
+        Optionally send "content_hash" (hex SHA-256 of the file): if the
+        user already stored that file, it is reused and the ProjectImage is
+        returned as {"duplicate": ...} with no ticket.
+        """
+        project = self.get_object()
+        image_type = request.data.get('type', 'original')
+        if image_type not in dict(ProjectImage.IMAGE_TYPES):
+            return Response(
+                {'error': f'Invalid image type: {image_type}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_hash = str(request.data.get('content_hash') or '').lower()
+        duplicate = content_hash and fingerprints.find_duplicate(request.user, content_hash=content_hash)
+        if duplicate:
+            project_image, created = fingerprints.reuse(duplicate, project, image_type)
+            serializer = ProjectImageSerializer(project_image, context={'request': request})
+            return Response(
+                {'duplicate': serializer.data},
+                status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+            )
+        return Response(issue_ticket(request, project, image_type), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], url_path='upload-complete')
+    def upload_complete(self, request, pk=None):
+        """
+        POST /api/projects/{id}/upload-complete/
+        Record the ProjectImage for a finished direct upload.
+        
+        Expected: {"ticket": "...", "result": <storage upload response>}
+        """
+        project = self.get_object()
+        try:
+            ticket = redeem_ticket(request.data.get('ticket', ''))
+            if ticket['project'] != project.id or ticket['user'] != request.user.id:
+                raise InvalidUpload('Ticket was issued for another project')
+            project_image, created = complete_upload(ticket, request.data.get('result') or {})
+        except InvalidUpload as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = ProjectImageSerializer(project_image, context={'request': request})
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    def generation_cost(self, request):
+        """Tokens a generation request takes from the user's bucket."""
+        if self.action == 'generate_batch':
+            try:
+                return int(request.data.get('count', settings.GENERATION_BATCH_MAX))
+            except (TypeError, ValueError):
+                return 1
+        return 1
+
+    @action(detail=True, methods=['post'], throttle_classes=[GenerationTokenBucketThrottle])
     def generate(self, request, pk=None):
         """
         POST /api/projects/{id}/generate/
@@ -96,40 +246,250 @@ class ProjectViewSet(viewsets.ModelViewSet):
         
         In production, this would call a real AI model.
         For MVP, it duplicates an image with "_generated" suffix.
+        Follow progress at tasks/{task_id}/events/ (SSE) or poll
+        tasks/{task_id}/.
+        
+        Identical requests (same base image, prompt and params) are
+        deduplicated: while one is running, duplicates get its task_id;
+        once finished, its variant is returned directly (200, "cached").
+        Send "force": true to generate anew.
         """
         project = self.get_object()
         prompt = request.data.get('prompt', '')
+        params = request.data.get('params') or {}
         
-        # Trigger Celery task
-        task = generate_variant.delay(project.id, prompt)
+        base_image = project.images.filter(type='original').first()
+        if not base_image:
+            return Response(
+                {'error': 'No original image found in project'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        key = generation_key(base_image, prompt, params)
+        task_id = str(uuid.uuid4())
+        if request.data.get('force'):
+            generation.evict(key)
+        outcome, found = generation.claim(key, task_id)
+        
+        if outcome == 'cached' and project.variants.filter(pk=found['variant_id']).exists():
+            return Response({
+                'message': 'Generation reused',
+                'task_id': found['task_id'],
+                'variant_id': found['variant_id'],
+                'project_id': project.id,
+                'cached': True
+            }, status=status.HTTP_200_OK)
+        if outcome == 'cached':
+            # The cached variant was deleted; generate again
+            generation.evict(key)
+            outcome, found = generation.claim(key, task_id)
+        
+        if outcome == 'inflight':
+            return Response({
+                'message': 'Generation already in progress',
+                'task_id': found,
+                'project_id': project.id
+            }, status=status.HTTP_202_ACCEPTED)
+        
+        if not generation.acquire_slots(request.user.id, 1):
+            generation.release(key)
+            return self._too_many_generations()
+        
+        # Publish the queued state before the worker can report progress
+        publish_progress(task_id, project.id, QUEUED)
+        try:
+            generate_variant.apply_async(
+                (project.id, prompt),
+                {'params': params, 'cache_key': key, 'user_id': request.user.id},
+                task_id=task_id,
+                priority=generation.fair_priority(request.user.id, base=2)
+            )
+        except Exception:
+            generation.release(key)
+            generation.release_slots(request.user.id, 1)
+            raise
         
         return Response({
             'message': 'Generation started',
-            'task_id': task.id,
+            'task_id': task_id,
+            'project_id': project.id
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(
+        detail=True, methods=['post'], url_path='generate-batch',
+        throttle_classes=[GenerationTokenBucketThrottle]
+    )
+    def generate_batch(self, request, pk=None):
+        """
+        POST /api/projects/{id}/generate-batch/
+        Generate several design options for one prompt in parallel.
+        
+        Expected: {"prompt": "...", "count": 6, "params": {...}}
+        Returns a batch task_id; its progress stream ends with
+        state "done" and the new `variant_ids`.
+        """
+        project = self.get_object()
+        prompt = request.data.get('prompt', '')
+        params = request.data.get('params') or {}
+        try:
+            count = int(request.data.get('count', settings.GENERATION_BATCH_MAX))
+        except (TypeError, ValueError):
+            count = 0
+        if not 1 <= count <= settings.GENERATION_BATCH_MAX:
+            return Response(
+                {'error': f'count must be between 1 and {settings.GENERATION_BATCH_MAX}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        base_image = project.images.filter(type='original').first()
+        if not base_image:
+            return Response(
+                {'error': 'No original image found in project'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not generation.acquire_slots(request.user.id, count):
+            return self._too_many_generations()
+        
+        batch_id = str(uuid.uuid4())
+        publish_progress(batch_id, project.id, QUEUED)
+        try:
+            start_generation_batch(
+                project.id, base_image, prompt, count, params, batch_id, request.user.id,
+                priority=generation.fair_priority(request.user.id, base=4)
+            )
+        except Exception:
+            generation.release_slots(request.user.id, count)
+            raise
+        
+        return Response({
+            'message': 'Batch generation started',
+            'task_id': batch_id,
+            'count': count,
             'project_id': project.id
         }, status=status.HTTP_202_ACCEPTED)
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Generation requests rejected as invalid spend no tokens
+        if response.status_code == status.HTTP_400_BAD_REQUEST:
+            GenerationTokenBucketThrottle().refund(request)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def _too_many_generations(self):
+        return Response(
+            {'error': 'Too many generations in progress. Wait for some to finish.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={'Retry-After': '10'}
+        )
+
+    @action(detail=False, methods=['get'], url_path='metrics/generation', permission_classes=[IsAdminUser])
+    def generation_metrics(self, request):
+        """
+        GET /api/projects/metrics/generation/
+        Generation dedup counters and hit rate (staff only).
+        """
+        return Response(generation.generation_stats())
+
+    @action(detail=True, methods=['get'], url_path=r'tasks/(?P<task_id>[-\w]+)')
+    def task_status(self, request, pk=None, task_id=None):
+        """
+        GET /api/projects/{id}/tasks/{task_id}/
+        Latest state of a generation task: queued, running (with percent),
+        done (with variant_id) or error (with message).
+        Prefer the event stream at tasks/{task_id}/events/ over polling.
+        """
+        project = self.get_object()
+        current = get_status(task_id)
+        if current is None or current['project_id'] != project.id:
+            return Response({'error': 'Unknown task'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(current)
+
+    @action(detail=True, methods=['post'], url_path=r'tasks/(?P<task_id>[-\w]+)/events-token')
+    def events_token(self, request, pk=None, task_id=None):
+        """
+        POST /api/projects/{id}/tasks/{task_id}/events-token/
+        Issue a short-lived token for the task's event stream, which
+        EventSource opens without headers. Returns {token, url, expires_in}.
+        """
+        project = self.get_object()
+        current = get_status(task_id)
+        if current is None or current['project_id'] != project.id:
+            return Response({'error': 'Unknown task'}, status=status.HTTP_404_NOT_FOUND)
+        return _url_token(
+            request, task_events_scope(project.id, task_id), f'/api/projects/{project.id}/tasks/{task_id}/events/'
+        )
+
+    @action(detail=True, methods=['post'], url_path='export-token')
+    def export_token(self, request, pk=None):
+        """
+        POST /api/projects/{id}/export-token/
+        Issue a short-lived token for downloading this project's export from
+        a plain link. Returns {token, url, expires_in}.
+        """
+        project = self.get_object()
+        return _url_token(request, export_scope(project.id), f'/api/projects/{project.id}/export/')
+
     @action(detail=True, methods=['get'])
     def variants(self, request, pk=None):
         """
         GET /api/projects/{id}/variants/
-        Fetch all design variants for a project.
+        Fetch design variants for a project, newest first.
+        Cursor-paginated: follow `next` for older variants.
         """
         project = self.get_object()
-        variants = project.variants.all()
-        serializer = DesignVariantSerializer(variants, many=True)
-        return Response(serializer.data)
+        variants = project.variants.prefetch_related(item_prefetch())
+        return conditional_response(
+            request, project, lambda: self._keyset_page(variants, DesignVariantSerializer)
+        )
 
     @action(detail=True, methods=['get'])
     def versions(self, request, pk=None):
         """
         GET /api/projects/{id}/versions/
         Fetch version history for a project.
+        
+        ?encoding=delta returns the stored keyframes and JSON-patch deltas
+        instead of full snapshots; replay them in `sequence` order.
+        Cursor-paginated: follow `next` for older versions.
         """
         project = self.get_object()
         versions = project.versions.all()
-        serializer = VersionSerializer(versions, many=True)
-        return Response(serializer.data)
+        if request.query_params.get('encoding') == 'delta':
+            serializer_class = VersionDeltaSerializer
+        else:
+            serializer_class = VersionSerializer
+        return conditional_response(
+            request, project, lambda: self._keyset_page(versions, serializer_class)
+        )
+
+    @action(detail=True, methods=['post'], url_path='render')
+    def render_variants(self, request, pk=None):
+        """
+        POST /api/projects/{id}/render/?output=jpeg|png
+        Queue flattened renders of every variant whose current state has
+        not been rendered yet. `current` holds the renders already done.
+        """
+        project = self.get_object()
+        output, error = _render_output(request)
+        if error:
+            return error
+        writebehind.flush(project_ids=[project.id])
+        queued, current = start_project_render(project, output)
+        current = {
+            variant_id: dict(record, url=request.build_absolute_uri(record['url']))
+            for variant_id, record in current.items()
+        }
+        return Response(
+            {'queued': queued, 'current': current},
+            status=status.HTTP_202_ACCEPTED if queued else status.HTTP_200_OK,
+        )
+
+    def _keyset_page(self, queryset, serializer_class):
+        """Serialize one keyset page of a child queryset."""
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        serializer = serializer_class(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
 
 class VariantViewSet(viewsets.ModelViewSet):
@@ -138,11 +498,27 @@ class VariantViewSet(viewsets.ModelViewSet):
     """
     serializer_class = DesignVariantSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         """Return variants for user's projects only."""
-        user_projects = Project.objects.filter(owner=self.request.user)
-        return DesignVariant.objects.filter(project__in=user_projects)
+        return DesignVariant.objects.filter(
+            owner=self.request.user, project__deleted_at__isnull=True
+        ).prefetch_related(item_prefetch())
+
+    @action(detail=True, methods=['post'], url_path='live-token')
+    def live_token(self, request, pk=None):
+        """
+        POST /api/projects/variants/{id}/live-token/
+        Issue a short-lived token for opening the variant's live editing
+        WebSocket, which browsers open without headers.
+        Returns {token, url, expires_in}.
+        """
+        variant = self.get_object()
+        return _url_token(
+            request, collaboration.live_scope(variant.id), f'/api/projects/variants/{variant.id}/live/',
+            scheme='wss' if request.is_secure() else 'ws',
+        )
 
     @action(detail=True, methods=['post'])
     def items(self, request, pk=None):
@@ -159,6 +535,219 @@ class VariantViewSet(viewsets.ModelViewSet):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'], url_path='items/bulk')
+    def bulk_items(self, request, pk=None):
+        """
+        POST /api/variants/{id}/items/bulk/
+        Apply a batch of item creates, updates and deletes in one transaction.
+        
+        Expected: {"create": [{client_id?, name, category, ...}],
+                   "update": [{id, <changed fields>}],
+                   "delete": [id, ...]}
+        """
+        variant = self.get_object()
+        # Buffered edits first, so the batch's writes get later versions
+        writebehind.flush(variant_ids=[variant.id])
+        serializer = ItemInstanceBatchSerializer(data=request.data, context={'variant': variant})
+        serializer.is_valid(raise_exception=True)
+        batch = serializer.validated_data
+        instances = batch['instances']
+
+        new_items = []
+        for data in batch['create']:
+            data = dict(data)
+            data.pop('client_id', None)
+            new_items.append(ItemInstance(variant=variant, **data))
+
+        changed_fields = set()
+        for data in batch['update']:
+            item = instances[data['id']]
+            for field, value in data.items():
+                if field != 'id':
+                    setattr(item, field, value)
+                    changed_fields.add(field)
+            if len(data) > 1:
+                item.version = F('version') + 1
+        updated_items = [instances[data['id']] for data in batch['update']]
+
+        with transaction.atomic():
+            ItemInstance.objects.bulk_create(new_items)
+            if changed_fields:
+                ItemInstance.objects.bulk_update(updated_items, sorted(changed_fields | {'version'}))
+                versions = dict(
+                    ItemInstance.objects.filter(pk__in=[item.pk for item in updated_items]).values_list('id', 'version')
+                )
+                for item in updated_items:
+                    item.version = versions[item.pk]
+            if batch['delete']:
+                ItemInstance.objects.filter(id__in=batch['delete']).delete()
+            # bulk_create and bulk_update send no signals
+            DesignVariant.bump_revision([variant.id])
+            states = [collaboration.item_state(item) for item in new_items + updated_items]
+            transaction.on_commit(lambda: collaboration.publish_items(variant.id, states))
+
+        created = {}
+        for data, item in zip(batch['create'], new_items):
+            if 'client_id' in data:
+                created[data['client_id']] = item.id
+
+        return Response({
+            'created': created,
+            'created_ids': [item.id for item in new_items],
+            'updated': [item.id for item in updated_items],
+            'deleted': batch['delete'],
+        })
+
+    def _coordinates(self, names):
+        """Read float query parameters; returns (values, error_response)."""
+        try:
+            return [float(self.request.query_params[name]) for name in names], None
+        except (KeyError, ValueError):
+            error = f'Numeric query parameters required: {", ".join(names)}'
+            return None, Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'], url_path='items/region')
+    def items_region(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/items/region/?x=&y=&width=&height=
+        Items whose bounding box intersects the rectangle, in canvas order.
+        """
+        variant = self.get_object()
+        values, error = self._coordinates(('x', 'y', 'width', 'height'))
+        if error:
+            return error
+        x, y, width, height = values
+        items = spatial_queries().region(variant.items.order_by('created_at', 'id'), x, y, x + width, y + height)
+        return Response(ItemInstanceSerializer(items, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='items/hit')
+    def items_hit(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/items/hit/?x=&y=
+        Items under the point, topmost (most recently added) first.
+        """
+        variant = self.get_object()
+        values, error = self._coordinates(('x', 'y'))
+        if error:
+            return error
+        items = spatial_queries().hit_test(variant.items.order_by('-created_at', '-id'), *values)
+        return Response(ItemInstanceSerializer(items, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='items/overlaps')
+    def items_overlaps(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/items/overlaps/
+        Pairs of items whose bounding boxes overlap, largest shared area first.
+        """
+        variant = self.get_object()
+        pairs = spatial_queries().overlaps(variant.id)
+        return Response({
+            'count': len(pairs),
+            'pairs': [{'items': [first, second], 'area': area} for first, second, area in pairs],
+        })
+
+    @action(detail=True, methods=['get', 'post'], url_path='render')
+    def render_image(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/render/?output=jpeg|png
+        The flattened render of the variant's current state, or 404.
+
+        POST queues the render (202 with task_id, or null if it is already
+        queued) unless the current state was already rendered (200).
+        """
+        variant = self.get_object()
+        output, error = _render_output(request)
+        if error:
+            return error
+        if writebehind.flush(variant_ids=[variant.id]):
+            variant = self.get_object()  # Reload the written items
+        key, record = rendering.current_render(variant, output)
+        if record is not None:
+            return Response(dict(record, url=request.build_absolute_uri(record['url'])))
+        if request.method == 'GET':
+            return Response({'error': 'Not rendered', 'key': key}, status=status.HTTP_404_NOT_FOUND)
+        task_id = queue_render(variant, output, key)
+        return Response({'status': 'queued', 'key': key, 'task_id': task_id}, status=status.HTTP_202_ACCEPTED)
+
+    def _masked_items(self, variant):
+        """The variant's items that have an inline mask, in canvas order."""
+        return list(variant.items.filter(mask_height__isnull=False).order_by('created_at', 'id'))
+
+    @action(detail=True, methods=['get'])
+    def masks(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/masks/
+        Every item mask of the variant as RLE, in one response.
+        """
+        variant = self.get_object()
+
+        def render():
+            return Response({
+                'items': [{'id': item.id, **masks.payload(item)} for item in self._masked_items(variant)],
+            })
+
+        return conditional_response(request, variant.project, render, variant)
+
+    @action(detail=True, methods=['get'], url_path='masks/labels')
+    def mask_labels(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/masks/labels/
+        The item masks merged into one run-length encoded label map.
+        Run values index `labels` (0 = background, k = labels[k - 1]); later
+        items are drawn over earlier ones. Masks whose size differs from the
+        most common size are listed in `skipped`.
+        """
+        variant = self.get_object()
+
+        def render():
+            items = self._masked_items(variant)
+            if not items:
+                return Response({'size': None, 'labels': [], 'values': '', 'counts': '', 'skipped': []})
+            sizes = [(item.mask_height, item.mask_width) for item in items]
+            height, width = max(set(sizes), key=sizes.count)
+            merged = [item for item in items if (item.mask_height, item.mask_width) == (height, width)]
+            labels = masks.label_map(
+                [masks.decode(bytes(item.mask_rle), height, width) for item in merged], height, width
+            )
+            values, counts = masks.encode_labels(labels)
+            return Response({
+                'size': [height, width],
+                'labels': [item.id for item in merged],
+                'values': masks.to_base64(values),
+                'counts': masks.to_base64(counts),
+                'skipped': [item.id for item in items if item not in merged],
+            })
+
+        return conditional_response(request, variant.project, render, variant)
+
+    @action(detail=True, methods=['get'], url_path='masks/iou')
+    def mask_iou(self, request, pk=None):
+        """
+        GET /api/projects/variants/{id}/masks/iou/
+        Mask intersection over union for every pair of items whose bounding
+        boxes overlap (pairs that do not overlap have an IoU of 0).
+        """
+        variant = self.get_object()
+        items = {item.id: item for item in self._masked_items(variant)}
+        decoded = {}
+
+        def mask(item):
+            if item.id not in decoded:
+                decoded[item.id] = masks.decode(bytes(item.mask_rle), item.mask_height, item.mask_width)
+            return decoded[item.id]
+
+        pairs = []
+        for first, second, _ in spatial_queries().overlaps(variant.id):
+            if first in items and second in items:
+                value = masks.iou(mask(items[first]), mask(items[second]))
+                if value > 0:
+                    pairs.append({'items': [first, second], 'iou': round(value, 4)})
+        pairs.sort(key=lambda pair: -pair['iou'])
+        return Response({
+            'areas': {item_id: item.mask_area for item_id, item in items.items()},
+            'pairs': pairs,
+        })
+
 
 class ItemInstanceViewSet(viewsets.ModelViewSet):
     """
@@ -166,10 +755,84 @@ class ItemInstanceViewSet(viewsets.ModelViewSet):
     """
     serializer_class = ItemInstanceSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         """Return items for user's variants only."""
-        user_projects = Project.objects.filter(owner=self.request.user)
-        user_variants = DesignVariant.objects.filter(project__in=user_projects)
-        return ItemInstance.objects.filter(variant__in=user_variants)
+        return ItemInstance.objects.filter(owner=self.request.user, project__deleted_at__isnull=True)
+
+    def get_object(self):
+        """The item, with its buffered edits (see writebehind.py)."""
+        item = super().get_object()
+        writebehind.overlay([item])
+        return item
+
+    def partial_update(self, request, *args, **kwargs):
+        """
+        PATCH /api/projects/items/{id}/
+        Transform-only edits (e.g. a drag) are written behind: acknowledged
+        once buffered and written to the database in batches. Other edits
+        are written at once.
+        """
+        if not settings.ITEM_WRITE_BEHIND or set(request.data) != {'transform'}:
+            return super().partial_update(request, *args, **kwargs)
+        item = self.get_object()
+        serializer = self.get_serializer(item, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        writebehind.buffer_transform(item, serializer.validated_data['transform'])
+        collaboration.publish_items(item.variant_id, [collaboration.item_state(item)])
+        return Response(self.get_serializer(item).data)
+
+    def perform_update(self, serializer):
+        # Buffered edits first, so this write gets the next version
+        writebehind.flush(item_ids=[serializer.instance.pk])
+        serializer.save()
+
+    @action(detail=True, methods=['get'])
+    def mask(self, request, pk=None):
+        """
+        GET /api/projects/items/{id}/mask/
+        The item's inline segmentation mask as RLE.
+        """
+        item = self.get_object()
+        if item.mask_height is None:
+            return Response({'error': 'Item has no mask'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'id': item.id, **masks.payload(item)})
 
+
+class UploadCallbackView(APIView):
+    """
+    POST /api/projects/uploads/callback/?ticket=...
+    Storage provider notification for a finished direct upload.
+    Authenticated by the provider's signature rather than a user token.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        try:
+            ticket, result = get_upload_backend().parse_callback(request)
+            project_image, created = complete_upload(redeem_ticket(ticket, enforce_ttl=False), result)
+        except InvalidUpload as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'id': project_image.id, 'created': created})
+
+
+class LocalUploadView(APIView):
+    """
+    POST /api/projects/uploads/local/
+    Upload target for LocalUploadBackend (tests and local development).
+    Authorized by the signed token from the upload ticket.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        backend = get_upload_backend()
+        if not isinstance(backend, LocalUploadBackend):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        try:
+            result = backend.receive(request)
+        except InvalidUpload as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
@@ -0,0 +1,297 @@
+"""
+Write-behind buffer for item transform edits.
+
+Dragging an item on the canvas sends a stream of transform-only PATCHes.
+With settings.ITEM_WRITE_BEHIND on, each one is acknowledged once it is
+recorded in a buffer rather than written to the database:
+- edits are coalesced per item: the buffer holds an item's latest
+  transform and the version it would have after its writes
+- flush_item_writes (queued at most once per ITEM_WRITE_BEHIND_SECONDS,
+  and run by celery beat every ITEM_WRITE_BEHIND_SWEEP_SECONDS in case a
+  queued flush was lost) writes every buffered item with one bulk_update
+  and one revision bump per variant, then drops the entries it wrote
+- the buffer indexes item ids by variant and project, so flushing one
+  variant or project reads only its own entries
+- reads overlay buffered state on the rows they load (overlay()), and
+  cached project responses are keyed by the project's buffer stamp too
+  (see caching.py), so clients read their own writes
+- direct writes of an item (other PATCHes, bulk edits, live edits) and
+  readers of the database state (renders, exports) flush first, so
+  versions stay in order
+
+The buffer is chosen with settings.ITEM_WRITE_BUFFER:
+- RedisBuffer: shared by every API process and worker (production)
+- InMemoryBuffer: a single process only (tests, local development)
+"""
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When, prefetch_related_objects
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+
+from .models import DesignVariant, ItemInstance
+from .querysets import item_prefetch
+
+FLUSH_QUEUED_KEY = 'item-writes-flush-queued'
+# Lets a later edit queue the flush again if a queued one was lost
+FLUSH_QUEUED_TTL = 60
+
+
+class InMemoryBuffer:
+    """Process-local buffer for tests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # item id -> (version, data)
+        self._stamps = defaultdict(int)
+        self._variants = defaultdict(set)  # variant id -> item ids
+        self._projects = defaultdict(set)  # project id -> item ids
+
+    def put(self, item_id, base_version, data):
+        """Buffer an edit of an item read at `base_version`; returns the item's new version."""
+        with self._lock:
+            stored = self._entries.get(item_id, (0, None))[0]
+            version = max(stored, base_version) + 1
+            self._entries[item_id] = (version, data)
+            self._stamps[data['project']] += 1
+            self._variants[data['variant']].add(item_id)
+            self._projects[data['project']].add(item_id)
+        return version
+
+    def get(self, item_ids):
+        """{item id: data + version} of the given items' buffered edits."""
+        with self._lock:
+            found = [(item_id, self._entries.get(item_id)) for item_id in item_ids]
+        return {item_id: {**entry[1], 'version': entry[0]} for item_id, entry in found if entry is not None}
+
+    def all(self):
+        with self._lock:
+            return {item_id: {**data, 'version': version} for item_id, (version, data) in self._entries.items()}
+
+    def ids(self, variant_ids=(), project_ids=()):
+        """Ids of the items with buffered edits in the given variants or projects."""
+        with self._lock:
+            found = set()
+            for variant_id in variant_ids:
+                found |= self._variants.get(variant_id, set())
+            for project_id in project_ids:
+                found |= self._projects.get(project_id, set())
+            return found
+
+    def remove(self, entries):
+        """Drop written entries ({item id: entry}) unless edited again since."""
+        with self._lock:
+            for item_id, entry in entries.items():
+                if self._entries.get(item_id, (None,))[0] == entry['version']:
+                    del self._entries[item_id]
+                    self._variants[entry['variant']].discard(item_id)
+                    self._projects[entry['project']].discard(item_id)
+
+    def stamp(self, project_id):
+        """Counter of the edits buffered for a project so far."""
+        with self._lock:
+            return self._stamps[project_id]
+
+
+class RedisBuffer:
+    """Redis hashes shared by every API process and worker."""
+
+    ITEMS = 'item-writes:items'  # item id -> JSON data
+    VERSIONS = 'item-writes:versions'  # item id -> version
+    STAMPS = 'item-writes:stamps'  # project id -> edit counter
+    VARIANT_INDEX = 'item-writes:variant:{}'  # set of item ids
+    PROJECT_INDEX = 'item-writes:project:{}'  # set of item ids
+    PUT_SCRIPT = """
+        local version = math.max(tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or 0), tonumber(ARGV[2])) + 1
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+        redis.call('HSET', KEYS[2], ARGV[1], version)
+        redis.call('HINCRBY', KEYS[3], ARGV[4], 1)
+        redis.call('SADD', KEYS[4], ARGV[1])
+        redis.call('SADD', KEYS[5], ARGV[1])
+        return version
+    """
+    # ARGV: item id, version, variant index key, project index key per entry
+    REMOVE_SCRIPT = """
+        for i = 1, #ARGV, 4 do
+            if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[i + 1] then
+                redis.call('HDEL', KEYS[1], ARGV[i])
+                redis.call('HDEL', KEYS[2], ARGV[i])
+                redis.call('SREM', ARGV[i + 2], ARGV[i])
+                redis.call('SREM', ARGV[i + 3], ARGV[i])
+            end
+        end
+    """
+
+    def __init__(self, url=None):
+        import redis
+
+        self.client = redis.Redis.from_url(url or settings.ITEM_WRITE_BUFFER_URL)
+        self._put = self.client.register_script(self.PUT_SCRIPT)
+        self._remove = self.client.register_script(self.REMOVE_SCRIPT)
+
+    def put(self, item_id, base_version, data):
+        return int(self._put(
+            keys=[
+                self.ITEMS, self.VERSIONS, self.STAMPS,
+                self.VARIANT_INDEX.format(data['variant']), self.PROJECT_INDEX.format(data['project']),
+            ],
+            args=[item_id, base_version, json.dumps(data), data['project']],
+        ))
+
+    def _entries(self, values, versions):
+        return {
+            int(item_id): {**json.loads(value), 'version': int(versions[item_id])}
+            for item_id, value in values.items() if value is not None and versions.get(item_id) is not None
+        }
+
+    def get(self, item_ids):
+        item_ids = [str(item_id) for item_id in item_ids]
+        if not item_ids:
+            return {}
+        pipe = self.client.pipeline()
+        pipe.hmget(self.ITEMS, item_ids)
+        pipe.hmget(self.VERSIONS, item_ids)
+        values, versions = pipe.execute()
+        return self._entries(dict(zip(item_ids, values)), dict(zip(item_ids, versions)))
+
+    def all(self):
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.ITEMS)
+        pipe.hgetall(self.VERSIONS)
+        values, versions = pipe.execute()
+        return self._entries(values, versions)
+
+    def ids(self, variant_ids=(), project_ids=()):
+        keys = [self.VARIANT_INDEX.format(pk) for pk in variant_ids]
+        keys += [self.PROJECT_INDEX.format(pk) for pk in project_ids]
+        return {int(item_id) for item_id in self.client.sunion(keys)} if keys else set()
+
+    def remove(self, entries):
+        if entries:
+            args = []
+            for item_id, entry in entries.items():
+                args += [
+                    item_id, entry['version'],
+                    self.VARIANT_INDEX.format(entry['variant']), self.PROJECT_INDEX.format(entry['project']),
+                ]
+            self._remove(keys=[self.ITEMS, self.VERSIONS], args=args)
+
+    def stamp(self, project_id):
+        return int(self.client.hget(self.STAMPS, project_id) or 0)
+
+
+@lru_cache(maxsize=None)
+def _buffer(path):
+    return import_string(path)()
+
+
+def get_buffer():
+    """Return the configured buffer (one instance per process)."""
+    return _buffer(settings.ITEM_WRITE_BUFFER)
+
+
+def pending(item_ids):
+    """{item id: buffered edit} of the given items."""
+    if not settings.ITEM_WRITE_BEHIND:
+        return {}
+    return get_buffer().get(item_ids)
+
+
+def stamp(project_id):
+    """Changes with every edit buffered for the project (0 if write-behind is off)."""
+    if not settings.ITEM_WRITE_BEHIND:
+        return 0
+    return get_buffer().stamp(project_id)
+
+
+def overlay(items):
+    """Apply buffered edits to ItemInstances loaded from the database, in place."""
+    entries = pending([item.pk for item in items]) if items else {}
+    for item in items:
+        entry = entries.get(item.pk)
+        # An entry already written and overtaken by a direct write is stale
+        if entry is not None and entry['version'] > item.version:
+            item.transform, item.version = entry['transform'], entry['version']
+    return items
+
+
+def overlay_variants(variants):
+    """
+    overlay() for the items of many variants with one buffer read. Items
+    not prefetched yet are loaded first, so serializers reuse them.
+    """
+    prefetch_related_objects(variants, item_prefetch())
+    overlay([item for variant in variants for item in variant.items.all()])
+    return variants
+
+
+def overlay_rows(rows):
+    """overlay() for .values() rows with id, transform and version."""
+    entries = pending([row['id'] for row in rows]) if rows else {}
+    for row in rows:
+        entry = entries.get(row['id'])
+        if entry is not None and entry['version'] > row['version']:
+            row['transform'], row['version'] = entry['transform'], entry['version']
+    return rows
+
+
+def buffer_transform(item, transform):
+    """
+    Record a transform edit of `item` (as read, with overlay()) and queue
+    the flush. Updates the item's transform and version in place.
+    """
+    from .tasks import flush_item_writes
+
+    data = {'variant': item.variant_id, 'project': item.project_id, 'transform': transform}
+    item.version = get_buffer().put(item.pk, item.version, data)
+    item.transform = transform
+    if cache.add(FLUSH_QUEUED_KEY, 1, timeout=FLUSH_QUEUED_TTL):
+        flush_item_writes.apply_async(countdown=settings.ITEM_WRITE_BEHIND_SECONDS)
+    return item
+
+
+def flush(item_ids=None, variant_ids=None, project_ids=None):
+    """
+    Write buffered edits to the database: all of them, or those of the
+    given items, variants or projects. Returns how many items were written.
+    """
+    if not settings.ITEM_WRITE_BEHIND:
+        return 0
+    buffer = get_buffer()
+    if item_ids is None and variant_ids is None and project_ids is None:
+        entries = buffer.all()
+    else:
+        if item_ids is None:
+            item_ids = buffer.ids(variant_ids or (), project_ids or ())
+        entries = buffer.get(item_ids)
+    if variant_ids is not None:
+        variant_ids = set(variant_ids)
+        entries = {item_id: entry for item_id, entry in entries.items() if entry['variant'] in variant_ids}
+    if project_ids is not None:
+        project_ids = set(project_ids)
+        entries = {item_id: entry for item_id, entry in entries.items() if entry['project'] in project_ids}
+    if not entries:
+        return 0
+
+    items = []
+    for item_id, entry in sorted(entries.items()):
+        item = ItemInstance(pk=item_id)
+        # Never undo a direct write that got in between
+        item.transform = Case(
+            When(Q(version__lt=entry['version']), then=Value(entry['transform'], output_field=models.JSONField())),
+            default=F('transform'),
+        )
+        item.version = Greatest(F('version'), Value(entry['version']), output_field=models.PositiveIntegerField())
+        items.append(item)
+    with transaction.atomic():
+        ItemInstance.objects.bulk_update(items, ['transform', 'version'])
+        # bulk_update sends no signals
+        DesignVariant.bump_revision({entry['variant'] for entry in entries.values()})
+        transaction.on_commit(lambda: buffer.remove(entries))
+    return len(entries)
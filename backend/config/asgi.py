@@ -1,10 +1,36 @@
 """
 ASGI config for DreamSpace project.
+
+Serves the regular API plus the async streaming endpoints (server-sent
+events for task progress, project export archives) and the live variant
+editing WebSocket. Run with an ASGI server, e.g.:
+    uvicorn config.asgi:application --host 0.0.0.0 --port 8000
 """
 import os
+import re
+
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from apps.projects.collaboration import variant_socket  # noqa: E402 (needs the app registry)
+
+# Django only serves HTTP; WebSocket paths are routed here
+websocket_routes = [
+    (re.compile(r'^/api/projects/variants/(?P<pk>\d+)/live/$'), variant_socket),
+]
+
 
+async def application(scope, receive, send):
+    if scope['type'] != 'websocket':
+        return await django_application(scope, receive, send)
+    for pattern, handler in websocket_routes:
+        match = pattern.match(scope['path'])
+        if match:
+            kwargs = {name: int(value) for name, value in match.groupdict().items()}
+            return await handler(scope, receive, send, **kwargs)
+    # Refuse the handshake
+    await receive()
+    await send({'type': 'websocket.close'})
@@ -25,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party apps
     'rest_framework',
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
     # Local apps
     'apps.users',
     'apps.projects',
+    'apps.catalog',
 ]
 
 MIDDLEWARE = [
@@ -124,6 +126,19 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# Serve project list counts from the denormalized counter columns instead
+# of COUNT subqueries.
+PROJECT_LIST_USE_COUNTERS = config('PROJECT_LIST_USE_COUNTERS', default=False, cast=bool)
+
+# Latest versions listed in the project detail (the full history is
+# paginated at /api/projects/{id}/versions/)
+PROJECT_DETAIL_VERSIONS = config('PROJECT_DETAIL_VERSIONS', default=10, cast=int)
+
+# Version history: a full snapshot keyframe every N versions, JSON-patch
+# deltas in between; payloads larger than the threshold (bytes) are zlib'd.
+VERSION_KEYFRAME_INTERVAL = config('VERSION_KEYFRAME_INTERVAL', default=20, cast=int)
+VERSION_COMPRESS_THRESHOLD = config('VERSION_COMPRESS_THRESHOLD', default=2048, cast=int)
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -150,6 +165,109 @@ CLOUDINARY_CONFIG = {
     'api_secret': config('CLOUDINARY_API_SECRET', default=''),
 }
 
+# Direct-to-storage uploads: backend class and signed ticket lifetime (seconds).
+# Use apps.projects.storage.LocalUploadBackend for tests and offline development.
+UPLOAD_BACKEND = config('UPLOAD_BACKEND', default='apps.projects.storage.CloudinaryUploadBackend')
+UPLOAD_TICKET_TTL = config('UPLOAD_TICKET_TTL', default=600, cast=int)
+# Hosts besides the upload backend's own that stored files may be read back
+# from (e.g. vendor CDNs serving catalog models); everything else is refused.
+UPLOAD_FETCH_HOSTS = config('UPLOAD_FETCH_HOSTS', default='', cast=Csv())
+# Reuse an owner's stored photo when a new upload's perceptual hash differs
+# by at most this many bits (0 = exact perceptual match, -1 = content hash only;
+# at most 3, see models.PHASH_BANDS). Similar photos of one room can be a few
+# bits apart, so anything above 0 may reuse a different photo.
+UPLOAD_DUPLICATE_DISTANCE = config('UPLOAD_DUPLICATE_DISTANCE', default=0, cast=int)
+
+# Cache (task status, shared across API processes and workers)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default='redis://redis:6379/1'),
+    }
+}
+# Cached project detail/variants/versions responses (see projects/caching.py):
+# cache alias and lifetime in seconds. Entries are keyed by project revision,
+# so writes never serve stale data; the TTL only bounds memory use.
+RESPONSE_CACHE_ALIAS = config('RESPONSE_CACHE_ALIAS', default='default')
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=300, cast=int)
+
+# Flattened variant renders (see apps/projects/rendering.py): how long a
+# render's URL is remembered by state hash, and how long a queued render
+# blocks queuing the same state again.
+RENDER_CACHE_TTL = config('RENDER_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+RENDER_QUEUED_TTL = config('RENDER_QUEUED_TTL', default=600, cast=int)
+
+# Project archives (see apps/projects/archive.py): rows read per database
+# fetch, and how many assets are downloaded or uploaded at once.
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=500, cast=int)
+EXPORT_FETCH_CONCURRENCY = config('EXPORT_FETCH_CONCURRENCY', default=4, cast=int)
+
+# Deleted projects are purged in the background (see apps/projects/purge.py),
+# this many rows per DELETE statement.
+PURGE_BATCH_SIZE = config('PURGE_BATCH_SIZE', default=1000, cast=int)
+
+# Catalog search (see apps/catalog/search.py): text searches page through at
+# most this many matches, and a search's matches and facet counts are cached
+# for this long (seconds). Precomputed facet counts are invalidated on change.
+CATALOG_SEARCH_CANDIDATES = config('CATALOG_SEARCH_CANDIDATES', default=2000, cast=int)
+CATALOG_SEARCH_CACHE_TTL = config('CATALOG_SEARCH_CACHE_TTL', default=300, cast=int)
+# Vendor feed ingest (see apps/catalog/ingest.py): rows diffed and written per
+# transaction, the batch writes from which PostgreSQL loads through COPY, and
+# how long (seconds) a vendor's running ingest blocks starting another.
+CATALOG_INGEST_BATCH_SIZE = config('CATALOG_INGEST_BATCH_SIZE', default=5000, cast=int)
+CATALOG_INGEST_COPY_ROWS = config('CATALOG_INGEST_COPY_ROWS', default=1000, cast=int)
+CATALOG_INGEST_LOCK_TTL = config('CATALOG_INGEST_LOCK_TTL', default=6 * 3600, cast=int)
+# Product 3D models (see apps/catalog/lods.py): how long a file's analysis is
+# cached by content hash, how long a queued analysis blocks queuing the same
+# URL again (seconds), and the largest model file analysed (bytes).
+MODEL_ANALYSIS_CACHE_TTL = config('MODEL_ANALYSIS_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+MODEL_ANALYSIS_QUEUED_TTL = config('MODEL_ANALYSIS_QUEUED_TTL', default=3600, cast=int)
+MODEL_MAX_BYTES = config('MODEL_MAX_BYTES', default=200 * 1024 * 1024, cast=int)
+
+# Live updates: pub/sub broker for event streams.
+# Use apps.projects.realtime.InMemoryBroker for tests (single process only).
+REALTIME_BROKER = config('REALTIME_BROKER', default='apps.projects.realtime.RedisBroker')
+REALTIME_REDIS_URL = config('REALTIME_REDIS_URL', default='redis://redis:6379/2')
+SSE_HEARTBEAT_SECONDS = 15
+# Lifetime (seconds) of the signed tokens in export links, event stream and
+# live socket URLs (see apps/projects/streams.py); they are only checked
+# when the URL is opened.
+URL_TOKEN_TTL = config('URL_TOKEN_TTL', default=60, cast=int)
+# Live variant editing (see apps/projects/collaboration.py): edits are written
+# and updates sent once per frame window (milliseconds); operations allowed
+# per client message.
+LIVE_FRAME_MS = config('LIVE_FRAME_MS', default=50, cast=int)
+LIVE_MAX_OPS = config('LIVE_MAX_OPS', default=500, cast=int)
+TASK_STATUS_TTL = 60 * 60 * 24
+
+# Write-behind item transform edits (see apps/projects/writebehind.py), off
+# by default: transform-only PATCHes are buffered and written in batches at
+# most every ITEM_WRITE_BEHIND_SECONDS. Buffered edits live only in the
+# buffer until then, so the Redis instance should persist its data, and
+# celery beat must run to sweep the buffer every ITEM_WRITE_BEHIND_SWEEP_SECONDS
+# in case a queued flush is lost.
+# Use apps.projects.writebehind.InMemoryBuffer for tests (single process only).
+ITEM_WRITE_BEHIND = config('ITEM_WRITE_BEHIND', default=False, cast=bool)
+ITEM_WRITE_BEHIND_SECONDS = config('ITEM_WRITE_BEHIND_SECONDS', default=1.0, cast=float)
+ITEM_WRITE_BEHIND_SWEEP_SECONDS = config('ITEM_WRITE_BEHIND_SWEEP_SECONDS', default=30.0, cast=float)
+ITEM_WRITE_BUFFER = config('ITEM_WRITE_BUFFER', default='apps.projects.writebehind.RedisBuffer')
+ITEM_WRITE_BUFFER_URL = config('ITEM_WRITE_BUFFER_URL', default='redis://redis:6379/3')
+
+# Variant generation dedup: reuse finished results for this long (seconds);
+# in-flight claims expire after the inflight TTL in case a worker dies.
+GENERATION_CACHE_TTL = config('GENERATION_CACHE_TTL', default=60 * 60 * 24, cast=int)
+GENERATION_INFLIGHT_TTL = config('GENERATION_INFLIGHT_TTL', default=60 * 15, cast=int)
+# Queued/running generations allowed per user, and options per batch request
+GENERATION_MAX_CONCURRENT_PER_USER = config('GENERATION_MAX_CONCURRENT_PER_USER', default=8, cast=int)
+GENERATION_BATCH_MAX = config('GENERATION_BATCH_MAX', default=6, cast=int)
+# Token-bucket admission for generation requests (tokens = variants), kept
+# in their own Redis database (see apps/projects/throttling.py).
+# Use apps.projects.throttling.CacheBuckets for tests (single process only).
+GENERATION_BUCKET_CAPACITY = config('GENERATION_BUCKET_CAPACITY', default=12, cast=int)
+GENERATION_BUCKET_REFILL_PER_MINUTE = config('GENERATION_BUCKET_REFILL_PER_MINUTE', default=6, cast=float)
+GENERATION_BUCKET_STORE = config('GENERATION_BUCKET_STORE', default='apps.projects.throttling.RedisBuckets')
+GENERATION_BUCKET_REDIS_URL = config('GENERATION_BUCKET_REDIS_URL', default='redis://redis:6379/4')
+
 # Celery Configuration
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://redis:6379/0')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://redis:6379/0')
@@ -158,3 +276,40 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Queues: interactive (short tasks a user is waiting on; the default),
+# bulk (long AI generation and 3D model processing) and maintenance
+# (housekeeping). Each has its own workers in docker-compose.yml, so quick
+# jobs never wait behind generations.
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_ROUTES = {
+    'apps.projects.tasks.generate_variant': {'queue': 'bulk'},
+    'apps.projects.tasks.generate_option': {'queue': 'bulk'},
+    'apps.projects.tasks.store_batch_variants': {'queue': 'interactive'},
+    'apps.projects.tasks.generate_derivatives': {'queue': 'interactive'},
+    'apps.projects.tasks.render_variant': {'queue': 'interactive'},
+    'apps.projects.tasks.flush_item_writes': {'queue': 'interactive'},
+    'apps.projects.tasks.purge_project': {'queue': 'maintenance'},
+    'apps.catalog.tasks.ingest_feed': {'queue': 'maintenance'},
+    'apps.catalog.tasks.analyze_model': {'queue': 'bulk'},
+}
+# Redis priorities: 0 is served first (see generation.fair_priority)
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Long tasks: reserve one task at a time and acknowledge after completion,
+# so a busy worker does not hoard queued generations.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+
+# Periodic tasks, run by the beat service in docker-compose.yml
+CELERY_BEAT_SCHEDULE = {
+    'flush-item-writes': {
+        'task': 'apps.projects.tasks.flush_item_writes',
+        'schedule': ITEM_WRITE_BEHIND_SWEEP_SECONDS,
+    },
+}
+
@@ -31,6 +31,7 @@ urlpatterns = [
     # App URLs
     path('api/users/', include('apps.users.urls')),
     path('api/projects/', include('apps.projects.urls')),
+    path('api/catalog/', include('apps.catalog.urls')),
 ]
 
 # Serve media files in development
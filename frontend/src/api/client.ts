@@ -9,7 +9,16 @@ import type {
   User, 
   Project, 
   DesignVariant,
-  ItemInstance 
+  ItemInstance,
+  Mask,
+  MaskLabelMap,
+  RenderOutput,
+  VariantRender,
+  Product,
+  ProductFacets,
+  ProductModel,
+  ProductSearch,
+  Vendor
 } from '../types'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
@@ -136,13 +145,41 @@ export const projectsAPI = {
     return response.data
   },
 
-  getVariants: async (projectId: number): Promise<DesignVariant[]> => {
-    const response = await api.get(`/projects/${projectId}/variants/`)
+  getTaskStatus: async (projectId: number, taskId: string) => {
+    const response = await api.get(`/projects/${projectId}/tasks/${taskId}/`)
     return response.data
   },
 
-  getVersions: async (projectId: number) => {
-    const response = await api.get(`/projects/${projectId}/versions/`)
+  // Server-sent progress events for a generation task (open with EventSource right
+  // away, and fetch a new URL to reconnect: the signed token expires after about a minute)
+  taskEventsUrl: async (projectId: number, taskId: string) => {
+    const response = await api.post(`/projects/${projectId}/tasks/${taskId}/events-token/`)
+    const token = encodeURIComponent(response.data.token)
+    return `${API_URL}/api/projects/${projectId}/tasks/${taskId}/events/?token=${token}`
+  },
+
+  // Streamed ZIP download of the whole project (use as a link href right away:
+  // the signed token in the URL expires after about a minute)
+  exportUrl: async (projectId: number, includeAssets = true) => {
+    const response = await api.post(`/projects/${projectId}/export-token/`)
+    const assets = includeAssets ? '' : '&assets=0'
+    return `${API_URL}/api/projects/${projectId}/export/?token=${encodeURIComponent(response.data.token)}${assets}`
+  },
+
+  // Cursor-paginated: pass the previous response's `next` cursor for older rows
+  getVariants: async (projectId: number, cursor?: string): Promise<DesignVariant[]> => {
+    const response = await api.get(`/projects/${projectId}/variants/`, { params: { cursor } })
+    return response.data.results
+  },
+
+  getVersions: async (projectId: number, cursor?: string) => {
+    const response = await api.get(`/projects/${projectId}/versions/`, { params: { cursor } })
+    return response.data.results
+  },
+
+  // Queue flattened renders of every variant that needs one
+  renderProject: async (projectId: number, output: RenderOutput = 'jpeg') => {
+    const response = await api.post(`/projects/${projectId}/render/`, null, { params: { output } })
     return response.data
   },
 }
@@ -162,6 +199,122 @@ export const variantsAPI = {
   deleteItem: async (itemId: number) => {
     await api.delete(`/projects/items/${itemId}/`)
   },
+
+  // WebSocket for live editing: receives LiveMessage, send {type: 'ops', ops: LiveOp[]}.
+  // Connect right away and fetch a new URL to reconnect (the token expires after about a minute)
+  liveUrl: async (variantId: number) => {
+    const response = await api.post(`/projects/variants/${variantId}/live-token/`)
+    const base = API_URL.replace(/^http/, 'ws')
+    return `${base}/api/projects/variants/${variantId}/live/?token=${encodeURIComponent(response.data.token)}`
+  },
+
+  // Save many item edits in one request; returns {created: {client_id: id}, ...}
+  bulkItems: async (
+    variantId: number,
+    batch: {
+      create?: (Partial<ItemInstance> & { client_id?: string })[]
+      update?: (Partial<ItemInstance> & { id: number })[]
+      delete?: number[]
+    }
+  ) => {
+    const response = await api.post(`/projects/variants/${variantId}/items/bulk/`, batch)
+    return response.data
+  },
+
+  // Spatial queries over a variant's item bounding boxes
+  itemsInRegion: async (
+    variantId: number,
+    region: { x: number; y: number; width: number; height: number }
+  ): Promise<ItemInstance[]> => {
+    const response = await api.get(`/projects/variants/${variantId}/items/region/`, { params: region })
+    return response.data
+  },
+
+  // Items under a point, topmost first
+  hitTest: async (variantId: number, x: number, y: number): Promise<ItemInstance[]> => {
+    const response = await api.get(`/projects/variants/${variantId}/items/hit/`, { params: { x, y } })
+    return response.data
+  },
+
+  getOverlaps: async (variantId: number) => {
+    const response = await api.get(`/projects/variants/${variantId}/items/overlaps/`)
+    return response.data
+  },
+
+  // Inline RLE segmentation masks
+  getItemMask: async (itemId: number): Promise<Mask> => {
+    const response = await api.get(`/projects/items/${itemId}/mask/`)
+    return response.data
+  },
+
+  getVariantMasks: async (variantId: number): Promise<{ items: Mask[] }> => {
+    const response = await api.get(`/projects/variants/${variantId}/masks/`)
+    return response.data
+  },
+
+  getMaskLabels: async (variantId: number): Promise<MaskLabelMap> => {
+    const response = await api.get(`/projects/variants/${variantId}/masks/labels/`)
+    return response.data
+  },
+
+  getMaskIou: async (variantId: number) => {
+    const response = await api.get(`/projects/variants/${variantId}/masks/iou/`)
+    return response.data
+  },
+
+  // Flattened server-side renders (202 while queued)
+  renderVariant: async (variantId: number, output: RenderOutput = 'jpeg') => {
+    const response = await api.post(`/projects/variants/${variantId}/render/`, null, { params: { output } })
+    return response.data
+  },
+
+  getVariantRender: async (variantId: number, output: RenderOutput = 'jpeg'): Promise<VariantRender> => {
+    const response = await api.get(`/projects/variants/${variantId}/render/`, { params: { output } })
+    return response.data
+  },
+}
+
+// Catalog API
+const searchParams = ({ category, vendor, ...search }: ProductSearch) => ({
+  ...search,
+  category: category?.join(','),
+  vendor: vendor?.join(','),
+})
+
+export const catalogAPI = {
+  // Cursor-paginated: pass the previous response's `next` cursor for the next page
+  searchProducts: async (
+    search: ProductSearch = {},
+    cursor?: string
+  ): Promise<{ next: string | null; results: Product[] }> => {
+    const response = await api.get('/catalog/products/', { params: { ...searchParams(search), cursor } })
+    return response.data
+  },
+
+  // Fetch alongside the first page; counts for the same search
+  getProductFacets: async (search: ProductSearch = {}): Promise<ProductFacets> => {
+    const response = await api.get('/catalog/products/facets/', { params: searchParams(search) })
+    return response.data
+  },
+
+  getProduct: async (id: number): Promise<Product> => {
+    const response = await api.get(`/catalog/products/${id}/`)
+    return response.data
+  },
+
+  // Smallest model with at least this many triangles and texture pixels
+  getProductModel: async (
+    id: number,
+    needs: { triangles?: number; texture?: number } = {}
+  ): Promise<ProductModel> => {
+    const response = await api.get(`/catalog/products/${id}/model/`, { params: needs })
+    return response.data
+  },
+
+  listVendors: async (): Promise<Vendor[]> => {
+    const response = await api.get('/catalog/vendors/')
+    return response.data
+  },
 }
 
 export default api
@@ -155,7 +155,7 @@ export default function RightPanel() {
                     className="border border-gray-200 rounded-lg overflow-hidden hover:border-primary-400 transition-colors cursor-pointer"
                   >
                     <img
-                      src={variant.image_url}
+                      src={variant.srcset?.thumb ?? variant.image_url}
                       alt="Variant"
                       className="w-full h-32 object-cover"
                     />
@@ -100,9 +100,9 @@ export default function Dashboard() {
                 className="bg-white rounded-lg shadow hover:shadow-lg transition-shadow cursor-pointer overflow-hidden"
               >
                 <div className="h-48 bg-gradient-to-br from-primary-100 to-primary-200 flex items-center justify-center">
-                  {project.images && project.images.length > 0 ? (
+                  {project.cover ? (
                     <img
-                      src={project.images[0].image_url}
+                      src={project.cover.thumb ?? project.cover.original}
                       alt={project.name}
                       className="w-full h-full object-cover"
                     />
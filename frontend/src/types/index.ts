@@ -17,7 +17,9 @@ export interface Project {
   owner_username: string
   images: ProjectImage[]
   variants: DesignVariant[]
-  versions: Version[]
+  // Latest versions only, without snapshots (see getVersions for the history)
+  versions: VersionSummary[]
+  cover?: Srcset | null
   created_at: string
   updated_at: string
 }
@@ -27,30 +29,62 @@ export interface ProjectImage {
   project: number
   type: 'original' | 'inspo' | 'generated'
   image_url: string
+  srcset: Srcset
   metadata: Record<string, any>
   created_at: string
 }
 
+// Resized copies of an image; derivatives appear once rendered
+export interface Srcset {
+  original: string
+  thumb?: string
+  medium?: string
+  webp?: string
+}
+
 export interface DesignVariant {
   id: number
   project: number
   image_url: string
+  srcset: Srcset
   metadata: Record<string, any>
   items: ItemInstance[]
   created_at: string
 }
 
+// Run-length encoded segmentation mask: column-major runs starting with
+// background, as base64 LEB128 varints (see backend apps/projects/masks.py)
+export interface MaskSummary {
+  size: [number, number] // [height, width]
+  area: number
+}
+
+export interface Mask extends MaskSummary {
+  id: number
+  counts: string
+}
+
+export interface MaskLabelMap {
+  size: [number, number] | null
+  labels: number[]
+  values: string
+  counts: string
+  skipped: number[]
+}
+
 export interface ItemInstance {
   id: number
   variant: number
   name: string
   category: string
+  product?: number | null
   bbox: {
     x: number
     y: number
     width: number
     height: number
   }
+  mask?: MaskSummary | null
   mask_url?: string
   transform: {
     x?: number
@@ -59,9 +93,137 @@ export interface ItemInstance {
     scaleX?: number
     scaleY?: number
   }
+  // Goes up with every write; live edits are based on it
+  version: number
   created_at: string
 }
 
+// Live editing messages (see variantsAPI.liveUrl)
+export type LiveItem = Pick<ItemInstance, 'id' | 'version' | 'name' | 'category' | 'bbox' | 'transform'> & {
+  product: number | null
+}
+
+export interface LiveOp {
+  id: number
+  version: number
+  transform?: ItemInstance['transform']
+  bbox?: ItemInstance['bbox']
+}
+
+export type LiveMessage =
+  | { type: 'snapshot'; session: string; items: LiveItem[] }
+  | { type: 'items'; items: (LiveItem & { session: string | null })[]; deleted: number[] }
+  | { type: 'rejected'; items: (LiveItem | { id: number; deleted: true })[] }
+  | { type: 'error'; error: string }
+
+export interface Vendor {
+  id: number
+  name: string
+  website: string
+  logo_url: string
+}
+
+export interface Product {
+  id: number
+  vendor: number
+  vendor_name: string
+  sku: string
+  name: string
+  description: string
+  category: string
+  style: string
+  model_url: string
+  // Null until the model has been analysed
+  model: ProductModelInfo | null
+  thumbnail_url: string
+  dimensions: {
+    width: number | null
+    depth: number | null
+    height: number | null
+  }
+  color_options: string[]
+  price: string
+  in_stock: boolean
+  created_at: string
+  updated_at: string
+}
+
+// Bounding box in scene units (metres), node transforms applied
+export interface ModelBox {
+  min: [number, number, number]
+  max: [number, number, number]
+  size: [number, number, number]
+}
+
+export interface ModelLod {
+  name: string
+  url: string
+  triangles: number
+  max_texture: number
+  bytes: number
+}
+
+export interface ProductModelInfo {
+  bbox: ModelBox | null
+  triangles: number
+  max_texture: number
+  bytes: number
+  lods: ModelLod[]
+}
+
+// The model version picked for a scene (see catalogAPI.getProductModel)
+export type ProductModel =
+  | (ModelLod & { bbox: ModelBox | null; analyzed: true })
+  | { name: 'original'; url: string; analyzed: false }
+
+export type ProductSort = 'relevance' | 'name' | 'price' | '-price'
+
+// Ranges are min <= value < max, matching the facet buckets
+export interface ProductSearch {
+  q?: string
+  category?: string[]
+  vendor?: number[]
+  min_price?: number
+  max_price?: number
+  min_width?: number
+  max_width?: number
+  min_depth?: number
+  max_depth?: number
+  min_height?: number
+  max_height?: number
+  in_stock?: boolean
+  sort?: ProductSort
+}
+
+export interface FacetValue {
+  value: string
+  count: number
+}
+
+export interface RangeFacetValue extends FacetValue {
+  min: number
+  max: number | null
+}
+
+export interface ProductFacets {
+  category: FacetValue[]
+  vendor: { value: number; name: string; count: number }[]
+  price: RangeFacetValue[]
+  width: RangeFacetValue[]
+  depth: RangeFacetValue[]
+  height: RangeFacetValue[]
+}
+
+export type RenderOutput = 'jpeg' | 'png'
+
+export interface VariantRender {
+  key: string
+  url: string
+  width: number
+  height: number
+  format: string
+}
+
 export interface Version {
   id: number
   project: number
@@ -70,6 +232,13 @@ export interface Version {
   created_at: string
 }
 
+export interface VersionSummary {
+  id: number
+  sequence: number
+  prompt: string
+  created_at: string
+}
+
 export interface CanvasItem {
   id: string
   type: 'image' | 'rect' | 'text'